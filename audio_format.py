@@ -0,0 +1,131 @@
+"""Audio device capability probing and stream format negotiation.
+
+Finding a rate two devices agree on by opening and closing streams takes
+seconds on some drivers. PortAudio can answer the question without opening
+anything (Pa_IsFormatSupported, exposed by sounddevice as
+check_input_settings/check_output_settings), so CapabilityProbe asks it
+once per device and keeps the answer until `clear()`, which a device rescan
+calls. `negotiate` then picks rates, channels, block sizes and latencies
+for an input/output pair in one step. When the two devices have no good
+rate in common each keeps its best one and the ring buffer resamples
+between them.
+"""
+from collections import namedtuple
+
+from audio_mix import MAX_INPUTS
+
+STANDARD_RATES = [48000, 44100, 32000, 22050, 16000]
+
+# Callback period. 10 ms keeps passthrough latency low without waking the
+# Python callbacks more often than they can reliably keep up with.
+BLOCK_SECONDS = 0.01
+
+# `channels` is the program channel count (see audio_mix); the input device
+# is opened with all its channels up to MAX_INPUTS and the output device
+# with as many program channels as it can play.
+AudioFormat = namedtuple("AudioFormat", "input_rate output_rate input_channels channels output_channels "
+                                        "input_blocksize output_blocksize input_latency output_latency")
+
+
+class CapabilityProbe:
+    """Per-device supported rates, probed once and cached.
+
+    `caps` returns a dict with "rates" (supported rates, preferred first),
+    "max_channels", "default_rate" and "latency" (the device's default low
+    latency in seconds, or None). Rates are probed with as many channels
+    as the stream will be opened with for `channels` program channels (see
+    `stream_channels`), since drivers may support a rate in stereo and not
+    with all their channels. Devices are keyed by index, name and host API,
+    so a device that moved index after a rescan is probed again.
+    """
+
+    def __init__(self, rates=STANDARD_RATES):
+        self.rates = list(rates)
+        self.probes = 0
+        self._cache = {}
+
+    def caps(self, backend, info, kind, channels=2):
+        channels = stream_channels(info, kind, channels)
+        key = (kind, info["index"], info["name"], info.get("hostapi"), channels)
+        caps = self._cache.get(key)
+        if caps is None:
+            caps = self._cache[key] = self._probe(backend, info, kind, channels)
+        return caps
+
+    def _probe(self, backend, info, kind, channels):
+        check = getattr(backend, f"check_{kind}_settings")
+        default = int(info.get("default_samplerate") or 0)
+        candidates = self.rates + ([default] if default and default not in self.rates else [])
+        rates = []
+        for rate in candidates:
+            try:
+                check(device=info["index"], samplerate=rate, channels=channels, dtype="float32")
+            except Exception:
+                continue
+            rates.append(rate)
+        self.probes += 1
+        return {
+            "rates": rates,
+            "max_channels": int(info[f"max_{kind}_channels"]),
+            "default_rate": default,
+            "latency": info.get(f"default_low_{kind}_latency"),
+        }
+
+    def clear(self):
+        self._cache.clear()
+
+
+def stream_channels(info, kind, channels=2):
+    """Channels a stream on the device is opened with for `channels` program channels."""
+    return min(MAX_INPUTS if kind == "input" else channels, int(info[f"max_{kind}_channels"]))
+
+
+def _best_rate(caps, preferred):
+    for rate in preferred:
+        if rate in caps["rates"]:
+            return rate
+    # Nothing standard, e.g. a 96 kHz-only interface: use what it has.
+    return caps["rates"][0] if caps["rates"] else None
+
+
+def negotiate(input_caps, output_caps, channels=2, input_rate=None, output_rate=None, preferred=STANDARD_RATES):
+    """Stream format for an input/output pair, or None if one has no usable rate.
+
+    A rate both devices support is used for both unless it is lower than
+    what the weaker device could do on its own; then each runs at its best
+    rate and the difference is resampled. `input_rate`/`output_rate` pin a
+    side that is already running, so switching the other device does not
+    reopen it. `channels` is the program channel count, which does not
+    depend on the devices.
+    """
+    input_channels = min(MAX_INPUTS, input_caps["max_channels"])
+    output_channels = min(channels, output_caps["max_channels"])
+    if input_channels < 1 or output_channels < 1:
+        return None
+    if input_rate is not None and input_rate not in input_caps["rates"]:
+        input_rate = None
+    if output_rate is not None and output_rate not in output_caps["rates"]:
+        output_rate = None
+    best_in = input_rate or _best_rate(input_caps, preferred)
+    best_out = output_rate or _best_rate(output_caps, preferred)
+    if best_in is None or best_out is None:
+        return None
+    if input_rate is None and output_rate is None:
+        common = [r for r in preferred if r in input_caps["rates"] and r in output_caps["rates"]]
+        if common and common[0] >= min(best_in, best_out):
+            best_in = best_out = common[0]
+    elif input_rate is None and best_out in input_caps["rates"]:
+        best_in = best_out
+    elif output_rate is None and best_in in output_caps["rates"]:
+        best_out = best_in
+    return AudioFormat(
+        input_rate=best_in,
+        output_rate=best_out,
+        input_channels=input_channels,
+        channels=channels,
+        output_channels=output_channels,
+        input_blocksize=round(best_in * BLOCK_SECONDS),
+        output_blocksize=round(best_out * BLOCK_SECONDS),
+        input_latency=input_caps["latency"] or "low",
+        output_latency=output_caps["latency"] or "low",
+    )
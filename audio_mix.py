@@ -0,0 +1,206 @@
+"""Routing and gain matrix from input device channels to program channels.
+
+Program audio is what the PGM sink embeds (2, 8 or 16 channels, in pairs
+as on an SDI link) and what the output device monitors (its first
+channels). It is mixed from the input device's channels by one matrix
+multiply per block: program = input @ gains, gains being (inputs, program
+channels) with routing, input gains and output gains folded together.
+
+MixMatrix holds the settings. Any thread may change them; each change
+builds a new gains array and replaces the old one whole, so the audio
+callback never sees a half-written matrix. Each input stream has its own
+MatrixMixer which, on seeing new gains, ramps every cell from its current
+value over RAMP_SECONDS instead of jumping, so gain changes and re-routing
+make no zipper noise or clicks. Mixers only touch arrays allocated up front.
+"""
+import threading
+
+import numpy as np
+
+# Program channel counts offered for embedding.
+PROGRAM_CHANNELS = (2, 8, 16)
+
+# Input channels a matrix has rows for; a device with more only has its
+# first MAX_INPUTS opened.
+MAX_INPUTS = 16
+
+RAMP_SECONDS = 0.02
+
+
+def db_to_gain(db):
+    return 0.0 if db is None or db == -float("inf") else 10 ** (db / 20)
+
+
+class MixMatrix:
+    """Routes and gains from MAX_INPUTS input channels to `outputs` program channels.
+
+    `routes[i, o]` is the gain from input i to program channel o (0 for not
+    routed); `input_gains` and `output_gains` scale whole rows and columns.
+    `gains` is their product, the matrix mixers apply. `custom` is False
+    until a route is set by hand, so the default routing can follow the
+    input device (see `default_routes`).
+    """
+
+    def __init__(self, outputs=2, inputs=MAX_INPUTS):
+        if outputs not in PROGRAM_CHANNELS:
+            raise ValueError(f"Program audio must have one of {PROGRAM_CHANNELS} channels, not {outputs}")
+        self.inputs = inputs
+        self.outputs = outputs
+        self.routes = np.zeros((inputs, outputs), dtype=np.float32)
+        self.input_gains = np.ones(inputs, dtype=np.float32)
+        self.output_gains = np.ones(outputs, dtype=np.float32)
+        self.custom = False
+        self._lock = threading.Lock()
+        self.default_routes(2)
+
+    def _publish(self):
+        gains = self.routes * self.input_gains[:, None] * self.output_gains[None, :]
+        # Replaced, never written in place: mixers compare by identity.
+        self.gains = np.ascontiguousarray(gains, dtype=np.float32)
+
+    def default_routes(self, channels):
+        """Input i to program channel i; a mono input to both sides of pair 1."""
+        with self._lock:
+            self.routes[:] = 0.0
+            if channels == 1:
+                self.routes[0, :2] = 1.0
+            else:
+                n = min(channels, self.inputs, self.outputs)
+                self.routes[np.arange(n), np.arange(n)] = 1.0
+            self._publish()
+
+    def route(self, input, output, gain=1.0):
+        """Send input channel `input` to program channel `output` at `gain` (0 to unroute)."""
+        with self._lock:
+            self.routes[input, output] = gain
+            self.custom = True
+            self._publish()
+
+    def route_pair(self, inputs, pair, gain=1.0):
+        """Send one input (to both sides) or an (left, right) input pair to program pair `pair`.
+
+        Anything else routed to that pair is removed.
+        """
+        if isinstance(inputs, int):
+            inputs = (inputs, inputs)
+        left, right = 2 * pair, 2 * pair + 1
+        with self._lock:
+            self.routes[:, left:right + 1] = 0.0
+            self.routes[inputs[0], left] = gain
+            self.routes[inputs[1], right] = gain
+            self.custom = True
+            self._publish()
+
+    def route_input(self, input, outputs, gain=1.0):
+        """Send input channel `input` to exactly the program channels `outputs` (none to mute it)."""
+        with self._lock:
+            self.routes[input] = 0.0
+            self.routes[input, list(outputs)] = gain
+            self.custom = True
+            self._publish()
+
+    def set_routes(self, routes):
+        """Replace all routes with an (inputs, outputs) array; missing rows and columns are unrouted."""
+        routes = np.asarray(routes, dtype=np.float32)
+        with self._lock:
+            self.routes[:] = 0.0
+            rows, cols = min(routes.shape[0], self.inputs), min(routes.shape[1], self.outputs)
+            self.routes[:rows, :cols] = routes[:rows, :cols]
+            self.custom = True
+            self._publish()
+
+    def set_input_gain(self, input, gain):
+        with self._lock:
+            self.input_gains[input] = gain
+            self._publish()
+
+    def set_output_gain(self, output, gain):
+        with self._lock:
+            self.output_gains[output] = gain
+            self._publish()
+
+    def resized(self, outputs):
+        """A matrix with `outputs` program channels and the same routes and gains where they fit."""
+        matrix = MixMatrix(outputs, self.inputs)
+        with self._lock:
+            n = min(outputs, self.outputs)
+            matrix.routes[:] = 0.0
+            matrix.routes[:, :n] = self.routes[:, :n]
+            matrix.input_gains[:] = self.input_gains
+            matrix.output_gains[:n] = self.output_gains[:n]
+            matrix.custom = self.custom
+        matrix._publish()
+        return matrix
+
+    def routing(self):
+        """Routed (input, output, gain) triples, for display and stats."""
+        with self._lock:
+            return [(int(i), int(o), float(self.routes[i, o])) for i, o in zip(*np.nonzero(self.routes))]
+
+
+class MatrixMixer:
+    """Applies a MixMatrix to the blocks of one input stream; runs on its callback.
+
+    `channels` is how many input channels the stream has (the first rows
+    of the matrix). `process(block)` returns a view of a buffer owned by the
+    mixer, valid until the next call.
+    """
+
+    def __init__(self, matrix, channels, samplerate, blocksize=1024):
+        self.matrix = matrix
+        self.channels = channels
+        self.ramp_frames = max(1, int(samplerate * RAMP_SECONDS))
+        outputs = matrix.outputs
+        self._target = matrix.gains
+        self._gains = np.array(self._target[:channels])
+        self._start = np.empty_like(self._gains)
+        self._delta = np.empty_like(self._gains)
+        self._ramping = False
+        self._pos = 0
+        self._outputs = outputs
+        self._alloc(blocksize)
+
+    def _alloc(self, frames):
+        # Only grows if a driver hands over a block larger than any before.
+        self._frames = frames
+        self._out = np.empty((frames, self._outputs), dtype=np.float32)
+        self._change = np.empty((frames, self._outputs), dtype=np.float32)
+        self._k = np.arange(1, frames + 1, dtype=np.float32)[:, None]
+        self._ramp_buf = np.empty((frames, 1), dtype=np.float32)
+
+    def process(self, block):
+        frames = len(block)
+        if frames > self._frames:
+            self._alloc(frames)
+        target = self.matrix.gains
+        if target is not self._target:
+            # Ramp from wherever the gains are now, even mid-ramp.
+            self._target = target
+            np.copyto(self._start, self._gains)
+            np.subtract(target[:self.channels], self._start, out=self._delta)
+            self._pos = 0
+            self._ramping = True
+
+        out = self._out[:frames]
+        if not self._ramping:
+            np.matmul(block, self._gains, out=out)
+            return out
+
+        # out = in @ start + ramp * (in @ delta), the ramp per frame.
+        np.matmul(block, self._start, out=out)
+        change = self._change[:frames]
+        np.matmul(block, self._delta, out=change)
+        ramp = self._ramp_buf[:frames]
+        np.add(self._k[:frames], self._pos, out=ramp)
+        ramp *= 1.0 / self.ramp_frames
+        np.minimum(ramp, 1.0, out=ramp)
+        change *= ramp
+        out += change
+        self._pos += frames
+        if self._pos >= self.ramp_frames:
+            np.copyto(self._gains, self._target[:self.channels])
+            self._ramping = False
+        else:
+            np.multiply(self._delta, self._pos / self.ramp_frames, out=self._gains)
+            self._gains += self._start
+        return out
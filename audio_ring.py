@@ -0,0 +1,179 @@
+import numpy as np
+
+
+class AudioRingBuffer:
+    """Single-producer/single-consumer sample FIFO between two audio callbacks.
+
+    The input callback calls `write` and the output callback calls `read`;
+    each side only ever advances its own position counter, and a Python int
+    assignment is atomic, so no lock is taken on either realtime thread. All
+    storage is preallocated (scratch arrays grow once if a larger block size
+    shows up).
+
+    Input and output devices run on separate clocks, so the consumer reads
+    through a linear-interpolating resampler whose ratio is steered by a PI
+    controller on the fill level. This holds the buffer at `target_latency`
+    instead of slowly draining or overflowing.
+
+    The same resampler converts between nominal rates when the output device
+    runs at `output_rate` rather than `samplerate` (the input rate), e.g.
+    48 kHz in to 44.1 kHz out. Linear interpolation is plenty for monitoring,
+    though it is not a band-limited converter.
+    """
+
+    # Drift a real pair of sound cards shows is well under 0.1%; 0.5% leaves
+    # headroom without making the pitch shift audible during correction.
+    MAX_CORRECTION = 0.005
+
+    def __init__(self, samplerate, channels=1, capacity=1.0, target_latency=0.05, output_rate=None):
+        self.samplerate = samplerate
+        self.output_rate = output_rate or samplerate
+        # Input frames consumed per output frame before drift correction.
+        self.nominal_ratio = samplerate / self.output_rate
+        self.channels = channels
+        self.capacity = int(samplerate * capacity)
+        self.target = int(samplerate * target_latency)
+        if self.target * 2 > self.capacity:
+            raise ValueError("Ring capacity must be at least twice the target latency")
+        self._buffer = np.zeros((self.capacity, channels), dtype=np.float32)
+        self._write_pos = 0
+        self._read_pos = 0
+        self._frac = 0.0
+        self._priming = True
+        self._smoothed_fill = float(self.target)
+        self._integral = 0.0
+        self.ratio = 1.0
+        self._alloc_scratch(1024)
+
+        self.overruns = 0
+        self.underruns = 0
+        self.dropped_frames = 0
+
+    def _alloc_scratch(self, frames):
+        self._scratch_frames = frames
+        self._k = np.arange(frames, dtype=np.float64)
+        self._pos = np.empty(frames, dtype=np.float64)
+        self._idx = np.empty(frames, dtype=np.intp)
+        self._weight = np.empty((frames, 1), dtype=np.float32)
+        # Input window: frames at the maximum ratio plus interpolation guard.
+        self._window = np.empty((int(frames * self.nominal_ratio * (1 + self.MAX_CORRECTION)) + 3, self.channels),
+                                dtype=np.float32)
+        self._delta = np.empty((frames, self.channels), dtype=np.float32)
+
+    @property
+    def fill(self):
+        """Frames currently buffered."""
+        return self._write_pos - self._read_pos
+
+    @property
+    def latency(self):
+        return self.fill / self.samplerate
+
+    @property
+    def ready(self):
+        """True once enough is buffered for the consumer to start playing."""
+        return self._write_pos - self._read_pos >= self.target
+
+    @property
+    def priming(self):
+        """True while the consumer is playing silence waiting for the target fill."""
+        return self._priming
+
+    def write(self, block):
+        """Producer side: append a (frames, channels) block of any length."""
+        frames = len(block)
+        free = self.capacity - (self._write_pos - self._read_pos)
+        if frames > free:
+            self.overruns += 1
+            self.dropped_frames += frames - free
+            frames = free
+            if not frames:
+                return
+        start = self._write_pos % self.capacity
+        first = min(frames, self.capacity - start)
+        self._buffer[start:start + first] = block[:first]
+        if first < frames:
+            self._buffer[:frames - first] = block[first:frames]
+        self._write_pos += frames
+
+    def read(self, out):
+        """Consumer side: fill `out` (frames, channels), resampling for drift."""
+        frames = len(out)
+        fill = self._write_pos - self._read_pos
+        if self._priming:
+            if fill < self.target:
+                out.fill(0)
+                return
+            self._priming = False
+
+        ratio = self._steer(fill, frames) * self.nominal_ratio
+        consumed = self._frac + frames * ratio
+        needed = int(consumed) + 2
+        if needed > fill:
+            # Underrun: play silence and refill to the target before resuming,
+            # rather than crackling on every block while starved.
+            self.underruns += 1
+            self._priming = True
+            self._frac = 0.0
+            out.fill(0)
+            return
+
+        if frames > self._scratch_frames:
+            self._alloc_scratch(frames)
+        window = self._window[:needed]
+        start = self._read_pos % self.capacity
+        first = min(needed, self.capacity - start)
+        window[:first] = self._buffer[start:start + first]
+        if first < needed:
+            window[first:] = self._buffer[:needed - first]
+
+        pos = self._pos[:frames]
+        idx = self._idx[:frames]
+        weight = self._weight[:frames]
+        delta = self._delta[:frames]
+        np.multiply(self._k[:frames], ratio, out=pos)
+        pos += self._frac
+        idx[:] = pos  # positions are non-negative, so truncation is floor
+        np.subtract(pos, idx, out=weight[:, 0])
+        np.take(window, idx, axis=0, out=out)
+        np.take(window, idx + 1, axis=0, out=delta)
+        delta -= out
+        delta *= weight
+        out += delta
+
+        whole = int(consumed)
+        self._frac = consumed - whole
+        self._read_pos += whole
+
+    def _steer(self, fill, frames):
+        """PI control of the resampling ratio from the smoothed fill level."""
+        dt = frames / self.output_rate
+        # ~2 s smoothing averages out the sawtooth of block-sized writes.
+        self._smoothed_fill += (fill - self._smoothed_fill) * min(1.0, dt / 2.0)
+        error = (self._smoothed_fill - self.target) / self.samplerate
+        self._integral = max(-0.1, min(0.1, self._integral + error * dt))
+        correction = error * 0.05 + self._integral * 0.002
+        correction = max(-self.MAX_CORRECTION, min(self.MAX_CORRECTION, correction))
+        self.ratio = 1.0 + correction
+        return self.ratio
+
+    def reset(self):
+        """Drop buffered audio. Only safe while neither callback is running."""
+        self._read_pos = self._write_pos = 0
+        self._frac = 0.0
+        self._priming = True
+        self._smoothed_fill = float(self.target)
+        self._integral = 0.0
+        self.ratio = 1.0
+
+    def stats(self):
+        return {
+            "fill_frames": self.fill,
+            "latency_ms": self.latency * 1000,
+            "target_ms": self.target / self.samplerate * 1000,
+            "ratio": self.ratio,
+            "resample_ratio": self.nominal_ratio,
+            "overruns": self.overruns,
+            "underruns": self.underruns,
+            "dropped_frames": self.dropped_frames,
+        }
@@ -0,0 +1,171 @@
+"""Input and output stream paths that can be swapped without a dropout.
+
+Audio passthrough is an InputPath (one input stream, mixed to program
+channels by a MatrixMixer, feeding one or more AudioRingBuffers) and an
+OutputPath (one output stream playing the first program channels from a
+ring). Switching devices never stops the path that stays:
+
+* a new input is crossfaded in by the running output, which reads the old
+  and the new ring side by side for FADE_SECONDS once the new one is
+  primed (`OutputPath.crossfade_to`);
+* a new output gets a ring of its own, fed by the same input, and fades in
+  while the old output fades out (`OutputPath.fade_out(after=...)`).
+
+The replaced path is closed off the callback threads once its fade is done.
+Callbacks only touch preallocated arrays.
+"""
+import threading
+
+import numpy as np
+
+FADE_SECONDS = 0.02
+
+
+class InputPath:
+    """An input stream writing every block to `rings`.
+
+    `rings` is a tuple replaced whole when an output is added or removed, so
+    the callback always sees a consistent set. With a `mixer` the rings get
+    its program channels instead of the device's. `on_block(path, block,
+    frames, time_info)` runs after the rings are written, with the same
+    block. The meter shows the device's own channels.
+    """
+
+    def __init__(self, device, rings, meter, on_block=None, mixer=None):
+        self.device = device
+        self.rings = tuple(rings)
+        self.meter = meter
+        self.on_block = on_block
+        self.mixer = mixer
+        self.stream = None
+        self.xruns = 0
+
+    def callback(self, indata, frames, time_info, status):
+        if status:
+            # Counted rather than printed: the callback must not block.
+            self.xruns += 1
+        block = self.mixer.process(indata) if self.mixer is not None else indata
+        for ring in self.rings:
+            ring.write(block)
+        if self.on_block is not None:
+            self.on_block(self, block, frames, time_info)
+        self.meter.feed(indata)
+
+    def start(self, stream):
+        self.stream = stream
+        self.meter.start()
+        stream.start()
+
+    def close(self):
+        stream, self.stream = self.stream, None
+        if stream is not None:
+            stream.stop()
+            stream.close()
+        self.meter.stop()
+
+
+class OutputPath:
+    """An output stream playing from `ring`, with gain and crossfade ramps.
+
+    `channels` is the ring's (program) channel count; a device with fewer
+    channels plays the first ones.
+    """
+
+    def __init__(self, device, ring, meter, samplerate, channels=1, fade_in=False):
+        self.device = device
+        self.ring = ring
+        self.meter = meter
+        self.stream = None
+        self.xruns = 0
+        self.fade_frames = max(1, int(samplerate * FADE_SECONDS))
+        self.gain = 0.0 if fade_in else 1.0
+        self.target_gain = 1.0
+        self.next_ring = None
+        self._mix = 0.0
+        self._fade_after = None
+        # Set when a crossfade to `next_ring` completes / when faded out.
+        self.switched = threading.Event()
+        self.faded = threading.Event()
+        self._channels = channels
+        self._alloc(1024)
+
+    def _alloc(self, frames):
+        self._frames = frames
+        self._k = np.arange(frames, dtype=np.float32)[:, None]
+        self._ramp_buf = np.empty((frames, 1), dtype=np.float32)
+        self._other = np.empty((frames, self._channels), dtype=np.float32)
+        self._program = np.empty((frames, self._channels), dtype=np.float32)
+
+    def _ramp(self, frames, start, step):
+        ramp = self._ramp_buf[:frames]
+        np.multiply(self._k[:frames], step, out=ramp)
+        ramp += start
+        np.clip(ramp, 0.0, 1.0, out=ramp)
+        return ramp
+
+    def crossfade_to(self, ring):
+        """Move playback to `ring` (fed by a new input) once it is primed."""
+        self.switched.clear()
+        self._mix = 0.0
+        self.next_ring = ring
+
+    def fade_out(self, after=None):
+        """Fade to silence, starting once `after` (a ring) has begun playing."""
+        self._fade_after = after
+        self.target_gain = 0.0
+
+    def callback(self, outdata, frames, time_info, status):
+        if status:
+            self.xruns += 1
+        if frames > self._frames:
+            self._alloc(frames)
+        if self.gain <= 0.0 and self.target_gain <= 0.0:
+            outdata.fill(0)
+            self.faded.set()
+            return
+        # Mixed at program width; a narrower device gets the first channels.
+        program = outdata if outdata.shape[1] == self._channels else self._program[:frames]
+        # Silence while the ring is priming or after an underrun.
+        self.ring.read(program)
+
+        next_ring = self.next_ring
+        if next_ring is not None and (next_ring.ready or not next_ring.priming):
+            other = self._other[:frames]
+            next_ring.read(other)
+            step = 1.0 / self.fade_frames
+            # out = old + (new - old) * ramp
+            other -= program
+            other *= self._ramp(frames, self._mix, step)
+            program += other
+            self._mix += frames * step
+            if self._mix >= 1.0:
+                self.ring = next_ring
+                self.next_ring = None
+                self.switched.set()
+        if program is not outdata:
+            np.copyto(outdata, program[:, :outdata.shape[1]])
+
+        if self.gain != self.target_gain:
+            after = self._fade_after
+            fading_in = self.target_gain > self.gain
+            # Fade in from the first real samples, and out only once the
+            # replacement has started, so the two overlap.
+            if (fading_in and not self.ring.priming) or (not fading_in and (after is None or not after.priming)):
+                step = (1.0 if fading_in else -1.0) / self.fade_frames
+                outdata *= self._ramp(frames, self.gain + step, step)
+                self.gain = min(1.0, max(0.0, self.gain + frames * step))
+            elif fading_in:
+                outdata.fill(0)
+        self.meter.feed(outdata)
+
+    def start(self, stream):
+        self.stream = stream
+        self.meter.start()
+        stream.start()
+
+    def close(self):
+        stream, self.stream = self.stream, None
+        if stream is not None:
+            stream.stop()
+            stream.close()
+        self.meter.stop()
@@ -0,0 +1,231 @@
+"""Common-clock timestamps for audio and per-frame A/V alignment.
+
+Video frames are stamped with time.monotonic() when their grab starts.
+Audio blocks are stamped with the ADC time PortAudio passes to the input
+callback, mapped onto the same clock by StreamClock. AVSync keeps the
+stamped input audio in a fixed ring and, for every output video frame,
+cuts exactly the samples that cover that frame (1920 at 48 kHz/25 fps).
+"""
+import time
+
+import numpy as np
+
+
+class StreamClock:
+    """Maps a PortAudio stream's clock onto time.monotonic().
+
+    PortAudio reports buffer times on the stream's own clock (Pa_GetStreamTime),
+    whose epoch is unspecified. In every callback `now - currentTime` is the
+    offset between the two clocks plus however late the callback was
+    scheduled, so the smallest recent sample is the best estimate. The
+    estimate may creep up by `max_step` seconds per callback, which follows
+    any slow drift between the clocks without letting a late callback
+    through.
+    """
+
+    def __init__(self, max_step=20e-6):
+        self.max_step = max_step
+        self.offset = None
+        self.fallbacks = 0
+
+    def reset(self):
+        self.offset = None
+
+    def input_time(self, time_info, frames, samplerate, now=None):
+        """Monotonic time of the first sample of an input block."""
+        if now is None:
+            now = time.monotonic()
+        current = getattr(time_info, "currentTime", 0.0)
+        adc = getattr(time_info, "inputBufferAdcTime", 0.0)
+        if not current or not adc:
+            # Some host APIs leave the times at zero; assume the block was
+            # captured in the period just before the callback.
+            self.fallbacks += 1
+            return now - frames / samplerate
+        sample = now - current
+        if self.offset is None or sample < self.offset:
+            self.offset = sample
+        else:
+            self.offset += min(sample - self.offset, self.max_step)
+        return adc + self.offset
+
+
+class AVSync:
+    """Cuts the input audio into blocks aligned with output video frames.
+
+    The input callback calls `write(block, timestamp)`; it copies the
+    samples into a preallocated ring and records (sample index, timestamp).
+    The PGM thread calls `read(frame_time)` once per output frame. A line
+    fitted through the recent stamps gives the sample index for any
+    monotonic time, which averages out callback jitter and tracks the
+    audio clock's rate against the system clock.
+
+    Consecutive frames should take consecutive audio. So `read` continues
+    from where the previous frame ended and only steers towards the fitted
+    position, taking up to `max_correction` more or fewer samples per frame
+    and resampling them to the exact frame length. This absorbs clock drift
+    without clicks. An error over half a frame (a dropped video frame, a gap
+    in the input) is fixed with a hard resync instead.
+
+    `audio_delay` (seconds) takes the audio for each frame that much later
+    than the frame's own stamp, to make up for a source whose sound leads
+    its picture; a negative delay takes it earlier.
+
+    `offset` is the audio-minus-video time of the last frame, in seconds:
+    where the continued audio was against where the fitted clock puts the
+    frame (plus `audio_delay`). It is measured before any resync, so a slip
+    shows in full; `stats()` reports it with its recent maximum and counts
+    the audio out of sync while that maximum exceeds half a frame.
+    """
+
+    def __init__(self, samplerate, channels=1, frame_rate=25.0, capacity=4.0, max_correction=0.002, stamps=512,
+                 audio_delay=0.0):
+        self.samplerate = samplerate
+        self.channels = channels
+        self.frame_rate = frame_rate
+        self.samples_per_frame = samplerate / frame_rate
+        self.capacity = int(samplerate * capacity)
+        self.max_correction = max_correction
+        self.audio_delay = audio_delay
+        self._buffer = np.zeros((self.capacity, channels), dtype=np.float32)
+        self._write_pos = 0
+        # Ring of (sample index, monotonic time) stamps, one per input block.
+        self._stamp_index = np.zeros(stamps, dtype=np.float64)
+        self._stamp_time = np.zeros(stamps, dtype=np.float64)
+        self._stamps = 0
+
+        self._next_pos = None
+        self._frame_acc = 0.0
+        self.offset = 0.0
+        self.max_offset = 0.0
+        self.correction = 0.0
+        self.frames = 0
+        self.resyncs = 0
+        self.late_frames = 0
+
+    def write(self, block, timestamp):
+        """Producer side: append a block whose first sample was taken at `timestamp`."""
+        frames = len(block)
+        if frames > self.capacity:
+            block = block[-self.capacity:]
+            timestamp += (frames - self.capacity) / self.samplerate
+            frames = self.capacity
+        slot = self._stamps % len(self._stamp_index)
+        self._stamp_index[slot] = self._write_pos
+        self._stamp_time[slot] = timestamp
+        start = self._write_pos % self.capacity
+        first = min(frames, self.capacity - start)
+        self._buffer[start:start + first] = block[:first]
+        if first < frames:
+            self._buffer[:frames - first] = block[first:]
+        self._write_pos += frames
+        # Published last, so a reader never sees a stamp without its samples.
+        self._stamps += 1
+
+    def _fit(self):
+        """(index, time, samples per second) of the clock line, or None."""
+        stamps = self._stamps
+        size = len(self._stamp_index)
+        count = min(stamps, size)
+        if count < 2:
+            return None
+        index = self._stamp_index[:count].copy()
+        times = self._stamp_time[:count].copy()
+        if stamps >= size:
+            # Leave out the slot the writer fills next; it may be half written.
+            keep = np.arange(size) != stamps % size
+            index, times = index[keep], times[keep]
+        ref_index, ref_time = index.mean(), times.mean()
+        di, dt = index - ref_index, times - ref_time
+        denom = float(np.dot(dt, dt))
+        rate = float(np.dot(dt, di)) / denom if denom > 0 else self.samplerate
+        if not 0.9 * self.samplerate < rate < 1.1 * self.samplerate:
+            rate = self.samplerate
+        return float(ref_index), float(ref_time), rate
+
+    def position(self, timestamp):
+        """Fractional sample index captured at monotonic `timestamp`, or None."""
+        fit = self._fit()
+        if fit is None:
+            return None
+        ref_index, ref_time, rate = fit
+        return ref_index + (timestamp + self.audio_delay - ref_time) * rate
+
+    def read(self, frame_time, timeout=0.0):
+        """Audio for the output frame starting at `frame_time`, or None.
+
+        Waits up to `timeout` seconds for the input to catch up with the end
+        of the frame. Missing samples are returned as silence and counted
+        as a late frame. None is returned until enough input has been
+        stamped to place the frame.
+        """
+        self._frame_acc += self.samples_per_frame
+        length = int(self._frame_acc)
+        self._frame_acc -= length
+
+        fit = self._fit()
+        if fit is None:
+            return None
+        ref_index, ref_time, rate = fit
+        target = ref_index + (frame_time + self.audio_delay - ref_time) * rate
+        pos = self._next_pos
+        error = 0.0 if pos is None else pos - target
+        if pos is None or abs(error) > self.samples_per_frame / 2 or pos < self._write_pos - self.capacity:
+            if pos is not None:
+                self.resyncs += 1
+            pos = target
+        # Steer the continuation towards the fitted position.
+        limit = length * self.max_correction
+        step = max(-limit, min(limit, (target - pos) * 0.1))
+        consumed = length * (rate / self.samplerate) + step
+        pos = max(pos, float(self._write_pos - self.capacity))
+        self.correction = consumed / length - 1
+
+        end = int(np.ceil(pos + consumed)) + 1
+        deadline = time.monotonic() + timeout
+        while self._write_pos < end:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            time.sleep(min(0.002, remaining))
+
+        out = np.zeros((length, self.channels), dtype=np.float32)
+        positions = pos + np.arange(length) * (consumed / length)
+        idx = np.floor(positions).astype(np.int64)
+        weight = (positions - idx).astype(np.float32)[:, None]
+        available = idx + 1 < self._write_pos
+        if not available.all():
+            self.late_frames += 1
+        if available.any():
+            idx, weight = idx[available], weight[available]
+            a = self._buffer[idx % self.capacity]
+            b = self._buffer[(idx + 1) % self.capacity]
+            out[available] = a + (b - a) * weight
+
+        self.offset = error / rate
+        self.max_offset = max(self.max_offset * 0.999, abs(self.offset))
+        self._next_pos = pos + consumed
+        self.frames += 1
+        return out
+
+    def reset(self):
+        """Forget buffered audio and stamps. Only safe while no callback runs."""
+        self._write_pos = 0
+        self._stamps = 0
+        self._next_pos = None
+        self._frame_acc = 0.0
+        self.offset = self.max_offset = self.correction = 0.0
+
+    def stats(self):
+        return {
+            "offset_ms": self.offset * 1000,
+            "max_offset_ms": self.max_offset * 1000,
+            "frame_ms": 1000 / self.frame_rate,
+            "audio_delay_ms": self.audio_delay * 1000,
+            "in_sync": bool(self.max_offset <= 0.5 / self.frame_rate),
+            "correction_ppm": self.correction * 1e6,
+            "samples_per_frame": self.samples_per_frame,
+            "frames": self.frames,
+            "late_frames": self.late_frames,
+            "resyncs": self.resyncs,
+        }
@@ -0,0 +1,510 @@
+"""Repeatable pipeline benchmarks on synthetic sources; runs on headless Linux.
+
+    python -m benchmarks --resolutions 1080p 4k --patterns gradient text \\
+        --formats "1920x1080 50i" --frames 100 --output results.json
+
+Video cases push frames from a SyntheticSource (or, with --replay, from a
+recording made with the "record" sink) through the same grab,
+ScanConverter and sink code the engine uses, one stage after the other on
+the calling thread, and time each stage per frame. The audio case runs the
+engine's passthrough callbacks against FakeSoundDevice, which replays input
+and output devices with a small clock drift on a simulated timeline, and
+switches to a second input halfway through to time the crossfade. The
+cadence case runs in real time: a capture thread on a synthetic source,
+optionally off its nominal rate, feeds an OutputScheduler, and the report
+gives tick jitter and the repeats and drops the rate offset causes.
+
+Results are printed (or written) as one JSON document with fps, per-stage
+p50/p99 latency in milliseconds, CPU use and peak RSS.
+"""
+import argparse
+import json
+import platform
+import sys
+import threading
+import time
+from types import SimpleNamespace
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+from audio_format import STANDARD_RATES
+from capture import CaptureEngine
+from convert import PIXEL_FORMATS, ScanConverter
+from engine import SINKS, ScanConverterEngine
+from formats import SIGNAL_FORMATS, parse_format
+from frames import FramePool
+from recorder import ReplaySource
+from scheduler import OutputScheduler
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+RESOLUTIONS = {
+    "720p": (1280, 720),
+    "1080p": (1920, 1080),
+    "4k": (3840, 2160),
+}
+PATTERNS = ("gradient", "slides", "text")
+
+STAGES = ("grab", "convert", "output", "total")
+
+
+class SyntheticSource:
+    """Capture source that plays back generated content instead of a screen.
+
+    Patterns:
+
+    - "gradient": colour ramps moving a few pixels every frame, so every
+      tile changes every frame (worst case for the tile cache);
+    - "slides": static slides that change every `slide_frames` frames, like
+      a presentation;
+    - "text": lines of text scrolling upwards, like a credits roll or a
+      scrolling document.
+
+    Content is rendered once into a canvas larger than the frame; `grab`
+    copies a moving window of it into a pooled frame, which costs about the
+    same as the copy out of an mss screenshot.
+    """
+
+    def __init__(self, width, height, pattern="gradient", slide_frames=50):
+        if pattern not in PATTERNS:
+            raise ValueError(f"Unknown pattern: {pattern!r}")
+        self.width = width
+        self.height = height
+        self.pattern = pattern
+        self.slide_frames = slide_frames
+        self.index = 0
+        self._canvas = None
+
+    def open(self):
+        if self._canvas is None:
+            self._canvas = getattr(self, f"_render_{self.pattern}")()
+
+    def close(self):
+        pass
+
+    def _render_gradient(self):
+        # Two frame widths wide, so any offset up to `width` is a full window.
+        width, height = self.width, self.height
+        x = np.arange(width * 2, dtype=np.float32)[None, :]
+        y = np.arange(height, dtype=np.float32)[:, None]
+        canvas = np.empty((height, width * 2, 4), dtype=np.uint8)
+        canvas[..., 0] = (x * 255 / width + y * 64 / height) % 256
+        canvas[..., 1] = (y * 255 / height + x * 32 / width) % 256
+        canvas[..., 2] = 255 - (x * 128 / width) % 256
+        canvas[..., 3] = 255
+        return canvas
+
+    def _render_slides(self):
+        # A stack of slides, one below the other.
+        slides = []
+        font = ImageFont.load_default()
+        for n in range(4):
+            image = Image.new("RGB", (self.width, self.height), (24 + 40 * n, 32, 64))
+            draw = ImageDraw.Draw(image)
+            draw.rectangle((0, 0, self.width, self.height // 8), fill=(230, 230, 230))
+            for line in range(12):
+                top = self.height // 6 + line * self.height // 16
+                draw.text((self.width // 10, top), f"Slide {n + 1} - bullet point {line + 1}", fill="white", font=font)
+            draw.ellipse((self.width * 3 // 5, self.height // 3, self.width * 9 // 10, self.height * 5 // 6),
+                         fill=(200, 120 + 30 * n, 40))
+            slides.append(np.asarray(image.convert("RGBX")))
+        return np.concatenate(slides)
+
+    def _render_text(self):
+        # One frame of text repeated below itself so the scroll wraps seamlessly.
+        image = Image.new("RGB", (self.width, self.height), (16, 16, 16))
+        draw = ImageDraw.Draw(image)
+        font = ImageFont.load_default()
+        line_height = 14
+        for line in range(self.height // line_height):
+            text = f"{line:04d} The quick brown fox jumps over the lazy dog. " * (self.width // 300 + 1)
+            draw.text((8, line * line_height), text, fill=(220, 220, 220), font=font)
+        page = np.asarray(image.convert("RGBX"))
+        return np.concatenate((page, page))
+
+    def grab(self, pool, monitor_index=0, roi_coords=None):
+        self.open()
+        frame = pool.acquire(self.width, self.height)
+        n = self.index
+        self.index += 1
+        if self.pattern == "gradient":
+            offset = (n * 8) % self.width
+            np.copyto(frame.data, self._canvas[:, offset:offset + self.width])
+        elif self.pattern == "slides":
+            top = (n // self.slide_frames) % 4 * self.height
+            np.copyto(frame.data, self._canvas[top:top + self.height])
+        else:
+            top = (n * 2) % self.height
+            np.copyto(frame.data, self._canvas[top:top + self.height])
+        return frame
+
+
+class _FakeStream:
+    def __init__(self, device=None, samplerate=48000, channels=1, callback=None, blocksize=None, **kwargs):
+        self.device = device
+        self.samplerate = samplerate
+        self.channels = channels
+        self.callback = callback
+        self.blocksize = blocksize or 0
+        self.active = False
+        self.closed = False
+        self.phase = 0
+
+    def start(self):
+        self.active = True
+
+    def stop(self):
+        self.active = False
+
+    def close(self):
+        self.active = False
+        self.closed = True
+
+
+class FakeSoundDevice:
+    """Enough of the sounddevice module to run the engine's audio path.
+
+    Streams are created by the engine as usual but do not run by themselves;
+    `run` steps every active stream through a simulated timeline, calling
+    its callback with a block and a PortAudio-style time info. The output
+    clock runs `drift_ppm` fast relative to the input, as two separate sound
+    cards would. The inputs play a 997 Hz tone at -20 dBFS.
+
+    Devices accept the rates in `input_rates`/`output_rates` (all standard
+    rates by default) when probed with check_input_settings and
+    check_output_settings.
+    """
+
+    def __init__(self, blocksize=480, drift_ppm=100.0, input_rates=None, output_rates=None):
+        self.default_blocksize = blocksize
+        self.drift_ppm = drift_ppm
+        self.rates = {"input": input_rates or STANDARD_RATES, "output": output_rates or STANDARD_RATES}
+        self.streams = []
+        # Simulated time, carried over between runs.
+        self.now = 0.0
+        fake = self
+
+        class InputStream(_FakeStream):
+            kind = "input"
+
+            def __init__(self, *args, **kwargs):
+                super().__init__(*args, **kwargs)
+                fake.streams.append(self)
+
+        class OutputStream(_FakeStream):
+            kind = "output"
+
+            def __init__(self, *args, **kwargs):
+                super().__init__(*args, **kwargs)
+                fake.streams.append(self)
+
+        self.InputStream = InputStream
+        self.OutputStream = OutputStream
+
+    def query_hostapis(self):
+        return [{"name": "Fake", "devices": [0, 1, 2]}]
+
+    def query_devices(self):
+        return [
+            {"index": 0, "name": "Fake input", "hostapi": 0, "max_input_channels": 2,
+             "max_output_channels": 0, "default_samplerate": 48000.0},
+            {"index": 1, "name": "Fake output", "hostapi": 0, "max_input_channels": 0,
+             "max_output_channels": 2, "default_samplerate": 48000.0},
+            {"index": 2, "name": "Fake input 2", "hostapi": 0, "max_input_channels": 2,
+             "max_output_channels": 0, "default_samplerate": 48000.0},
+        ]
+
+    def _check(self, kind, samplerate, **kwargs):
+        if samplerate not in self.rates[kind]:
+            raise ValueError(f"Invalid sample rate for fake {kind}: {samplerate}")
+
+    def check_input_settings(self, device=None, samplerate=None, **kwargs):
+        self._check("input", samplerate)
+
+    def check_output_settings(self, device=None, samplerate=None, **kwargs):
+        self._check("output", samplerate)
+
+    def run(self, seconds):
+        """Drive all active streams for `seconds` of simulated time.
+
+        Returns callback durations (seconds of wall time) per stream kind and
+        how many callbacks took longer than their block period. Streams the
+        engine closes meanwhile stop being called.
+        """
+        streams = [s for s in self.streams if s.active]
+        durations = {s.kind: [] for s in streams}
+        late = {s.kind: 0 for s in streams}
+        clocks = []
+        for s in streams:
+            frames = s.blocksize or self.default_blocksize
+            rate = s.samplerate * (1 + self.drift_ppm * 1e-6 if s.kind == "output" else 1)
+            buf = np.zeros((frames, s.channels), dtype=np.float32)
+            clocks.append([self.now, s, frames, frames / rate, buf])
+        end = self.now + seconds
+        while clocks:
+            clock = min(clocks, key=lambda c: c[0])
+            now, stream, frames, period, buf = clock
+            if now >= end:
+                break
+            if not stream.active:
+                clocks.remove(clock)
+                continue
+            if stream.kind == "input":
+                t = np.arange(stream.phase, stream.phase + frames) / stream.samplerate
+                buf[:] = (0.1 * np.sin(2 * np.pi * 997 * t))[:, None]
+                stream.phase += frames
+                info = SimpleNamespace(inputBufferAdcTime=now, outputBufferDacTime=0.0, currentTime=now + period)
+            else:
+                info = SimpleNamespace(inputBufferAdcTime=0.0, outputBufferDacTime=now + period, currentTime=now)
+            started = time.perf_counter()
+            stream.callback(buf, frames, info, 0)
+            elapsed = time.perf_counter() - started
+            durations[stream.kind].append(elapsed)
+            if elapsed > period:
+                late[stream.kind] += 1
+            clock[0] = now + period
+        self.now = end
+        return durations, late
+
+
+def _percentiles(samples):
+    if not samples:
+        return {"p50": None, "p99": None, "max": None}
+    ms = np.asarray(samples) * 1000
+    return {"p50": float(np.percentile(ms, 50)), "p99": float(np.percentile(ms, 99)), "max": float(ms.max())}
+
+
+def _cpu_time():
+    if resource is None:
+        return time.process_time()
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    # ru_maxrss is in KiB on Linux and in bytes on macOS.
+    scale = 1 if sys.platform == "darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 2 ** 20
+
+
+def run_video(resolution, pattern, video_format, pixel_format, frames=100, sink="null", workers=4, warmup=5,
+              source=None):
+    """Time grab, convert and output for `frames` frames of one case.
+
+    `source` overrides the synthetic source picked by resolution and pattern.
+    """
+    if source is None:
+        width, height = RESOLUTIONS[resolution]
+        source = SyntheticSource(width, height, pattern)
+    source.open()
+    pool = FramePool()
+    converter = ScanConverter(video_format, pixel_format, workers=workers)
+    output_sink = SINKS[sink](converter.format, pixel_format)
+    times = {stage: [] for stage in STAGES}
+    outputs = 0
+    try:
+        for _ in range(warmup):
+            frame = source.grab(pool)
+            converter.convert(frame)
+            frame.release()
+        cpu_started = _cpu_time()
+        started = time.perf_counter()
+        for seq in range(frames):
+            t0 = time.perf_counter()
+            frame = source.grab(pool)
+            frame.seq, frame.timestamp = seq, time.monotonic()
+            t1 = time.perf_counter()
+            output = converter.convert(frame)
+            t2 = time.perf_counter()
+            times["grab"].append(t1 - t0)
+            times["convert"].append(t2 - t1)
+            if output is not None:
+                output_sink(output, frame)
+                t3 = time.perf_counter()
+                times["output"].append(t3 - t2)
+                times["total"].append(t3 - t0)
+                outputs += 1
+            frame.release()
+        elapsed = time.perf_counter() - started
+        cpu = _cpu_time() - cpu_started
+    finally:
+        converter.close()
+        output_sink.close()
+    stats = converter.stats()
+    return {
+        "resolution": resolution,
+        "pattern": pattern,
+        "format": converter.format.name,
+        "pixel_format": pixel_format,
+        "sink": sink,
+        "frames": frames,
+        "outputs": outputs,
+        "fps": frames / elapsed,
+        "realtime_factor": frames / elapsed / converter.format.rate,
+        "latency_ms": {stage: _percentiles(times[stage]) for stage in STAGES},
+        "cpu_percent": 100 * cpu / elapsed,
+        "tile_hit_rate": stats["tile_hit_rate"],
+        "over_budget": stats["over_budget"],
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def run_audio(seconds=30.0, blocksize=480, drift_ppm=100.0, output_rates=None):
+    """Run the engine's audio passthrough against FakeSoundDevice.
+
+    Halfway through, the input is switched to the second fake device, so
+    the report includes how long a switch takes (`switch_ms`).
+    """
+    fake = FakeSoundDevice(blocksize, drift_ppm, output_rates=output_rates)
+    engine = ScanConverterEngine(audio_backend=fake)
+    input_info, output_info, second_input = fake.query_devices()
+    if not engine.start_audio(input_info, output_info):
+        raise RuntimeError("Fake audio streams did not start")
+    try:
+        cpu_started = _cpu_time()
+        started = time.perf_counter()
+        durations, late = fake.run(seconds / 2)
+        if not engine.start_audio(second_input, output_info):
+            raise RuntimeError("Could not switch to the second fake input")
+        switch_ms = engine.switch_time * 1000
+        more_durations, more_late = fake.run(seconds / 2)
+        for kind, d in more_durations.items():
+            durations.setdefault(kind, []).extend(d)
+            late[kind] = late.get(kind, 0) + more_late[kind]
+        elapsed = time.perf_counter() - started
+        cpu = _cpu_time() - cpu_started
+        ring = engine.audio_ring.stats()
+        audio_format = engine.audio_format
+    finally:
+        engine.close()
+    return {
+        "simulated_seconds": seconds,
+        "samplerate": audio_format.input_rate,
+        "output_samplerate": audio_format.output_rate,
+        "switch_ms": switch_ms,
+        "blocksize": blocksize,
+        "drift_ppm": drift_ppm,
+        "callback_ms": {kind: _percentiles(d) for kind, d in durations.items()},
+        "late_callbacks": late,
+        "xruns": ring["underruns"] + ring["overruns"],
+        "ring": ring,
+        "speed": seconds / elapsed,
+        "cpu_percent": 100 * cpu / elapsed,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def run_cadence(video_format, seconds=5.0, capture_ppm=0.0):
+    """Tick an OutputScheduler for `seconds` against a live synthetic capture.
+
+    Capture runs `capture_ppm` off the format's rate, so over the run it
+    gains or loses about `seconds * rate * capture_ppm / 1e6` frames, which
+    should show up as that many evenly spaced drops or repeats.
+    """
+    fmt = parse_format(video_format)
+    capture = CaptureEngine(rate=fmt.rate * (1 + capture_ppm * 1e-6), source=SyntheticSource(640, 360, "slides"))
+    scheduler = OutputScheduler(fmt.rate, fields=2 if fmt.interlaced else 1)
+    running = threading.Event()
+    running.set()
+    steps = []
+    last_seq = None
+    capture.start()
+    try:
+        started = time.monotonic()
+        while time.monotonic() - started < seconds:
+            deadline = scheduler.wait(running)
+            frame, _ = scheduler.pick(capture.ring, deadline)
+            if frame is None:
+                continue
+            if last_seq is not None:
+                steps.append(frame.seq - last_seq)
+            last_seq = frame.seq
+            frame.release()
+    finally:
+        capture.stop()
+        scheduler.close()
+    # Ticks between consecutive repeats or drops; even spacing means no
+    # bursts of judder.
+    events = [i for i, step in enumerate(steps) if step != 1]
+    spacing = np.diff(events).tolist()
+    return {
+        "format": fmt.name,
+        "seconds": seconds,
+        "capture_ppm": capture_ppm,
+        "cadence": scheduler.stats(),
+        "capture_late": capture.late,
+        "events": len(events),
+        "event_spacing": {"min": int(min(spacing)), "max": int(max(spacing))} if spacing else None,
+    }
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description="Scan converter benchmarks")
+    parser.add_argument("--resolutions", nargs="+", choices=sorted(RESOLUTIONS), default=list(RESOLUTIONS))
+    parser.add_argument("--patterns", nargs="+", choices=PATTERNS, default=list(PATTERNS))
+    parser.add_argument("--formats", nargs="+", choices=SIGNAL_FORMATS, default=[SIGNAL_FORMATS[0]])
+    parser.add_argument("--pixel-formats", nargs="+", choices=PIXEL_FORMATS, default=["uyvy"])
+    parser.add_argument("--frames", type=int, default=100, help="frames per video case (default: 100)")
+    parser.add_argument("--sink", choices=sorted(SINKS), default="null")
+    parser.add_argument("--replay", help="use a recording (directory or segment .json) instead of synthetic sources")
+    parser.add_argument("--workers", type=int, default=4, help="conversion threads")
+    parser.add_argument("--audio-seconds", type=float, default=30.0,
+                        help="simulated seconds of audio passthrough, 0 to skip (default: 30)")
+    parser.add_argument("--drift-ppm", type=float, default=100.0, help="fake output clock drift")
+    parser.add_argument("--output-rate", type=int, help="only offer this rate on the fake output, to exercise "
+                                                        "resampling")
+    parser.add_argument("--cadence-seconds", type=float, default=5.0,
+                        help="real-time seconds of output scheduling per format, 0 to skip (default: 5)")
+    parser.add_argument("--capture-ppm", type=float, default=0.0,
+                        help="run capture this far off the format rate in the cadence case")
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    report = {
+        "time": time.time(),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "video": [],
+    }
+    if args.replay:
+        cases = [("recording", "replay")]
+    else:
+        cases = [(resolution, pattern) for resolution in args.resolutions for pattern in args.patterns]
+    for resolution, pattern in cases:
+        for video_format in args.formats:
+            for pixel_format in args.pixel_formats:
+                source = ReplaySource(args.replay) if args.replay else None
+                result = run_video(resolution, pattern, video_format, pixel_format,
+                                   args.frames, args.sink, args.workers, source=source)
+                print(f"{resolution} {pattern} -> {video_format} {pixel_format}: {result['fps']:.1f} fps, "
+                      f"total p99 {result['latency_ms']['total']['p99']:.1f} ms", file=sys.stderr)
+                report["video"].append(result)
+    if args.cadence_seconds > 0:
+        report["cadence"] = [run_cadence(video_format, args.cadence_seconds, args.capture_ppm)
+                             for video_format in args.formats]
+    if args.audio_seconds > 0:
+        report["audio"] = run_audio(args.audio_seconds, drift_ppm=args.drift_ppm,
+                                    output_rates=[args.output_rate] if args.output_rate else None)
+    report["peak_rss_mb"] = peak_rss_mb()
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
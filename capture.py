@@ -0,0 +1,255 @@
+import ctypes
+import sys
+import threading
+import time
+
+import mss
+
+from frames import FramePool, frame_from_shot
+from instrumentation import LatencyHistogram
+
+MIN_ROI_SIZE = 5
+
+
+def capture_region(monitor, roi_coords):
+    """Return the mss region for a monitor, cropped to the ROI if it is usable."""
+    if roi_coords:
+        x1, y1, x2, y2 = roi_coords
+        width, height = x2 - x1, y2 - y1
+        if width > MIN_ROI_SIZE and height > MIN_ROI_SIZE:
+            return {
+                "top": monitor["top"] + y1,
+                "left": monitor["left"] + x1,
+                "width": width,
+                "height": height,
+            }
+    return monitor
+
+
+class FrameRing:
+    """Fixed-size ring of the most recent frames with drop-oldest semantics.
+
+    The capture thread pushes, the preview peeks at the newest frame and the
+    PGM path consumes frames either in order with `wait_next` or, on its
+    output cadence, newest first with `take`. A frame that is pushed out of
+    the ring before the consumer reached it is counted as dropped.
+
+    The ring owns one reference to every frame it holds; frames returned by
+    `latest`, `wait_next` and `take` are retained for the caller, who must
+    release them.
+    """
+
+    def __init__(self, capacity=4):
+        if capacity < 1:
+            raise ValueError("FrameRing capacity must be at least 1")
+        self.capacity = capacity
+        self._slots = [None] * capacity
+        self._next_seq = 0
+        self._consumed_seq = -1
+        self._cond = threading.Condition()
+        self.pushed = 0
+        self.dropped = 0
+
+    def next_seq(self):
+        with self._cond:
+            seq = self._next_seq
+            self._next_seq += 1
+            return seq
+
+    def push(self, frame):
+        """Publish a frame, evicting (and releasing) the oldest one when full."""
+        with self._cond:
+            index = frame.seq % self.capacity
+            evicted = self._slots[index]
+            if evicted is not None and evicted.seq > self._consumed_seq:
+                self.dropped += 1
+            self._slots[index] = frame
+            self.pushed += 1
+            self._cond.notify_all()
+        if evicted is not None:
+            evicted.release()
+
+    def latest(self):
+        """Return the newest frame without consuming it."""
+        with self._cond:
+            newest = None
+            for frame in self._slots:
+                if frame is not None and (newest is None or frame.seq > newest.seq):
+                    newest = frame
+            return newest.retain() if newest is not None else None
+
+    def wait_next(self, timeout=None):
+        """Consume the oldest frame not yet consumed, waiting up to `timeout`."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while True:
+                pending = [f for f in self._slots if f is not None and f.seq > self._consumed_seq]
+                if pending:
+                    frame = min(pending, key=lambda f: f.seq)
+                    self._consumed_seq = frame.seq
+                    return frame.retain()
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return None
+                self._cond.wait(remaining)
+
+    def take(self, not_after):
+        """Consume the newest frame stamped at or before `not_after`.
+
+        Returns (frame, skipped): the frame (None if no pending frame is that
+        old) and the number of older pending frames passed over with it.
+        Newer frames stay pending.
+        """
+        with self._cond:
+            pending = [f for f in self._slots
+                       if f is not None and f.seq > self._consumed_seq and f.timestamp <= not_after]
+            if not pending:
+                return None, 0
+            frame = max(pending, key=lambda f: f.seq)
+            self._consumed_seq = frame.seq
+            return frame.retain(), len(pending) - 1
+
+    def clear(self):
+        with self._cond:
+            frames, self._slots = self._slots, [None] * self.capacity
+            self._consumed_seq = self._next_seq - 1
+        for frame in frames:
+            if frame is not None:
+                frame.release()
+
+
+def cursor_position():
+    """Desktop (x, y) of the mouse pointer, or None where it cannot be read.
+
+    Only implemented for Windows (GetCursorPos); elsewhere captures carry no
+    pointer position and the cursor overlay draws nothing.
+    """
+    if sys.platform != "win32":
+        return None
+    point = (ctypes.c_long * 2)()
+    if not ctypes.windll.user32.GetCursorPos(point):
+        return None
+    return point[0], point[1]
+
+
+class ScreenSource:
+    """Frame source that grabs a monitor (or an ROI on it) with mss.
+
+    mss handles are not safe to share between threads, so `open` is called
+    on the capture thread and the instance is private to it.
+    """
+
+    def __init__(self):
+        self._sct = None
+
+    def open(self):
+        self._sct = mss.mss()
+
+    def close(self):
+        if self._sct is not None:
+            self._sct.close()
+            self._sct = None
+
+    def grab(self, pool, monitor_index, roi_coords):
+        monitor = self._sct.monitors[monitor_index + 1]
+        frame = frame_from_shot(pool, self._sct.grab(capture_region(monitor, roi_coords)))
+        frame.cursor = cursor_position()
+        return frame
+
+
+class CaptureEngine:
+    """Grabs the selected monitor/ROI on a dedicated thread at a fixed cadence.
+
+    The grab itself is delegated to a source (ScreenSource by default; the
+    benchmarks substitute synthetic ones) which copies into pooled buffers.
+    Frames are timestamped and published into a FrameRing; grabs that finish
+    after their deadline are counted as late. Grab durations go into the
+    `grab_time` histogram.
+
+    A source whose grab returns None has no more frames (a recording played
+    to its end): capture then stops by itself and sets `finished`.
+    """
+
+    def __init__(self, rate=25.0, ring_capacity=4, source=None):
+        self.source = source if source is not None else ScreenSource()
+        self.ring = FrameRing(ring_capacity)
+        # Ring slots plus a few frames in flight with consumers.
+        self.pool = FramePool(max_free=ring_capacity + 4)
+        self.rate = rate
+        self.late = 0
+        self.errors = 0
+        self.finished = False
+        self.grab_time = LatencyHistogram()
+        self._source = (0, None)
+        self._thread = None
+        self._running = threading.Event()
+
+    def set_source(self, monitor_index, roi_coords=None):
+        # A single tuple assignment so the capture thread never sees a
+        # monitor index paired with a stale ROI.
+        self._source = (monitor_index, roi_coords)
+
+    def set_rate(self, rate):
+        self.rate = float(rate)
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self.finished = False
+        self._running.set()
+        self._thread = threading.Thread(target=self._run, name="capture", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=1.0):
+        self._running.clear()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    @property
+    def running(self):
+        return self._running.is_set()
+
+    def _run(self):
+        try:
+            self.source.open()
+        except Exception as e:
+            self.errors += 1
+            print("Capture error:", e)
+            self._running.clear()
+            return
+        try:
+            next_deadline = time.monotonic()
+            while self._running.is_set():
+                period = 1.0 / self.rate
+                monitor_index, roi_coords = self._source
+                try:
+                    # Stamped when the grab starts, which is when the
+                    # picture was sampled; audio is stamped on the same clock.
+                    grabbed_at = time.monotonic()
+                    started = time.perf_counter()
+                    frame = self.source.grab(self.pool, monitor_index, roi_coords)
+                    if frame is None:
+                        self.finished = True
+                        self._running.clear()
+                        break
+                    self.grab_time.observe(time.perf_counter() - started)
+                    now = time.monotonic()
+                    frame.seq = self.ring.next_seq()
+                    frame.timestamp = grabbed_at
+                    self.ring.push(frame)
+                except Exception as e:
+                    self.errors += 1
+                    print("Capture error:", e)
+                    now = time.monotonic()
+
+                next_deadline += period
+                if now > next_deadline:
+                    # The grab overran its slot; skip ahead instead of trying
+                    # to catch up with a burst of back-to-back grabs.
+                    self.late += 1
+                    next_deadline = now
+                else:
+                    time.sleep(next_deadline - now)
+        finally:
+            self.source.close()
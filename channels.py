@@ -0,0 +1,319 @@
+"""Several independent capture/convert channels, one worker process each.
+
+A channel is one monitor (and optional ROI) converted to one signal format
+and sent to one sink, for example a second PGM feed to "Decklink 2". Each
+channel runs a video-only ScanConverterEngine in its own process, so
+channels scale across cores instead of sharing one GIL, and a crash in one
+channel cannot take the others down.
+
+ChannelSupervisor starts the workers, collects their stats over a pipe per
+worker (so one killed mid-send cannot corrupt another's reports) and
+restarts any worker that exits or stops reporting, with exponential back-off
+for a channel that keeps failing.
+
+    python -m channels channels.json
+
+where channels.json is a list of channel objects, e.g.
+
+    [{"name": "pgm1", "monitor": 1, "format": "1920x1080 50i", "sink": "shm"},
+     {"name": "pgm2", "monitor": 2, "roi": [0, 0, 1280, 720], "format": "1280x720 50p", "sink": "shm"}]
+
+Monitors are numbered from 1, as in the headless CLI. "workers" sets a
+channel's conversion threads (default 2, since channels share the cores).
+"""
+import argparse
+import json
+import multiprocessing
+import multiprocessing.connection
+import signal
+import sys
+import threading
+import time
+from collections import namedtuple
+
+from formats import SIGNAL_FORMATS, parse_format
+
+ChannelConfig = namedtuple(
+    "ChannelConfig",
+    ["name", "monitor", "roi", "video_format", "pixel_format", "sink", "sink_options", "workers"],
+    defaults=[0, None, SIGNAL_FORMATS[0], "uyvy", "null", None, 2],
+)
+ChannelConfig.__doc__ = """One channel; `monitor` is 0-based and `roi` is (x1, y1, x2, y2) or None."""
+
+
+def _run_channel(config, stats_pipe, stop_event, interval):
+    """Worker process entry point: run one channel until told to stop."""
+    # The supervisor handles Ctrl+C; workers stop through `stop_event`.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    from engine import ScanConverterEngine
+
+    engine = ScanConverterEngine(config.monitor, config.roi, config.video_format, config.pixel_format,
+                                 workers=config.workers)
+    try:
+        engine.start()
+        engine.start_program(config.sink, **(config.sink_options or {}))
+        while not stop_event.wait(interval):
+            stats_pipe.send(engine.stats())
+            if not engine.capture.running:
+                # The capture thread gave up (e.g. the monitor went away);
+                # exit so the supervisor restarts the channel.
+                sys.exit(1)
+    finally:
+        engine.close()
+
+
+class _Worker:
+    def __init__(self, config):
+        self.config = config
+        self.process = None
+        self.stop_event = None
+        # Receiving end of the pipe the current process reports over.
+        self.conn = None
+        self.started = 0.0
+        self.last_report = 0.0
+        self.restart_at = 0.0
+        self.restarts = 0
+        self.failures = 0
+        self.last_exitcode = None
+        self.stats = None
+
+
+class ChannelSupervisor:
+    """Runs each channel in a worker process and restarts the ones that die.
+
+    A worker counts as failed when its process exits, or when it sends no
+    stats for `stall_timeout` seconds (it is then terminated). A failed
+    channel is restarted after `restart_delay` seconds, doubling for every
+    failure in a row up to `max_restart_delay`; a channel that ran for a
+    minute is healthy again. Other channels are never touched.
+    """
+
+    def __init__(self, configs=(), stats_interval=1.0, stall_timeout=10.0, restart_delay=1.0, max_restart_delay=30.0):
+        self.stats_interval = stats_interval
+        self.stall_timeout = stall_timeout
+        self.restart_delay = restart_delay
+        self.max_restart_delay = max_restart_delay
+        # Spawned rather than forked: capture handles and thread pools do not
+        # survive a fork, and spawn is what Windows does anyway.
+        self._context = multiprocessing.get_context("spawn")
+        self._workers = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._running = threading.Event()
+        for config in configs:
+            self.add_channel(config)
+
+    def add_channel(self, config):
+        with self._lock:
+            if config.name in self._workers:
+                raise ValueError(f"Duplicate channel name: {config.name!r}")
+            worker = self._workers[config.name] = _Worker(config)
+            if self._running.is_set():
+                self._spawn(worker)
+
+    def remove_channel(self, name, timeout=5.0):
+        with self._lock:
+            worker = self._workers.pop(name)
+        self._halt(worker, timeout)
+
+    @property
+    def channels(self):
+        return [w.config for w in self._workers.values()]
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._running.set()
+        with self._lock:
+            for worker in self._workers.values():
+                self._spawn(worker)
+        self._thread = threading.Thread(target=self._run, name="supervisor", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5.0):
+        self._running.clear()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        with self._lock:
+            workers = list(self._workers.values())
+        for worker in workers:
+            if worker.stop_event is not None:
+                worker.stop_event.set()
+        for worker in workers:
+            self._halt(worker, timeout)
+
+    @property
+    def running(self):
+        return self._running.is_set()
+
+    def _spawn(self, worker):
+        self._close_pipe(worker)
+        # A fresh pipe per process: whatever a killed one left half-written
+        # goes away with its pipe, and late reports cannot reach the new one.
+        worker.conn, sender = self._context.Pipe(duplex=False)
+        worker.stop_event = self._context.Event()
+        worker.process = self._context.Process(
+            target=_run_channel, name=f"channel-{worker.config.name}",
+            args=(worker.config, sender, worker.stop_event, self.stats_interval),
+            daemon=True)
+        worker.process.start()
+        # Only the worker writes; without this copy the pipe sees EOF when it exits.
+        sender.close()
+        worker.started = worker.last_report = time.monotonic()
+
+    @staticmethod
+    def _close_pipe(worker):
+        conn, worker.conn = worker.conn, None
+        if conn is not None:
+            conn.close()
+
+    def _halt(self, worker, timeout):
+        process = worker.process
+        if process is None:
+            return
+        worker.stop_event.set()
+        process.join(timeout)
+        if process.is_alive():
+            process.terminate()
+            process.join(1.0)
+        worker.last_exitcode = process.exitcode
+        worker.process = None
+        self._close_pipe(worker)
+
+    def _drain(self):
+        with self._lock:
+            pipes = {w.conn: w for w in self._workers.values() if w.conn is not None}
+        if not pipes:
+            time.sleep(0.2)
+            return
+        try:
+            ready = multiprocessing.connection.wait(list(pipes), timeout=0.2)
+        except OSError:
+            return  # A pipe was closed meanwhile; the next round skips it.
+        for conn in ready:
+            worker = pipes[conn]
+            try:
+                while conn.poll():
+                    worker.stats = conn.recv()
+                    worker.last_report = time.monotonic()
+            except Exception as e:
+                # The worker exited, or died mid-send; _check restarts it.
+                if not isinstance(e, (EOFError, OSError)):
+                    print(f"Bad stats from channel {worker.config.name!r}: {e}")
+                with self._lock:
+                    if worker.conn is conn:
+                        self._close_pipe(worker)
+
+    def _check(self, worker, now):
+        process = worker.process
+        if process is None:
+            if now >= worker.restart_at:
+                worker.restarts += 1
+                print(f"Restarting channel {worker.config.name!r} (restart {worker.restarts})")
+                self._spawn(worker)
+            return
+        stalled = now - worker.last_report > self.stall_timeout
+        if process.is_alive() and not stalled:
+            if now - worker.started > 60.0:
+                worker.failures = 0
+            return
+        if stalled and process.is_alive():
+            print(f"Channel {worker.config.name!r} stopped reporting; terminating it")
+            process.terminate()
+        process.join(1.0)
+        worker.last_exitcode = process.exitcode
+        worker.process = None
+        self._close_pipe(worker)
+        delay = min(self.max_restart_delay, self.restart_delay * 2 ** worker.failures)
+        worker.failures += 1
+        worker.restart_at = now + delay
+        print(f"Channel {worker.config.name!r} failed (exit code {worker.last_exitcode}); "
+              f"restarting in {delay:.1f} s")
+
+    def _run(self):
+        while self._running.is_set():
+            self._drain()
+            now = time.monotonic()
+            with self._lock:
+                if not self._running.is_set():
+                    break
+                for worker in self._workers.values():
+                    self._check(worker, now)
+
+    def stats(self):
+        with self._lock:
+            workers = list(self._workers.values())
+        return {
+            "time": time.time(),
+            "channels": {
+                w.config.name: {
+                    "pid": w.process.pid if w.process is not None else None,
+                    "alive": w.process is not None and w.process.is_alive(),
+                    "restarts": w.restarts,
+                    "last_exitcode": w.last_exitcode,
+                    "stats": w.stats,
+                }
+                for w in workers
+            },
+        }
+
+
+def load_channels(path):
+    """Read channel definitions from a JSON file (see the module docstring)."""
+    from shm_sink import DEFAULT_NAME
+
+    with open(path) as f:
+        entries = json.load(f)
+    configs = []
+    for i, entry in enumerate(entries):
+        name = entry.get("name") or f"channel{i + 1}"
+        video_format = entry.get("format", SIGNAL_FORMATS[0])
+        parse_format(video_format)  # Fail on a bad format here, not in the worker.
+        roi = tuple(entry["roi"]) if entry.get("roi") else None
+        sink = entry.get("sink", "null")
+        options = dict(entry.get("sink_options", {}))
+        if sink == "shm":
+            # Every channel needs its own block (which has its own port).
+            options.setdefault("name", f"{DEFAULT_NAME}_{name}")
+        elif sink == "record":
+            # And its own segment names, should the channels share a directory.
+            options.setdefault("prefix", name)
+        configs.append(ChannelConfig(
+            name, entry.get("monitor", 1) - 1, roi, video_format, entry.get("pixel_format", "uyvy"),
+            sink, options, entry.get("workers", 2)))
+    return configs
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m channels", description="Run several scan converter channels")
+    parser.add_argument("config", help="JSON file with a list of channels")
+    parser.add_argument("--duration", type=float, help="stop after this many seconds")
+    parser.add_argument("--stats-interval", type=float, default=5.0, help="seconds between stats lines")
+    args = parser.parse_args(argv)
+
+    supervisor = ChannelSupervisor(load_channels(args.config))
+    stopping = []
+    signal.signal(signal.SIGINT, lambda *_: stopping.append(True))
+    signal.signal(signal.SIGTERM, lambda *_: stopping.append(True))
+
+    supervisor.start()
+    started = time.monotonic()
+    next_stats = started + args.stats_interval
+    try:
+        while not stopping:
+            now = time.monotonic()
+            if args.duration is not None and now - started >= args.duration:
+                break
+            if now >= next_stats:
+                print(json.dumps(supervisor.stats()), flush=True)
+                next_stats += args.stats_interval
+            time.sleep(0.05)
+        print(json.dumps(supervisor.stats()), flush=True)
+    finally:
+        supervisor.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
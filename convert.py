@@ -0,0 +1,559 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+from change_detect import TileChangeDetector
+from formats import frame_rate, parse_format
+from instrumentation import LatencyHistogram
+from overlay import composite
+
+PIXEL_FORMATS = ("uyvy", "v210")
+
+# BT.709 RGB -> limited-range Y'CbCr, 8-bit scale. Rows are Y, Cb, Cr and
+# columns R, G, B; v210 output uses the same matrix scaled by 4.
+BT709_MATRIX = np.array([
+    [0.1826, 0.6142, 0.0620],
+    [-0.1006, -0.3386, 0.4392],
+    [0.4392, -0.3989, -0.0403],
+], dtype=np.float32)
+BT709_OFFSET = np.array([16.0, 128.0, 128.0], dtype=np.float32)
+
+# Component order of one packing group, as (component, pixel) pairs where
+# chroma is indexed per pixel pair. v210 packs each run of three into a
+# 32-bit word; UYVY stores them as bytes.
+PACKING = {
+    "uyvy": [(1, 0), (0, 0), (2, 0), (0, 1)],
+    "v210": [(1, 0), (0, 0), (2, 0), (0, 1), (1, 1), (0, 2),
+             (2, 1), (0, 3), (1, 2), (0, 4), (2, 2), (0, 5)],
+}
+
+# Pixels per packing group. The active picture starts on a group boundary;
+# a v210 picture whose width is not a multiple of 6 is padded with black into
+# the line's trailing padding or the pillarbox bar.
+PIXEL_GROUPS = {"uyvy": 2, "v210": 6}
+
+# Output tiles (rows, pixels) that are reconverted or reused as a unit. The
+# height is even so field parity is the same in every tile and the width is a
+# whole number of groups for both pixel formats.
+OUTPUT_TILE = (32, 96)
+
+# A scaled picture is resampled in horizontal spans of this many tiles,
+# always the same spans, since the resampler's output depends on the box
+# it is given (see ScanConverter._scaled). Wide enough that a full redraw
+# costs no more than resampling whole rows.
+SCALE_SPAN = 4
+
+
+def packing_matrix(pixel_format):
+    """Matrix and offset mapping a group of BGRA pixels straight to packed order.
+
+    Multiplying (n, group * 4) float BGRA by the matrix yields the components
+    in their final byte/word order, so colour conversion, 4:2:2 chroma
+    averaging and packing are a single matmul per band.
+    """
+    order = PACKING[pixel_format]
+    group = PIXEL_GROUPS[pixel_format]
+    scale = 1.0 if pixel_format == "uyvy" else 4.0
+    matrix = np.zeros((group * 4, len(order)), dtype=np.float32)
+    offset = np.empty(len(order), dtype=np.float32)
+    for column, (component, index) in enumerate(order):
+        # Captures are BGRA: R, G, B coefficients go to channels 2, 1, 0.
+        coeffs = BT709_MATRIX[component, ::-1] * scale
+        if component == 0:
+            pixels = [index]
+        else:
+            pixels = [index * 2, index * 2 + 1]
+            coeffs = coeffs / 2
+        for pixel in pixels:
+            matrix[pixel * 4:pixel * 4 + 3, column] = coeffs
+        # +0.5 so the truncating casts when storing round to nearest.
+        offset[column] = BT709_OFFSET[component] * scale + 0.5
+    return matrix, offset
+
+
+def unpack_to_bgra(data, width, pixel_format, out=None):
+    """Decode a packed (height, stride) UYVY or v210 picture back to BGRA.
+
+    The inverse of `packing_matrix`: one matmul maps each packing group's
+    components to its BGR pixels, repeating chroma for both pixels of a
+    pair and expanding BT.709 limited range to full-range RGB. Used to
+    replay recordings through the pipeline.
+    """
+    height = data.shape[0]
+    order = PACKING[pixel_format]
+    group = PIXEL_GROUPS[pixel_format]
+    groups = -(-width // group)
+    if pixel_format == "uyvy":
+        comps = data[:, :groups * len(order)].reshape(-1, len(order)).astype(np.float32)
+        scale = 1.0
+    else:
+        words = data.view(np.uint32)[:, :groups * 4]
+        comps = np.empty((height, groups * 4, 3), dtype=np.float32)
+        for i, shift in enumerate((0, 10, 20)):
+            comps[..., i] = (words >> shift) & 1023
+        comps = comps.reshape(-1, len(order))
+        scale = 4.0
+    inverse = np.linalg.inv(BT709_MATRIX)[::-1]  # rows B, G, R
+    matrix = np.zeros((len(order), group * 3), dtype=np.float32)
+    offset = np.zeros(len(order), dtype=np.float32)
+    for column, (component, index) in enumerate(order):
+        pixels = [index] if component == 0 else [index * 2, index * 2 + 1]
+        for pixel in pixels:
+            matrix[column, pixel * 3:pixel * 3 + 3] = inverse[:, component] / scale
+        offset[column] = BT709_OFFSET[component] * scale
+    comps -= offset
+    bgr = comps @ matrix
+    bgr += 0.5
+    np.clip(bgr, 0, 255, out=bgr)
+    if out is None:
+        out = np.empty((height, width, 4), dtype=np.uint8)
+    out[..., :3] = bgr.reshape(height, -1, 3)[:, :width]
+    out[..., 3] = 255
+    return out
+
+
+def v210_stride(width):
+    """Bytes per v210 line: 48 pixels per 128-byte block, as the SDK expects."""
+    return (width + 47) // 48 * 128
+
+
+def line_stride(width, pixel_format):
+    """Bytes per packed output line for a pixel format."""
+    if pixel_format == "uyvy":
+        return width * 2
+    return v210_stride(width)
+
+
+def fit_letterbox(src_width, src_height, dst_width, dst_height, align=2):
+    """Return (x, y, width, height) of the largest aspect-correct fit of the
+    source inside the destination raster, centred with x aligned to `align`
+    and an even width.
+    """
+    scale = min(dst_width / src_width, dst_height / src_height)
+    width = max(2, min(dst_width, round(src_width * scale)) // 2 * 2)
+    height = max(2, min(dst_height, round(src_height * scale)))
+    x = (dst_width - width) // 2 // align * align
+    y = (dst_height - height) // 2
+    return x, y, width, height
+
+
+class ScanConverter:
+    """Converts captured BGRA frames to one broadcast raster.
+
+    The ROI is scaled with PIL's antialiasing bilinear filter and letterboxed
+    into the raster of `video_format`, then converted with BT.709 to 8-bit
+    UYVY or 10-bit v210 and packed by one vectorized matmul (see
+    `packing_matrix`). Work is split into horizontal bands on a thread pool;
+    both PIL's resampler and NumPy's kernels release the GIL, so the bands
+    run on separate cores.
+
+    For interlaced formats each call converts one field from its own capture,
+    after a vertical [1, 2, 1] low-pass that suppresses interline twitter. The
+    top field comes first; `convert` returns a frame only once both fields
+    have been woven into it.
+
+    Static content is not reconverted: a TileChangeDetector (one per field
+    parity) finds the source tiles that changed since the last capture, and
+    only output tiles whose source footprint touches them are rendered; the
+    rest is carried over from the previous output. A scaled picture is
+    redrawn in fixed spans of SCALE_SPAN tiles, so what is carried over is
+    always what a full redraw would give. When nothing changed the previous output is
+    returned as-is. `stats()` reports the tile hit rate.
+
+    `overlays` (an OverlayStack) is keyed over the active picture. Its
+    placements are composited into the scaled blocks before packing, and
+    the tiles under any placement that changed since the previous output
+    (or the last field of the same parity) are rendered even when the
+    capture did not change there.
+
+    Every conversion is timed against the format's field/frame period, which
+    is the per-frame budget reported by `stats()`. Conversion times go into
+    the `convert_time` histogram; `scale_time` gets the resampling time per
+    conversion, summed over all worker threads.
+    """
+
+    def __init__(self, video_format, pixel_format="uyvy", workers=4, output_buffers=3, overlays=None):
+        if isinstance(video_format, str):
+            video_format = parse_format(video_format)
+        if pixel_format not in PIXEL_FORMATS:
+            raise ValueError(f"Unsupported pixel format: {pixel_format!r}")
+        self.format = video_format
+        self.pixel_format = pixel_format
+        self.budget = 1.0 / video_format.rate
+        self.workers = max(1, workers)
+        self._pool = ThreadPoolExecutor(self.workers, thread_name_prefix="convert") if self.workers > 1 else None
+
+        self.stride = line_stride(video_format.width, pixel_format)
+        self._matrix, self._offset = packing_matrix(pixel_format)
+        # Output buffers rotate so a sink can still be reading the previous
+        # frame while the next one is being converted into another buffer.
+        self._outputs = [self._black_buffer() for _ in range(output_buffers)]
+        self._out_index = 0
+        self._last_output = None
+        self._touched = False
+        self._field = 0
+        self._detectors = [TileChangeDetector() for _ in range(2 if video_format.interlaced else 1)]
+        self.overlays = overlays
+        self._placements = []
+        self._overlay_state = [frozenset() for _ in self._detectors]
+
+        self._geometry_key = None
+        self.frames = 0
+        self.reused_frames = 0
+        self.tiles_checked = 0
+        self.tiles_reused = 0
+        self.over_budget = 0
+        self.last_time = 0.0
+        self.avg_time = 0.0
+        self.max_time = 0.0
+        self.convert_time = LatencyHistogram()
+        self.scale_time = LatencyHistogram()
+
+    def _black_buffer(self):
+        height = self.format.height
+        buf = np.empty((height, self.stride), dtype=np.uint8)
+        if self.pixel_format == "uyvy":
+            buf.reshape(height, -1, 4)[:] = (128, 16, 128, 16)
+        else:
+            words = buf.view(np.uint32)
+            cb, y, cr = 512, 64, 512
+            pattern = np.array([
+                cb | (y << 10) | (cr << 20),
+                y | (cb << 10) | (y << 20),
+                cr | (y << 10) | (cb << 20),
+                y | (cr << 10) | (y << 20),
+            ], dtype=np.uint32)
+            words.reshape(height, -1, 4)[:] = pattern
+        return buf
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+            self._pool = None
+
+    def _prepare(self, src_width, src_height):
+        key = (src_width, src_height)
+        if key == self._geometry_key:
+            return
+        self._geometry_key = key
+        x, y, width, height = fit_letterbox(src_width, src_height, self.format.width, self.format.height,
+                                            PIXEL_GROUPS[self.pixel_format])
+        self.active = (x, y, width, height)
+        self._identity = (src_width, src_height) == (width, height)
+        self._xscale = src_width / width
+        self._yscale = src_height / height
+        # Letterbox bars changed: start from clean black buffers.
+        self._outputs = [self._black_buffer() for _ in self._outputs]
+        self._last_output = None
+        self._field = 0
+
+        tile_height, tile_width = OUTPUT_TILE
+        self._tile_rows = [(a, min(a + tile_height, height)) for a in range(0, height, tile_height)]
+        self._tile_cols = [(a, min(a + tile_width, width)) for a in range(0, width, tile_width)]
+        # Source-tile footprint of every output tile, widened by the
+        # resampler's support and the interlace filter's neighbouring lines.
+        detector = self._detectors[0]
+        ymargin = 2 * max(1.0, self._yscale) + 1
+        xmargin = max(1.0, self._xscale) + 1
+        self._footprint_rows = self._footprint(self._tile_rows, self._yscale, ymargin, src_height, detector.tile_height)
+        self._footprint_cols = self._footprint(self._tile_cols, self._xscale, xmargin, src_width, detector.tile_width)
+        for detector in self._detectors:
+            detector.reset()
+        if self.overlays is not None:
+            self.overlays.prepare(width, height, width / src_width, frame_rate(self.format))
+        self._overlay_state = [frozenset() for _ in self._detectors]
+
+    @staticmethod
+    def _footprint(spans, scale, margin, src_len, tile):
+        starts = np.array([a for a, _ in spans], dtype=np.float64) * scale - margin
+        stops = np.array([b for _, b in spans], dtype=np.float64) * scale + margin
+        starts = np.clip(np.floor(starts), 0, src_len - 1).astype(np.intp) // tile
+        stops = (np.clip(np.ceil(stops), 1, src_len).astype(np.intp) - 1) // tile + 1
+        return starts, stops
+
+    def _dirty_tiles(self, changed):
+        """Map a source changed-tile mask onto the output tile grid."""
+        shape = (len(self._tile_rows), len(self._tile_cols))
+        if changed is None:
+            return np.ones(shape, dtype=bool)
+        # Summed-area table: the change count inside any rectangle of source
+        # tiles is four lookups, done for all output tiles at once.
+        table = np.zeros((changed.shape[0] + 1, changed.shape[1] + 1), dtype=np.int32)
+        np.cumsum(np.cumsum(changed, axis=0), axis=1, out=table[1:, 1:])
+        r0, r1 = self._footprint_rows
+        c0, c1 = self._footprint_cols
+        counts = (table[np.ix_(r1, c1)] - table[np.ix_(r0, c1)]
+                  - table[np.ix_(r1, c0)] + table[np.ix_(r0, c0)])
+        return counts > 0
+
+    def _overlay_tiles(self, placements, parity):
+        """Output tiles under placements that appeared, moved, changed or went away."""
+        current = frozenset((p.key, p.x, p.y) + p.sprite.color.shape[:2] for p in placements)
+        changed = current ^ self._overlay_state[parity]
+        self._overlay_state[parity] = current
+        mask = np.zeros((len(self._tile_rows), len(self._tile_cols)), dtype=bool)
+        tile_height, tile_width = OUTPUT_TILE
+        for _, x, y, height, width in changed:
+            # One line of margin for the interlace filter's neighbours.
+            y, height = y - 1, height + 2
+            rows = slice(max(0, y) // tile_height, max(0, -(-(y + height) // tile_height)))
+            cols = slice(max(0, x) // tile_width, max(0, -(-(x + width) // tile_width)))
+            mask[rows, cols] = True
+        return mask
+
+    def _scaled(self, src, start, stop, left, right):
+        """Float32 BGRA block [start:stop, left:right] of the scaled picture."""
+        if self._identity:
+            return np.asarray(src)[start:stop, left:right].astype(np.float32)
+        # PIL derives its filter taps from the box, so the same output pixel
+        # can come out an LSB apart from different boxes, anywhere in the
+        # block. Blocks are whole spans of SCALE_SPAN tiles (see convert and
+        # _blocks), each of which always gets the same box.
+        box = (left * self._xscale, start * self._yscale, right * self._xscale, stop * self._yscale)
+        block = src.resize((right - left, stop - start), Image.BILINEAR, box=box)
+        return np.asarray(block, dtype=np.float32)
+
+    def _render_block(self, src, out, rows, cols, field):
+        """Render one block into `out`; returns the time spent resampling."""
+        x, y, width, height = self.active
+        start, stop = rows
+        left, right = cols
+        started = time.perf_counter()
+        if field is None:
+            bgra = self._scaled(src, start, stop, left, right)
+            scale_time = time.perf_counter() - started
+            composite(bgra, start, left, self._placements)
+            out_rows = slice(y + start, y + stop)
+        else:
+            # Only this field's lines, each low-passed with its neighbours.
+            first = start + ((y + start + field) % 2)
+            if first >= stop:
+                return 0.0
+            last = stop - 1 - ((stop - 1 - first) % 2)
+            lo, hi = max(first - 1, 0), min(last + 2, height)
+            scaled = self._scaled(src, lo, hi, left, right)
+            scale_time = time.perf_counter() - started
+            # Keyed before the interlace filter, so overlays do not twitter.
+            composite(scaled, lo, left, self._placements)
+            idx = np.arange(first - lo, last - lo + 1, 2)
+            bgra = scaled[idx]
+            bgra *= 2
+            bgra += scaled[np.maximum(idx - 1, 0)]
+            bgra += scaled[np.minimum(idx + 1, hi - lo - 1)]
+            bgra *= 0.25
+            out_rows = slice(y + first, y + last + 1, 2)
+
+        group = PIXEL_GROUPS[self.pixel_format]
+        block_width = right - left
+        groups = -(-block_width // group)
+        if groups * group != block_width:
+            bgra = np.pad(bgra, ((0, 0), (0, groups * group - block_width), (0, 0)))
+        packed = bgra.reshape(-1, group * 4) @ self._matrix
+        packed += self._offset
+        packed = packed.reshape(bgra.shape[0], -1)
+        if self.pixel_format == "uyvy":
+            out[out_rows, (x + left) * 2:(x + right) * 2] = packed
+        else:
+            comps = packed.astype(np.uint32).reshape(bgra.shape[0], -1, 3)
+            first_word = (x + left) // 6 * 4
+            words = out.view(np.uint32)[out_rows, first_word:first_word + groups * 4]
+            words[:] = comps[..., 0] | (comps[..., 1] << 10) | (comps[..., 2] << 20)
+        return scale_time
+
+    def _blocks(self, dirty):
+        """Merge dirty output tiles into one block per horizontal run, within a span when scaling."""
+        step = len(self._tile_cols) if self._identity else SCALE_SPAN
+        blocks = []
+        for (start, stop), row in zip(self._tile_rows, dirty):
+            for base in range(0, len(row), step):
+                part = row[base:base + step]
+                edges = np.flatnonzero(np.diff(np.concatenate(([False], part, [False])).astype(np.int8))) + base
+                for first, last in zip(edges[0::2], edges[1::2]):
+                    blocks.append(((start, stop), (self._tile_cols[first][0], self._tile_cols[last - 1][1])))
+        return blocks
+
+    def _run_blocks(self, src, out, blocks, field):
+        def run(chunk):
+            return sum(self._render_block(src, out, rows, cols, field) for rows, cols in chunk)
+
+        if self._pool is None or len(blocks) == 1:
+            return run(blocks)
+        chunks = [blocks[i::self.workers * 2] for i in range(self.workers * 2)]
+        return sum(future.result() for future in [self._pool.submit(run, chunk) for chunk in chunks if chunk])
+
+    def convert(self, frame):
+        """Convert one Frame; returns the packed output array or None.
+
+        The returned array belongs to the converter and is reused a few
+        frames later, so sinks must finish with it (or copy it) promptly.
+        None is returned after the first field of an interlaced frame.
+        """
+        started = time.perf_counter()
+        self._prepare(frame.width, frame.height)
+        out = self._outputs[self._out_index]
+        field = self._field if self.format.interlaced else None
+        if field is not None:
+            self._field ^= 1
+        if field != 1:
+            self._touched = False
+
+        dirty = self._dirty_tiles(self._detectors[field or 0].update(frame.data))
+        self._placements = self.overlays.place(frame, field) if self.overlays is not None else []
+        if self._placements or self._overlay_state[field or 0]:
+            dirty |= self._overlay_tiles(self._placements, field or 0)
+        if not self._identity:
+            # Redraw scaled tiles a whole span at a time; see _scaled.
+            rows, cols = dirty.shape
+            spans = np.pad(dirty, ((0, 0), (0, -cols % SCALE_SPAN))).reshape(rows, -1, SCALE_SPAN).any(axis=2)
+            dirty = np.repeat(spans, SCALE_SPAN, axis=1)[:, :cols]
+        self.tiles_checked += dirty.size
+        self.tiles_reused += dirty.size - int(np.count_nonzero(dirty))
+        if dirty.any():
+            if not self._touched:
+                # Unchanged tiles (and the other field) carry over from the
+                # previous output unless everything is about to be redrawn.
+                if self._last_output is not None and not (field is None and dirty.all()):
+                    np.copyto(out, self._last_output)
+                self._touched = True
+            # A zero-copy PIL view of the BGRA buffer. Channel order does not
+            # matter to the resampler; RGBX (not RGBA) avoids alpha premultiply.
+            src = frame.data if self._identity else Image.frombuffer("RGBX", frame.size, frame.data, "raw", "RGBX", 0, 1)
+            self.scale_time.observe(self._run_blocks(src, out, self._blocks(dirty), field))
+
+        result = None
+        if field != 0:
+            if self._touched:
+                result = self._last_output = out
+                self._out_index = (self._out_index + 1) % len(self._outputs)
+            else:
+                result = self._last_output
+                self.reused_frames += 1
+
+        elapsed = time.perf_counter() - started
+        self.convert_time.observe(elapsed)
+        self.last_time = elapsed
+        self.max_time = max(self.max_time, elapsed)
+        if self.frames:
+            self.avg_time += (elapsed - self.avg_time) * 0.05
+        else:
+            self.avg_time = elapsed
+        self.frames += 1
+        if elapsed > self.budget:
+            self.over_budget += 1
+        return result
+
+    def stats(self):
+        return {
+            "format": self.format.name,
+            "pixel_format": self.pixel_format,
+            "budget_ms": self.budget * 1000,
+            "last_ms": self.last_time * 1000,
+            "avg_ms": self.avg_time * 1000,
+            "max_ms": self.max_time * 1000,
+            "budget_usage": self.avg_time / self.budget,
+            "frames": self.frames,
+            "over_budget": self.over_budget,
+            "reused_frames": self.reused_frames,
+            "tile_hit_rate": self.tiles_reused / self.tiles_checked if self.tiles_checked else 0.0,
+        }
+
+
+class ConversionEngine:
+    """Drives the PGM path: consumes captured frames and feeds a sink.
+
+    Frames are taken in order from the capture ring, or with a `scheduler`
+    (an OutputScheduler) the newest frame at each tick of the output
+    cadence, repeating or dropping frames to keep it. Each converted output
+    is passed to `sink(output, frame)` on the conversion thread; the time the
+    sink takes goes into the `output_time` histogram.
+
+    If `frame_audio` is given, it is called as `frame_audio(frame, stamp,
+    timeout)` with each output frame and the capture time the output stands
+    for (the tick's cut-off when scheduled, else None for the frame's own
+    stamp), and returns the audio block that belongs to it (or None). It may
+    wait up to `timeout` seconds for late audio: when scheduled, the time
+    left before the next tick after allowing for its conversion, so waiting
+    for audio never delays the picture. Blocks are passed
+    to the sink's `audio(block, frame)` method if it has one; the time spent
+    waiting for them goes into `sync_time`.
+
+    `tap` (an OutputTap) is offered every output for the PGM preview, and
+    `overlays` (an OverlayStack) is keyed over the picture.
+    """
+
+    def __init__(self, ring, video_format, pixel_format="uyvy", sink=None, workers=4, frame_audio=None, tap=None,
+                 overlays=None, scheduler=None):
+        self.ring = ring
+        self.converter = ScanConverter(video_format, pixel_format, workers=workers, overlays=overlays)
+        self.sink = sink
+        self.frame_audio = frame_audio
+        self.tap = tap
+        self.scheduler = scheduler
+        self.errors = 0
+        self.output_time = LatencyHistogram()
+        self.sync_time = LatencyHistogram()
+        self._thread = None
+        self._running = threading.Event()
+
+    def start(self):
+        if self._thread is not None:
+            return
+        # Start from live frames, not whatever was queued before PGM started.
+        self.ring.clear()
+        if self.scheduler is not None:
+            self.scheduler.reset()
+        self._running.set()
+        self._thread = threading.Thread(target=self._run, name="convert", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=1.0):
+        self._running.clear()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        if self.scheduler is not None:
+            self.scheduler.close()
+        self.converter.close()
+
+    @property
+    def running(self):
+        return self._running.is_set()
+
+    def _run(self):
+        scheduler = self.scheduler
+        while self._running.is_set():
+            if scheduler is None:
+                frame, stamp = self.ring.wait_next(timeout=0.1), None
+            else:
+                deadline = scheduler.wait(self._running)
+                if deadline is None:
+                    break
+                frame, stamp = scheduler.pick(self.ring, deadline)
+            if frame is None:
+                continue
+            try:
+                output = self.converter.convert(frame)
+                if output is not None and self.sink is not None:
+                    started = time.perf_counter()
+                    self.sink(output, frame)
+                    self.output_time.observe(time.perf_counter() - started)
+                if output is not None and self.tap is not None:
+                    self.tap.offer(output, self.converter.format.width, self.converter.pixel_format)
+                if output is not None and self.frame_audio is not None:
+                    started = time.perf_counter()
+                    if scheduler is None:
+                        timeout = self.converter.budget
+                    else:
+                        timeout = scheduler.slack(self.converter.avg_time)
+                    block = self.frame_audio(frame, stamp, timeout)
+                    self.sync_time.observe(time.perf_counter() - started)
+                    if block is not None and hasattr(self.sink, "audio"):
+                        self.sink.audio(block, frame)
+            except Exception as e:
+                self.errors += 1
+                print("PGM error:", e)
+            finally:
+                frame.release()
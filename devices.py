@@ -0,0 +1,146 @@
+"""Background discovery of monitors, audio devices and DeckLink cards.
+
+Enumerating devices means importing mss and sounddevice, initialising
+PortAudio and querying every host API, which is slow enough to hold up the
+first window by a noticeable amount. DeviceInventory does it on a worker
+thread instead and keeps the result in memory and in a small JSON cache on
+disk. The GUI fills its menus from the cache straight away and switches to
+the live result when the scan finishes. `scan(rescan=True)` re-initialises
+PortAudio so hot-plugged devices show up, and replaces the cache.
+
+This module only imports the standard library at load time; the device
+libraries are imported by the worker.
+"""
+import json
+import os
+import tempfile
+import threading
+import time
+
+CACHE_PATH = os.path.join(tempfile.gettempdir(), "scanconverter_devices.json")
+
+# Device fields kept in the inventory; sounddevice returns more.
+AUDIO_FIELDS = ("index", "name", "hostapi", "max_input_channels", "max_output_channels", "default_samplerate",
+                "default_low_input_latency", "default_low_output_latency")
+
+
+def decklink_devices():
+    # This should use the DeckLink SDK via Python bindings.
+    # For now, let's mock the result:
+    # return ["DeckLink 4K Extreme", "DeckLink Mini Recorder"]
+    # If no devices:
+    # return []
+    return []
+
+
+def reinitialize_portaudio(sd):
+    """Restart PortAudio so it enumerates devices afresh; False if that is not possible.
+
+    PortAudio only scans devices in Pa_Initialize, and sounddevice exposes
+    no public way to call it again. Its private _terminate/_initialize do
+    exactly that but may change between releases, so they are only used if
+    present and anything else falls back to querying the devices PortAudio
+    already knows (hot-plugged devices then need a restart).
+    """
+    terminate = getattr(sd, "_terminate", None)
+    initialize = getattr(sd, "_initialize", None)
+    if not callable(terminate) or not callable(initialize):
+        return False
+    terminate()
+    initialize()
+    return True
+
+
+class DeviceInventory:
+    """Device lists gathered on a background thread, cached between runs.
+
+    `devices` is None until a cache is loaded or a scan finishes, then a dict
+    with "monitors", "hostapi", "inputs", "outputs", "decklink", "errors",
+    "scanned_at" and "cached" (True while it still comes from the disk
+    cache). Every update replaces the dict and bumps `version`, so a
+    consumer on another thread only has to compare versions.
+    """
+
+    def __init__(self, cache_path=CACHE_PATH):
+        self.cache_path = cache_path
+        self.devices = None
+        self.version = 0
+        self.scan_time = None
+        self._thread = None
+        self._done = threading.Event()
+
+    def load_cache(self):
+        """Publish the device lists saved by the last scan, if there are any."""
+        try:
+            with open(self.cache_path) as f:
+                devices = json.load(f)
+        except (OSError, ValueError):
+            return None
+        devices["cached"] = True
+        self._publish(devices)
+        return devices
+
+    def scan(self, rescan=False):
+        """Start enumerating devices in the background; no-op while one runs.
+
+        With `rescan`, PortAudio is re-initialised first (see
+        `reinitialize_portaudio`) so devices plugged in or removed since it
+        started are seen. That invalidates every open stream, so callers must
+        stop audio before rescanning.
+        """
+        if self.scanning:
+            return
+        self._done.clear()
+        self._thread = threading.Thread(target=self._run, args=(rescan,), name="device-scan", daemon=True)
+        self._thread.start()
+
+    @property
+    def scanning(self):
+        return self._thread is not None and self._thread.is_alive() and not self._done.is_set()
+
+    def wait(self, timeout=None):
+        """Block until the current scan is done; True if it finished."""
+        return self._done.wait(timeout)
+
+    def _publish(self, devices):
+        self.devices = devices
+        self.version += 1
+
+    def _run(self, rescan):
+        started = time.perf_counter()
+        # Imported here, off the GUI thread: these pull in mss, NumPy and
+        # (on first use) PortAudio.
+        from engine import _sounddevice, audio_devices, find_wasapi_hostapi, list_monitors
+
+        devices = {"monitors": [], "hostapi": -1, "inputs": [], "outputs": [], "decklink": [], "errors": {}}
+        try:
+            devices["monitors"] = [dict(m) for m in list_monitors()]
+        except Exception as e:
+            devices["errors"]["monitors"] = str(e)
+        try:
+            if rescan and not reinitialize_portaudio(_sounddevice()):
+                devices["errors"]["rescan"] = "this sounddevice cannot re-initialise PortAudio; restart to see new devices"
+            hostapi = find_wasapi_hostapi()
+            found = _sounddevice().query_devices()
+            devices["hostapi"] = hostapi
+            for kind in ("input", "output"):
+                devices[f"{kind}s"] = [{k: d[k] for k in AUDIO_FIELDS}
+                                       for d in audio_devices(kind, hostapi, devices=found)]
+        except Exception as e:
+            devices["errors"]["audio"] = str(e)
+        try:
+            devices["decklink"] = decklink_devices() or []
+        except Exception as e:
+            devices["errors"]["decklink"] = str(e)
+        devices["scanned_at"] = time.time()
+        devices["cached"] = False
+        self.scan_time = time.perf_counter() - started
+        try:
+            tmp = f"{self.cache_path}.tmp"
+            with open(tmp, "w") as f:
+                json.dump({k: v for k, v in devices.items() if k != "cached"}, f)
+            os.replace(tmp, self.cache_path)
+        except OSError as e:
+            print(f"Could not write device cache: {e}")
+        self._publish(devices)
+        self._done.set()
@@ -0,0 +1,509 @@
+import threading
+import time
+
+import mss
+
+from audio_format import CapabilityProbe, negotiate
+from audio_mix import MatrixMixer, MixMatrix
+from audio_ring import AudioRingBuffer
+from audio_route import InputPath, OutputPath
+from avsync import AVSync, StreamClock
+from capture import CaptureEngine
+from convert import ConversionEngine
+from formats import SIGNAL_FORMATS, frame_rate, parse_format
+from instrumentation import StatsFileWriter
+from metering import AudioMeter
+from overlay import OverlayStack
+from preview import OutputTap
+from recorder import RecordingSink
+from scheduler import OutputScheduler
+from shm_sink import SharedMemoryFrameSink
+
+
+def _sounddevice():
+    # Imported on first use so video-only and headless runs work on machines
+    # without a PortAudio library.
+    import sounddevice as sd
+    return sd
+
+
+def find_wasapi_hostapi():
+    """Index of the WASAPI host API, or -1 if there is none."""
+    try:
+        for i, api in enumerate(_sounddevice().query_hostapis()):
+            if 'WASAPI' in api['name']:
+                print(f"Found WASAPI host API at index: {i}")
+                return i
+    except Exception as e:
+        print(f"Could not query host APIs: {e}")
+    return -1
+
+
+def audio_devices(kind, hostapi=-1, devices=None):
+    """Input ("input") or output ("output") devices, WASAPI ones if available.
+
+    `devices` is a query_devices() result to filter instead of querying
+    PortAudio again. Errors propagate so callers can decide how to report
+    them.
+    """
+    key = f"max_{kind}_channels"
+    if devices is None:
+        devices = _sounddevice().query_devices()
+    if hostapi != -1:
+        return [d for d in devices if d['hostapi'] == hostapi and d[key] > 0]
+    return [d for d in devices if d[key] > 0]
+
+
+def list_monitors():
+    with mss.mss() as sct:
+        return sct.monitors[1:]  # mss.monitors[0] is all, [1:] are real
+
+
+class NullSink:
+    """Discards converted frames; useful for measuring the pipeline alone."""
+
+    def __init__(self, video_format=None, pixel_format=None):
+        self.frames = 0
+        self.audio_blocks = 0
+
+    def __call__(self, output, frame):
+        self.frames += 1
+
+    def audio(self, block, frame):
+        self.audio_blocks += 1
+
+    def close(self):
+        pass
+
+
+# PGM sinks selectable by name, e.g. from the command line. Each is built as
+# factory(video_format, pixel_format, **options).
+SINKS = {
+    "null": NullSink,
+    "shm": SharedMemoryFrameSink,
+    "record": RecordingSink,
+}
+
+
+class ScanConverterEngine:
+    """Capture, conversion and audio passthrough without any GUI.
+
+    The Tk app and the headless CLI are both thin clients of this class: they
+    pick the source, format, sink and audio devices and read back frames,
+    meter levels and stats.
+
+    Captured frames and input audio are stamped on time.monotonic(); while
+    both PGM and audio run, AVSync hands the sink the audio belonging to each
+    output frame (see `_frame_audio`). PGM output is paced by an
+    OutputScheduler at the exact cadence of the signal format.
+
+    Program audio has 2, 8 or 16 channels (`set_audio_channels`), mixed from
+    the input device's channels by `audio_matrix`, which can be changed at
+    any time without touching the streams (see audio_mix).
+
+    `workers` is the number of conversion threads PGM uses.
+
+    `source` replaces the screen as the capture source (see ReplaySource)
+    and `audio_backend` stands in for the sounddevice module (the benchmarks
+    pass a fake one); by default sounddevice is imported on first use.
+    """
+
+    def __init__(self, monitor_index=0, roi=None, video_format=SIGNAL_FORMATS[0], pixel_format="uyvy",
+                 audio_backend=None, source=None, workers=4):
+        self.video_format = parse_format(video_format)
+        self.pixel_format = pixel_format
+        self.workers = workers
+        self.capture = CaptureEngine(rate=self.video_format.rate, source=source)
+        self.capture.set_source(monitor_index, roi)
+        self.program = None
+        self.sink = None
+        # (name, options) of a sink built from SINKS, to rebuild it for a new format.
+        self.sink_spec = None
+        # Copies of the PGM output for the GUI's program monitor.
+        self.pgm_tap = OutputTap()
+        # Keyer layers over PGM; see overlay.build_layers.
+        self.overlays = OverlayStack()
+
+        self.audio_backend = audio_backend
+        # Supported formats per device, kept until the devices are rescanned.
+        self.audio_caps = CapabilityProbe()
+        self.audio_format = None
+        self.audio_input = None
+        self.audio_output = None
+        self.audio_matrix = MixMatrix(2)
+        self._audio_devices = None
+        self.av_sync = None
+        # Seconds the PGM sink's audio is delayed against the picture.
+        self.audio_delay = 0.0
+        self.input_clock = StreamClock()
+        # PortAudio status flags seen by replaced callbacks (over/underflows);
+        # the current paths count their own.
+        self.input_xruns = 0
+        self.output_xruns = 0
+        self.switch_time = None
+        self._retiring = set()
+        self._audio_lock = threading.Lock()
+        self.stats_file = None
+
+    # Video
+
+    def start(self):
+        self.capture.start()
+
+    def set_source(self, monitor_index, roi=None):
+        self.capture.set_source(monitor_index, roi)
+
+    def set_format(self, name):
+        """Switch the signal format, restarting PGM on the new raster if it runs.
+
+        Sinks with a `format` attribute are sized for that raster: one built
+        by name is rebuilt with the same options, and the change is refused
+        (ValueError) for one passed in as an object.
+        """
+        video_format = parse_format(name)
+        sink = self.sink
+        if (self.program is not None and self.sink_spec is None
+                and getattr(sink, "format", video_format) != video_format):
+            raise ValueError(f"The PGM sink is fixed to {sink.format.name}; stop PGM before changing format")
+        self.video_format = video_format
+        self.capture.set_rate(self.video_format.rate)
+        if self.av_sync is not None:
+            # The callback picks up the new instance on its next block.
+            self.av_sync = AVSync(self.samplerate, self.audio_format.channels, frame_rate(self.video_format),
+                                  audio_delay=self.audio_delay)
+            self._sink_samplerate()
+        if self.program is not None:
+            self.program.stop()
+            self.program = None
+            if self.sink_spec is None:
+                self.start_program(sink)
+                return
+            # Close first: a shared memory sink reuses its block's name.
+            if hasattr(sink, "close"):
+                sink.close()
+            self.sink = None
+            sink_name, options = self.sink_spec
+            self.start_program(sink_name, **options)
+
+    def start_program(self, sink=None, **options):
+        """Start converting captured frames to the PGM sink.
+
+        `sink` is a sink object, or the name of one in SINKS to build for
+        the current format with `options`.
+        """
+        if self.program is not None:
+            return
+        fmt = self.video_format
+        if isinstance(sink, str):
+            self.sink_spec = (sink, options)
+            sink = SINKS[sink](fmt, self.pixel_format, **options)
+        else:
+            self.sink_spec = None
+        self.sink = sink
+        self._sink_samplerate()
+        scheduler = OutputScheduler(fmt.rate, fields=2 if fmt.interlaced else 1)
+        self.program = ConversionEngine(self.capture.ring, fmt, self.pixel_format, sink=sink, workers=self.workers,
+                                        frame_audio=self._frame_audio, tap=self.pgm_tap, overlays=self.overlays,
+                                        scheduler=scheduler)
+        self.program.start()
+
+    def _sink_samplerate(self):
+        """Tell a sink that records audio (one with a `samplerate`) the rate of the blocks it gets."""
+        sink, av_sync = self.sink, self.av_sync
+        if sink is not None and av_sync is not None and hasattr(sink, "samplerate"):
+            sink.samplerate = av_sync.samplerate
+
+    def stop_program(self):
+        if self.program is not None:
+            self.program.stop()
+            self.program = None
+            self.pgm_tap.reset()
+        if self.sink is not None and hasattr(self.sink, "close"):
+            self.sink.close()
+        self.sink = None
+        self.sink_spec = None
+
+    def program_pressure(self):
+        """PGM conversion budget usage and over-budget count, (0.0, 0) when stopped."""
+        program = self.program
+        if program is None:
+            return 0.0, 0
+        converter = program.converter
+        return converter.avg_time / converter.budget, converter.over_budget
+
+    def _frame_audio(self, frame, stamp=None, timeout=0.0):
+        """Input audio covering the output frame that ends with `frame`.
+
+        Called on the PGM thread. `stamp` is the capture time the output
+        stands for on the scheduler's grid (see OutputScheduler.pick), which
+        keeps the audio continuous across repeated and dropped frames. An
+        interlaced frame starts with its first field, one field period
+        before the capture that completed it. Waits at most `timeout`
+        seconds for the audio to arrive; what is still missing then is
+        silence (counted in the A/V stats as a late frame).
+        """
+        av_sync = self.av_sync
+        if av_sync is None:
+            return None
+        start = frame.timestamp if stamp is None else stamp
+        if self.video_format.interlaced:
+            start -= 1.0 / self.video_format.rate
+        return av_sync.read(start, timeout=timeout)
+
+    # Audio
+
+    @property
+    def audio_stream(self):
+        return self.audio_input.stream if self.audio_input is not None else None
+
+    @property
+    def audio_output_stream(self):
+        return self.audio_output.stream if self.audio_output is not None else None
+
+    @property
+    def audio_ring(self):
+        return self.audio_output.ring if self.audio_output is not None else None
+
+    @property
+    def input_meter(self):
+        return self.audio_input.meter if self.audio_input is not None else None
+
+    @property
+    def output_meter(self):
+        return self.audio_output.meter if self.audio_output is not None else None
+
+    @property
+    def samplerate(self):
+        """Input rate: the rate of the audio the PGM sink receives."""
+        return self.audio_format.input_rate if self.audio_format is not None else None
+
+    def _input_block(self, path, indata, frames, time_info):
+        """Feeds AVSync from whichever input is current; runs on its callback."""
+        av_sync = self.av_sync
+        if av_sync is not None and path is self.audio_input:
+            av_sync.write(indata, self.input_clock.input_time(time_info, frames, av_sync.samplerate))
+
+    def _open_input(self, sd, info, fmt, rings):
+        mixer = MatrixMixer(self.audio_matrix, fmt.input_channels, fmt.input_rate)
+        path = InputPath(info['index'], rings, AudioMeter(fmt.input_rate, fmt.input_channels), self._input_block,
+                         mixer=mixer)
+        path.start(sd.InputStream(
+            device=info['index'],
+            samplerate=fmt.input_rate,
+            channels=fmt.input_channels,
+            blocksize=fmt.input_blocksize,
+            latency=fmt.input_latency,
+            callback=path.callback))
+        return path
+
+    def _open_output(self, sd, info, fmt, ring, fade_in):
+        path = OutputPath(info['index'], ring, AudioMeter(fmt.output_rate, fmt.output_channels), fmt.output_rate,
+                          fmt.channels, fade_in=fade_in)
+        path.start(sd.OutputStream(
+            device=info['index'],
+            samplerate=fmt.output_rate,
+            channels=fmt.output_channels,
+            blocksize=fmt.output_blocksize,
+            latency=fmt.output_latency,
+            callback=path.callback))
+        return path
+
+    def _retire(self, event, paths, old_ring=None):
+        """Close replaced paths once their fade has finished (or timed out)."""
+        def run():
+            event.wait(1.0)
+            with self._audio_lock:
+                if old_ring is not None and self.audio_input is not None:
+                    self.audio_input.rings = tuple(r for r in self.audio_input.rings if r is not old_ring)
+                for path in paths:
+                    self._retiring.discard(path)
+                    path.close()
+
+        self._retiring.update(paths)
+        threading.Thread(target=run, name="audio-retire", daemon=True).start()
+
+    def start_audio(self, input_device_info, output_device_info):
+        """Start passthrough between two devices, or switch it to new ones.
+
+        The format is negotiated from cached capability probes rather than
+        by trial-opening streams. A running passthrough is switched in place:
+        a device that stays keeps its stream and the new one is crossfaded
+        in (see audio_route). Returns False if the devices have no usable
+        format or a stream fails to open; a running passthrough then keeps
+        going on its old devices.
+        """
+        sd = self.audio_backend or _sounddevice()
+        started = time.perf_counter()
+        with self._audio_lock:
+            current, old_in, old_out = self.audio_format, self.audio_input, self.audio_output
+            keep_in = old_in is not None and old_in.device == input_device_info['index']
+            keep_out = old_out is not None and old_out.device == output_device_info['index']
+            try:
+                channels = self.audio_matrix.outputs
+                fmt = negotiate(self.audio_caps.caps(sd, input_device_info, "input", channels),
+                                self.audio_caps.caps(sd, output_device_info, "output", channels),
+                                channels=channels,
+                                input_rate=current.input_rate if keep_in else None,
+                                output_rate=current.output_rate if keep_out else None)
+            except Exception as e:
+                print(f"Could not probe audio devices: {e}")
+                return False
+            if fmt is None:
+                print("No common audio format for the selected devices")
+                return False
+            keep_in = keep_in and fmt.input_rate == current.input_rate
+            keep_out = keep_out and fmt.output_rate == current.output_rate
+            if keep_in and keep_out:
+                return True
+
+            ring = AudioRingBuffer(fmt.input_rate, channels=fmt.channels, output_rate=fmt.output_rate)
+            new_in = new_out = None
+            try:
+                if not keep_in:
+                    new_in = self._open_input(sd, input_device_info, fmt, (ring,))
+                if not keep_out:
+                    if keep_in:
+                        # A ring of its own, fed by the running input.
+                        old_in.rings = old_in.rings + (ring,)
+                    new_out = self._open_output(sd, output_device_info, fmt, ring, fade_in=True)
+            except Exception as e:
+                print(f"Failed to start audio at {fmt.input_rate}/{fmt.output_rate} Hz: {e}")
+                for path in (new_in, new_out):
+                    if path is not None:
+                        path.close()
+                if keep_in:
+                    old_in.rings = tuple(r for r in old_in.rings if r is not ring)
+                return False
+
+            if new_in is not None:
+                if not self.audio_matrix.custom:
+                    # Until routed by hand, follow the device: a mono mic
+                    # on pair 1, otherwise channel for channel.
+                    self.audio_matrix.default_routes(fmt.input_channels)
+                self.input_clock.reset()
+                self.input_xruns += old_in.xruns if old_in is not None else 0
+                self.av_sync = AVSync(fmt.input_rate, fmt.channels, frame_rate(self.video_format),
+                                      audio_delay=self.audio_delay)
+                self._sink_samplerate()
+                self.audio_input = new_in
+            if old_out is not None and new_out is None:
+                # New input, same output: crossfade between the two rings.
+                old_out.crossfade_to(ring)
+                self._retire(old_out.switched, [old_in])
+            elif old_out is not None:
+                old_out.fade_out(after=ring)
+                self.output_xruns += old_out.xruns
+                self._retire(old_out.faded, [old_out] if keep_in else [old_out, old_in],
+                             old_ring=old_out.ring if keep_in else None)
+            if new_out is not None:
+                self.audio_output = new_out
+            self.audio_format = fmt
+            self._audio_devices = (input_device_info, output_device_info)
+            self.switch_time = time.perf_counter() - started
+        print(f"Audio running at {fmt.input_rate} Hz in, {fmt.output_rate} Hz out "
+              f"({self.switch_time * 1000:.0f} ms)")
+        return True
+
+    def _stop_audio_locked(self):
+        for path in [self.audio_input, self.audio_output, *self._retiring]:
+            if path is not None:
+                path.close()
+        self._retiring.clear()
+        self.audio_input = None
+        self.audio_output = None
+        self.audio_format = None
+        self.av_sync = None
+
+    def stop_audio(self):
+        with self._audio_lock:
+            self._stop_audio_locked()
+
+    def set_audio_delay(self, seconds):
+        """Delay the PGM sink's audio against the picture (negative to advance it)."""
+        self.audio_delay = seconds
+        av_sync = self.av_sync
+        if av_sync is not None:
+            av_sync.audio_delay = seconds
+
+    def set_audio_channels(self, channels):
+        """Change the program channel count (2, 8 or 16), keeping the routing where it fits.
+
+        Rings, A/V sync and the streams are sized for it, so running audio
+        restarts on the same devices. Returns False if that restart fails.
+        """
+        if channels == self.audio_matrix.outputs:
+            return True
+        matrix = self.audio_matrix.resized(channels)
+        with self._audio_lock:
+            devices = self._audio_devices if self.audio_format is not None else None
+            self._stop_audio_locked()
+            self.audio_matrix = matrix
+        return devices is None or self.start_audio(*devices)
+
+    # Stats
+
+    def histograms(self):
+        """Live per-stage timing histograms, keyed by stage name."""
+        histograms = {"grab": self.capture.grab_time}
+        if self.program is not None:
+            histograms["convert"] = self.program.converter.convert_time
+            histograms["scale"] = self.program.converter.scale_time
+            histograms["output"] = self.program.output_time
+            histograms["sync"] = self.program.sync_time
+            histograms["tick"] = self.program.scheduler.jitter
+        return histograms
+
+    def start_stats_file(self, path, interval=5.0):
+        """Write `stats()` to `path` every `interval` seconds (".prom" for Prometheus text)."""
+        self.stop_stats_file()
+        self.stats_file = StatsFileWriter(path, self.stats, self.histograms, interval)
+        self.stats_file.start()
+
+    def stop_stats_file(self):
+        if self.stats_file is not None:
+            self.stats_file.stop()
+            self.stats_file = None
+
+    # Lifecycle
+
+    def close(self):
+        self.stop_stats_file()
+        self.stop_program()
+        self.capture.stop()
+        self.stop_audio()
+
+    def stats(self):
+        stats = {
+            "time": time.time(),
+            "format": self.video_format.name,
+            "capture": {
+                "frames": self.capture.ring.pushed,
+                "dropped": self.capture.ring.dropped,
+                "late": self.capture.late,
+                "errors": self.capture.errors,
+            },
+            "timings": {name: hist.snapshot() for name, hist in self.histograms().items()},
+        }
+        if self.program is not None:
+            stats["convert"] = self.program.converter.stats()
+            stats["convert"]["errors"] = self.program.errors
+            stats["cadence"] = self.program.scheduler.stats()
+        if self.sink is not None and hasattr(self.sink, "stats"):
+            stats["sink"] = self.sink.stats()
+        fmt, audio_input, audio_output = self.audio_format, self.audio_input, self.audio_output
+        if fmt is not None and audio_input is not None and audio_output is not None:
+            stats["audio"] = audio_output.ring.stats()
+            stats["audio"]["samplerate"] = fmt.input_rate
+            stats["audio"]["output_samplerate"] = fmt.output_rate
+            stats["audio"]["channels"] = fmt.channels
+            stats["audio"]["input_channels"] = fmt.input_channels
+            stats["audio"]["output_channels"] = fmt.output_channels
+            stats["audio"]["input_xruns"] = self.input_xruns + audio_input.xruns
+            stats["audio"]["output_xruns"] = self.output_xruns + audio_output.xruns
+            stats["audio"]["switch_ms"] = self.switch_time * 1000
+            stats["audio"]["input_levels"] = audio_input.meter.levels
+            stats["audio"]["output_levels"] = audio_output.meter.levels
+        if self.av_sync is not None:
+            stats["avsync"] = self.av_sync.stats()
+            stats["avsync"]["clock_fallbacks"] = self.input_clock.fallbacks
+        return stats
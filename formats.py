@@ -0,0 +1,28 @@
+from collections import namedtuple
+
+# Formats offered in the "Signal Format" menu and accepted by the CLI.
+SIGNAL_FORMATS = ["1920x1080 50i", "1280x720 50p", "1920x1080 25p"]
+
+# Parsed form of the "Signal Format" menu entries, e.g. "1920x1080 50i".
+# `rate` is the capture cadence in Hz: for interlaced formats that is the
+# field rate, since each field is built from its own capture.
+VideoFormat = namedtuple("VideoFormat", ["name", "width", "height", "rate", "interlaced"])
+
+
+def parse_format(name):
+    """Parse a format name such as "1280x720 50p" into a VideoFormat."""
+    try:
+        size, cadence = name.split()
+        width, height = (int(v) for v in size.lower().split("x"))
+        scan = cadence[-1].lower()
+        rate = int(cadence[:-1])
+    except ValueError:
+        raise ValueError(f"Unrecognised signal format: {name!r}")
+    if scan not in ("i", "p"):
+        raise ValueError(f"Unrecognised scan type in signal format: {name!r}")
+    return VideoFormat(name, width, height, rate, scan == "i")
+
+
+def frame_rate(video_format):
+    """Output frames per second: half the field rate for interlaced formats."""
+    return video_format.rate / 2 if video_format.interlaced else video_format.rate
@@ -0,0 +1,107 @@
+import threading
+
+import numpy as np
+
+
+class Frame:
+    """A captured image as a NumPy view over a pooled BGRA buffer.
+
+    `data` has shape (height, width, 4) in the BGRA byte order mss delivers,
+    so no channel reordering is done until a consumer actually needs RGB.
+    `timestamp` is time.monotonic() when the grab started and `origin` is the (left, top)
+    desktop position of the grabbed region. `cursor` is the desktop position
+    of the mouse pointer at grab time, or None if the source does not know.
+
+    Frames are reference counted: whoever hands a frame to another thread
+    calls `retain()` first, and every holder calls `release()` when done so
+    the buffer can go back to its pool.
+    """
+
+    __slots__ = ("data", "seq", "timestamp", "origin", "cursor", "_pool", "_refs")
+
+    def __init__(self, data, pool=None):
+        self.data = data
+        self.seq = -1
+        self.timestamp = 0.0
+        self.origin = (0, 0)
+        self.cursor = None
+        self._pool = pool
+        self._refs = 1
+
+    @property
+    def width(self):
+        return self.data.shape[1]
+
+    @property
+    def height(self):
+        return self.data.shape[0]
+
+    @property
+    def size(self):
+        return self.data.shape[1], self.data.shape[0]
+
+    def retain(self):
+        if self._pool is not None:
+            self._pool._retain(self)
+        return self
+
+    def release(self):
+        if self._pool is not None:
+            self._pool._release(self)
+
+
+class FramePool:
+    """Recycles preallocated BGRA buffers so capture does no per-frame allocation.
+
+    Buffers are kept per (width, height); when the capture size changes (a new
+    ROI or monitor) buffers of the old size are simply not returned to the
+    free list once released.
+    """
+
+    def __init__(self, max_free=8):
+        self.max_free = max_free
+        self.allocations = 0
+        self._shape = None
+        self._free = []
+        self._lock = threading.Lock()
+
+    def acquire(self, width, height):
+        shape = (height, width, 4)
+        with self._lock:
+            if shape != self._shape:
+                self._shape = shape
+                self._free = []
+            if self._free:
+                frame = self._free.pop()
+                frame._refs = 1
+                frame.cursor = None
+                return frame
+            self.allocations += 1
+        return Frame(np.empty(shape, dtype=np.uint8), self)
+
+    def _retain(self, frame):
+        with self._lock:
+            frame._refs += 1
+
+    def _release(self, frame):
+        with self._lock:
+            frame._refs -= 1
+            if frame._refs > 0:
+                return
+            if frame.data.shape == self._shape and len(self._free) < self.max_free:
+                self._free.append(frame)
+
+
+def frame_from_shot(pool, shot):
+    """Copy an mss ScreenShot into a pooled Frame (seq and timestamp unset).
+
+    This is the only copy on the capture path: the raw BGRA bytes are viewed
+    in place and copied straight into the recycled buffer, instead of going
+    through mss's packed `.rgb` property and a PIL image.
+    """
+    width, height = shot.size
+    frame = pool.acquire(width, height)
+    src = np.frombuffer(shot.raw, dtype=np.uint8).reshape(height, width, 4)
+    np.copyto(frame.data, src)
+    frame.origin = (shot.left, shot.top)
+    return frame
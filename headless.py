@@ -0,0 +1,170 @@
+"""Run the scan converter without a GUI.
+
+    python -m headless --monitor 1 --roi 0,0,1280,720 --format "1280x720 50p" \\
+        --input-device 3 --output-device 5 --sink null --stats-interval 5
+
+Stats are printed to stdout as one JSON object per line. With --stats-file
+they are also kept in a file that is rewritten periodically, as JSON or, for
+a name ending in ".prom", as Prometheus text.
+"""
+import argparse
+import json
+import signal
+import sys
+import time
+
+from audio_mix import PROGRAM_CHANNELS, db_to_gain
+from engine import SINKS, ScanConverterEngine, audio_devices, find_wasapi_hostapi, list_monitors
+from formats import SIGNAL_FORMATS
+from overlay import POSITIONS, build_layers
+from recorder import ReplaySource
+
+
+def parse_roi(value):
+    try:
+        x1, y1, x2, y2 = (int(v) for v in value.split(","))
+    except ValueError:
+        raise argparse.ArgumentTypeError("ROI must be x1,y1,x2,y2")
+    if x2 <= x1 or y2 <= y1:
+        raise argparse.ArgumentTypeError("ROI must have x2 > x1 and y2 > y1")
+    return x1, y1, x2, y2
+
+
+def parse_route(value):
+    """IN:OUT[:GAIN_DB] with 1-based channel numbers, e.g. "1:3" or "2:4:-6"."""
+    try:
+        parts = value.split(":")
+        if len(parts) not in (2, 3):
+            raise ValueError
+        input_channel, output_channel = int(parts[0]) - 1, int(parts[1]) - 1
+        gain = db_to_gain(float(parts[2])) if len(parts) == 3 else 1.0
+    except ValueError:
+        raise argparse.ArgumentTypeError("Route must be IN:OUT or IN:OUT:GAIN_DB")
+    if input_channel < 0 or output_channel < 0:
+        raise argparse.ArgumentTypeError("Channels are numbered from 1")
+    return input_channel, output_channel, gain
+
+
+def find_device(devices, spec):
+    """Match a device by PortAudio index or by (part of) its name."""
+    for d in devices:
+        if spec.isdigit() and d['index'] == int(spec):
+            return d
+    for d in devices:
+        if spec.lower() in d['name'].lower():
+            return d
+    return None
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="python -m headless", description="Headless scan converter")
+    parser.add_argument("--monitor", type=int, default=1, help="monitor number, starting at 1 (default: 1)")
+    parser.add_argument("--roi", type=parse_roi, help="region of interest on the monitor as x1,y1,x2,y2")
+    parser.add_argument("--format", default=SIGNAL_FORMATS[0], help=f"signal format, one of {SIGNAL_FORMATS}")
+    parser.add_argument("--pixel-format", choices=["uyvy", "v210"], default="uyvy")
+    parser.add_argument("--workers", type=int, default=4, help="conversion threads (default: 4)")
+    parser.add_argument("--sink", choices=sorted(SINKS), default="null", help="PGM sink (default: null)")
+    parser.add_argument("--record-dir", default="recordings", help="directory for the record sink")
+    parser.add_argument("--replay", help="replay a recording (directory or segment .json) instead of the screen")
+    parser.add_argument("--no-loop", action="store_true", help="stop at the end of the replayed recording")
+    parser.add_argument("--input-device", help="audio input device index or name")
+    parser.add_argument("--output-device", help="audio output device index or name")
+    parser.add_argument("--audio-channels", type=int, choices=PROGRAM_CHANNELS, default=2,
+                        help="program audio channels for the sink (default: 2)")
+    parser.add_argument("--audio-delay", type=float, default=0.0,
+                        help="delay the sink's audio by this many ms against the picture (default: 0)")
+    parser.add_argument("--route", type=parse_route, action="append", default=[],
+                        help="route input channel IN to program channel OUT, optionally at GAIN_DB; repeatable "
+                             "(default: a mono input to 1+2, otherwise channel for channel)")
+    parser.add_argument("--cursor", action="store_true", help="key the mouse pointer over PGM (Windows only)")
+    parser.add_argument("--logo", help="key this image as a logo bug over PGM")
+    parser.add_argument("--logo-position", choices=sorted(POSITIONS), default="top-right")
+    parser.add_argument("--timecode", action="store_true", help="burn a time-of-day timecode into PGM")
+    parser.add_argument("--duration", type=float, help="stop after this many seconds")
+    parser.add_argument("--stats-interval", type=float, default=5.0, help="seconds between stats lines")
+    parser.add_argument("--stats-file", help="also write stats to this file (.prom for Prometheus text)")
+    parser.add_argument("--list-devices", action="store_true", help="list monitors and audio devices and exit")
+    return parser
+
+
+def list_devices():
+    try:
+        for i, monitor in enumerate(list_monitors()):
+            print(f"monitor {i + 1}: {monitor['width']}x{monitor['height']}+{monitor['left']}+{monitor['top']}")
+    except Exception as e:
+        print(f"Could not query monitors: {e}")
+    try:
+        hostapi = find_wasapi_hostapi()
+        for kind in ("input", "output"):
+            for d in audio_devices(kind, hostapi):
+                print(f"{kind} {d['index']}: {d['name']}")
+    except Exception as e:
+        print(f"Could not query audio devices: {e}")
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.list_devices:
+        list_devices()
+        return 0
+
+    try:
+        source = ReplaySource(args.replay, loop=not args.no_loop) if args.replay else None
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 2
+    engine = ScanConverterEngine(args.monitor - 1, args.roi, args.format, args.pixel_format, source=source,
+                                 workers=args.workers)
+    engine.set_audio_channels(args.audio_channels)
+    engine.set_audio_delay(args.audio_delay / 1000)
+    for input_channel, output_channel, gain in args.route:
+        if input_channel >= engine.audio_matrix.inputs or output_channel >= engine.audio_matrix.outputs:
+            print(f"Route {input_channel + 1}:{output_channel + 1} is outside {engine.audio_matrix.inputs} inputs "
+                  f"and {engine.audio_matrix.outputs} program channels", file=sys.stderr)
+            return 2
+        engine.audio_matrix.route(input_channel, output_channel, gain)
+    if args.input_device or args.output_device:
+        if not (args.input_device and args.output_device):
+            print("Audio passthrough needs both --input-device and --output-device", file=sys.stderr)
+            return 2
+        hostapi = find_wasapi_hostapi()
+        input_info = find_device(audio_devices("input", hostapi), args.input_device)
+        output_info = find_device(audio_devices("output", hostapi), args.output_device)
+        if input_info is None or output_info is None:
+            print("Audio device not found; see --list-devices", file=sys.stderr)
+            return 2
+        if not engine.start_audio(input_info, output_info):
+            print("Could not find a compatible audio format for the selected devices.", file=sys.stderr)
+            return 1
+
+    stopping = []
+    signal.signal(signal.SIGINT, lambda *_: stopping.append(True))
+    signal.signal(signal.SIGTERM, lambda *_: stopping.append(True))
+
+    engine.overlays.set_layers(build_layers(args.cursor, args.logo, args.timecode, args.logo_position))
+    engine.start()
+    options = {"directory": args.record_dir} if args.sink == "record" else {}
+    engine.start_program(args.sink, **options)
+    if args.stats_file:
+        engine.start_stats_file(args.stats_file, args.stats_interval)
+    started = time.monotonic()
+    next_stats = started + args.stats_interval
+    try:
+        while not stopping:
+            now = time.monotonic()
+            if args.duration is not None and now - started >= args.duration:
+                break
+            if engine.capture.finished:
+                break
+            if now >= next_stats:
+                print(json.dumps(engine.stats()), flush=True)
+                next_stats += args.stats_interval
+            time.sleep(0.05)
+        print(json.dumps(engine.stats()), flush=True)
+    finally:
+        engine.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
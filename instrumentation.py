@@ -0,0 +1,248 @@
+"""Low-overhead timing histograms and a periodic stats file.
+
+Each pipeline stage owns a LatencyHistogram that its thread feeds with one
+`observe` per frame; readers (the GUI stats panel, the stats file writer)
+take snapshots from other threads. Counts are plain Python ints updated by a
+single writer, so no lock is taken on the hot path and a snapshot is at
+worst one observation out of date.
+
+StatsFileWriter dumps a stats dict to disk every few seconds, as JSON or as
+Prometheus text exposition format (for node_exporter's textfile collector),
+so a windowed build without a console can still be watched.
+
+StartupTimer records start-up milestones against a budget such as "window
+shown within 500 ms".
+"""
+import bisect
+import ctypes
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+# Bucket upper bounds in seconds: 0.1 ms to ~2 s in steps of 25%, fine
+# enough that a bucket-derived percentile is within 25% of the true value.
+DEFAULT_BOUNDS = tuple(1e-4 * 1.25 ** i for i in range(45))
+
+DEFAULT_STATS_PATH = os.environ.get("SCANCONVERTER_STATS_FILE") or os.path.join(
+    tempfile.gettempdir(), "scanconverter_stats.json")
+
+
+class LatencyHistogram:
+    """Fixed-bucket histogram of durations in seconds."""
+
+    def __init__(self, bounds=DEFAULT_BOUNDS):
+        self.bounds = bounds
+        self.reset()
+
+    def reset(self):
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(self.bounds, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, q):
+        """Upper bound of the bucket holding quantile `q` (0..1), in seconds."""
+        counts = list(self.counts)
+        total = sum(counts)
+        if not total:
+            return 0.0
+        rank = q * total
+        seen = 0
+        for i, n in enumerate(counts):
+            seen += n
+            if seen >= rank and n:
+                break
+        bound = self.bounds[i] if i < len(self.bounds) else self.max
+        return min(bound, self.max)
+
+    def snapshot(self):
+        count = self.count
+        return {
+            "count": count,
+            "mean_ms": self.sum / count * 1000 if count else 0.0,
+            "p50_ms": self.percentile(0.5) * 1000,
+            "p99_ms": self.percentile(0.99) * 1000,
+            "max_ms": self.max * 1000,
+        }
+
+
+def process_age():
+    """Seconds since this process was created, or None if unknown.
+
+    Covers what happens before any of our code runs, such as interpreter
+    start-up and a PyInstaller one-file bundle unpacking itself.
+    """
+    try:
+        if sys.platform == "win32":
+            filetime = ctypes.c_ulonglong
+            created, exited, kernel, user, now = (filetime() for _ in range(5))
+            kernel32 = ctypes.windll.kernel32
+            if not kernel32.GetProcessTimes(kernel32.GetCurrentProcess(), ctypes.byref(created),
+                                            ctypes.byref(exited), ctypes.byref(kernel), ctypes.byref(user)):
+                return None
+            kernel32.GetSystemTimeAsFileTime(ctypes.byref(now))
+            return (now.value - created.value) / 1e7
+        with open("/proc/self/stat") as f:
+            # Field 22, counted after the parenthesised command name.
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        return uptime - start_ticks / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, AttributeError, IndexError):
+        return None
+
+
+class StartupTimer:
+    """Named start-up milestones, measured against a time budget.
+
+    Times are seconds since `started` (a perf_counter() value taken as early
+    as possible) plus however long the process ran before that, so they are
+    close to what a user waits after double-clicking the app.
+    """
+
+    def __init__(self, started=None, budget=0.5, milestone="window"):
+        now = time.perf_counter()
+        self.started = now if started is None else started
+        age = process_age()
+        # Time the process spent before `started`, if it can be known.
+        self.bootstrap = max(0.0, age - (now - self.started)) if age is not None else 0.0
+        self.budget = budget
+        self.milestone = milestone
+        self.marks = {}
+
+    def mark(self, name):
+        """Record milestone `name` once; later calls keep the first time."""
+        if name not in self.marks:
+            self.marks[name] = self.bootstrap + time.perf_counter() - self.started
+        return self.marks[name]
+
+    def report(self):
+        reached = self.marks.get(self.milestone)
+        return {
+            "bootstrap_ms": self.bootstrap * 1000,
+            "marks_ms": {name: t * 1000 for name, t in self.marks.items()},
+            "budget_ms": self.budget * 1000,
+            "milestone": self.milestone,
+            "within_budget": reached is not None and reached <= self.budget,
+        }
+
+
+def _metric_name(parts):
+    return "_".join(p.replace("-", "_") for p in parts)
+
+
+def _label_text(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in labels) + "}"
+
+
+def _gauges(prefix, value, lines, labels=()):
+    if isinstance(value, bool):
+        lines.append(f"{prefix}{_label_text(labels)} {int(value)}")
+    elif isinstance(value, (int, float)):
+        lines.append(f"{prefix}{_label_text(labels)} {value:.9g}")
+    elif isinstance(value, dict):
+        for key, item in value.items():
+            _gauges(f"{prefix}_{_metric_name([key])}", item, lines, labels)
+    elif isinstance(value, (list, tuple)):
+        # The outer list is per channel; lists nested in it add labels of
+        # their own, so every sample keeps a distinct label set.
+        name = "channel" if not labels else f"index{len(labels)}"
+        for i, item in enumerate(value):
+            _gauges(prefix, item, lines, labels + ((name, i),))
+    # Strings (format names and the like) have no numeric value to export.
+
+
+def prometheus_text(stats, histograms=None, prefix="scanconverter"):
+    """Render a stats dict (and optional histograms) as Prometheus text.
+
+    Numeric leaves of `stats` become gauges named after their path, lists
+    become one sample per channel (nested lists add an `index1`, `index2`...
+    label). Each LatencyHistogram in `histograms`
+    (name -> histogram) becomes a `<prefix>_<name>_seconds` histogram.
+    """
+    lines = []
+    for key, value in stats.items():
+        if key in ("time", "timings"):
+            continue
+        _gauges(f"{prefix}_{_metric_name([key])}", value, lines)
+    for name, hist in (histograms or {}).items():
+        metric = f"{prefix}_{_metric_name([name])}_seconds"
+        lines.append(f"# TYPE {metric} histogram")
+        counts = list(hist.counts)
+        cumulative = 0
+        for bound, n in zip(hist.bounds, counts):
+            cumulative += n
+            lines.append(f'{metric}_bucket{{le="{bound:.6g}"}} {cumulative}')
+        lines.append(f'{metric}_bucket{{le="+Inf"}} {sum(counts)}')
+        lines.append(f"{metric}_sum {hist.sum:.9g}")
+        lines.append(f"{metric}_count {sum(counts)}")
+    return "\n".join(lines) + "\n"
+
+
+class StatsFileWriter:
+    """Rewrites a stats file every `interval` seconds on a daemon thread.
+
+    `get_stats` returns the stats dict and `get_histograms` (optional) the
+    histograms to export. Files ending in ".prom" are written as Prometheus
+    text, anything else as JSON. The file is replaced atomically, so readers
+    never see a half-written one.
+    """
+
+    def __init__(self, path, get_stats, get_histograms=None, interval=5.0):
+        self.path = path
+        self.get_stats = get_stats
+        self.get_histograms = get_histograms
+        self.interval = interval
+        self.errors = 0
+        self._thread = None
+        self._running = threading.Event()
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._running.set()
+        self._thread = threading.Thread(target=self._run, name="stats-file", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=1.0):
+        self._running.clear()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def write(self):
+        stats = self.get_stats()
+        if self.path.endswith(".prom"):
+            histograms = self.get_histograms() if self.get_histograms else None
+            text = prometheus_text(stats, histograms)
+        else:
+            text = json.dumps(stats, indent=2) + "\n"
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w") as f:
+            f.write(text)
+        os.replace(tmp, self.path)
+
+    def _run(self):
+        next_write = time.monotonic()
+        while self._running.is_set():
+            try:
+                self.write()
+            except Exception as e:
+                self.errors += 1
+                print("Stats file error:", e)
+            next_write += self.interval
+            # Wake up promptly on stop instead of sleeping out the interval.
+            while self._running.is_set() and time.monotonic() < next_write:
+                time.sleep(min(0.1, max(0.0, next_write - time.monotonic())))
@@ -1,28 +1,41 @@
-import customtkinter as ctk
-import threading
 import time
-from PIL import Image, ImageTk
-import mss
-from CTkMessagebox import CTkMessagebox
-import sounddevice as sd
 
-import numpy as np
-import queue
+# Taken before any other import so the start-up report includes them.
+STARTED = time.perf_counter()
+
+import json
+import math
+import os
+import tempfile
+
+import customtkinter as ctk
+
+from devices import DeviceInventory
+from formats import SIGNAL_FORMATS
+from instrumentation import DEFAULT_STATS_PATH, StartupTimer
 
-# Mock device and format lists
+# The engine (NumPy, mss, PIL), PortAudio and CTkMessagebox are imported on
+# first use, after the window is up; see ScanConverterApp.start_engine.
+
+# Mock device list
 MOCK_DEVICES = ["Decklink 1", "Decklink 2"]
-MOCK_FORMATS = ["1920x1080 50i", "1280x720 50p", "1920x1080 25p"]
+
+# Time from launch to the first drawn window we want to stay under.
+STARTUP_BUDGET = 0.5
+STARTUP_REPORT_PATH = os.path.join(tempfile.gettempdir(), "scanconverter_startup.json")
+
+NO_DECKLINK = "No DeckLink card detected."
+NO_INPUTS = "No microphone devices found"
+NO_OUTPUTS = "No output devices found"
+SCANNING = "Scanning..."
 
 ctk.set_appearance_mode("dark")
 ctk.set_default_color_theme("blue")
 
-def get_decklink_devices():
-    # This should use the DeckLink SDK via Python bindings.
-    # For now, let's mock the result:
-    # return ["DeckLink 4K Extreme", "DeckLink Mini Recorder"]
-    # If no devices:
-    # return []
-    pass
+
+def show_message(**kwargs):
+    from CTkMessagebox import CTkMessagebox
+    return CTkMessagebox(**kwargs)
 
 class ROISelector(ctk.CTkToplevel):
     def __init__(self, monitor):
@@ -91,35 +104,235 @@ class ROISelector(ctk.CTkToplevel):
         return self.roi_coords
 
 
+class PreviewView:
+    """One image item on a canvas, updated in place.
+
+    The PhotoImage is created once per image size and then refreshed with
+    `paste`; the canvas item is never deleted and recreated.
+    """
+
+    def __init__(self, canvas, width, height):
+        self.canvas = canvas
+        self.item = canvas.create_image(width // 2, height // 2, anchor="center")
+        self.photo = None
+
+    def show(self, image):
+        from PIL import ImageTk
+
+        if image is None:
+            if self.photo is not None:
+                self.canvas.itemconfigure(self.item, image="")
+                self.photo = None
+            return
+        if self.photo is None or (self.photo.width(), self.photo.height()) != image.size:
+            self.photo = ImageTk.PhotoImage(image)
+            self.canvas.itemconfigure(self.item, image=self.photo)
+        else:
+            self.photo.paste(image)
+
+
+class StatsPanel(ctk.CTkToplevel):
+    """Live pipeline stats, refreshed twice a second."""
+
+    STAGES = ("grab", "convert", "scale", "output", "sync", "tick")
+
+    def __init__(self, app):
+        super().__init__(app)
+        self.app = app
+        self.title("Pipeline Stats")
+        self.geometry("560x420")
+        self.text = ctk.CTkTextbox(self, font=("Courier New", 13))
+        self.text.pack(fill="both", expand=True, padx=10, pady=10)
+        self._last = None
+        self.refresh()
+
+    def _rates(self, stats):
+        # Frame rates from the counter deltas since the previous refresh.
+        now = stats["time"]
+        counts = (stats["capture"]["frames"], stats.get("convert", {}).get("frames", 0))
+        rates = (0.0, 0.0)
+        if self._last is not None and now > self._last[0]:
+            rates = tuple(max(0, c - p) / (now - self._last[0]) for c, p in zip(counts, self._last[1]))
+        self._last = (now, counts)
+        return rates
+
+    def format_stats(self, stats):
+        capture_fps, pgm_fps = self._rates(stats)
+        cap = stats["capture"]
+        lines = [
+            f"Format    {stats['format']}",
+            f"Capture   {capture_fps:5.1f} fps  dropped {cap['dropped']}  late {cap['late']}  errors {cap['errors']}",
+        ]
+        if "convert" in stats:
+            conv = stats["convert"]
+            lines.append(f"PGM       {pgm_fps:5.1f} fps  repeated {conv['reused_frames']}  "
+                         f"over budget {conv['over_budget']}  errors {conv['errors']}")
+            lines.append(f"          budget {conv['budget_usage']:.0%}  tile reuse {conv['tile_hit_rate']:.0%}")
+            cadence = stats["cadence"]
+            lines.append(f"Cadence   {cadence['rate']:g} Hz  jitter {cadence['jitter_ms']:.2f} ms "
+                         f"(p99 {cadence['jitter_p99_ms']:.2f})  delay {cadence['delay_ms']:.0f} ms")
+            lines.append(f"          repeats {cadence['repeats']}  drops {cadence['drops']}  "
+                         f"missed ticks {cadence['missed']}")
+        else:
+            lines.append("PGM       stopped")
+        if self.app.preview is not None:
+            pvw = self.app.preview.stats()
+            lines.append(f"Preview   every {pvw['interval_ms']:.0f} ms  render {pvw['render_ms']:.1f} ms  "
+                         f"errors {pvw['errors'] + self.app.pvw_errors}")
+        else:
+            lines.append(f"Preview   errors {self.app.pvw_errors}")
+        lines.append("")
+        lines.append(f"{'Stage':10}{'p50 ms':>9}{'p99 ms':>9}{'max ms':>9}{'count':>9}")
+        for stage in self.STAGES:
+            t = stats["timings"].get(stage)
+            if t is not None:
+                lines.append(f"{stage:10}{t['p50_ms']:9.2f}{t['p99_ms']:9.2f}{t['max_ms']:9.2f}{t['count']:9d}")
+        lines.append("")
+        if "audio" in stats:
+            audio = stats["audio"]
+            rates = f"{audio['samplerate']}" if audio['samplerate'] == audio['output_samplerate'] else \
+                f"{audio['samplerate']}->{audio['output_samplerate']}"
+            lines.append(f"Audio     {rates} Hz  fill {audio['latency_ms']:.1f} ms "
+                         f"(target {audio['target_ms']:.0f})  ratio {audio['ratio']:.5f}")
+            lines.append(f"          channels in {audio['input_channels']} program {audio['channels']} "
+                         f"monitor {audio['output_channels']}  last switch {audio['switch_ms']:.0f} ms")
+            lines.append(f"          xruns in {audio['input_xruns']} out {audio['output_xruns']}  "
+                         f"underruns {audio['underruns']}  overruns {audio['overruns']}")
+        else:
+            lines.append("Audio     stopped")
+        if "avsync" in stats:
+            sync = stats["avsync"]
+            lines.append(f"A/V       offset {sync['offset_ms']:+.1f} ms  max {sync['max_offset_ms']:.1f} ms  "
+                         f"{'in sync' if sync['in_sync'] else 'OUT OF SYNC'}")
+            lines.append(f"          drift {sync['correction_ppm']:+.0f} ppm  late {sync['late_frames']}  "
+                         f"resyncs {sync['resyncs']}")
+        if self.app.engine.stats_file is not None:
+            lines.append("")
+            lines.append(f"Stats file: {self.app.engine.stats_file.path}")
+        startup = self.app.startup.report()
+        marks = "  ".join(f"{name} {ms:.0f}" for name, ms in startup["marks_ms"].items())
+        lines.append(f"Startup   {marks} ms  (budget {startup['budget_ms']:.0f} ms, "
+                     f"{'met' if startup['within_budget'] else 'MISSED'})")
+        return "\n".join(lines)
+
+    def refresh(self):
+        if not self.winfo_exists():
+            return
+        try:
+            text = self.format_stats(self.app.engine.stats())
+        except Exception as e:
+            text = f"Stats unavailable: {e}"
+        self.text.configure(state="normal")
+        self.text.delete("1.0", "end")
+        self.text.insert("1.0", text)
+        self.text.configure(state="disabled")
+        self.after(500, self.refresh)
+
+
+class RoutingPanel(ctk.CTkToplevel):
+    """Where each input channel goes in program audio, and at what gain.
+
+    Changes go straight to the engine's MixMatrix, which ramps them in on
+    the running streams. `build` redraws the rows after the input device or
+    the program channel count changed.
+    """
+
+    MUTE_DB = -60
+
+    def __init__(self, app):
+        super().__init__(app)
+        self.app = app
+        self.title("Audio Routing")
+        self.geometry("460x420")
+        self.body = None
+        self.build()
+
+    @staticmethod
+    def describe(outputs):
+        if not outputs:
+            return "Off"
+        if len(outputs) == 2 and outputs[0] % 2 == 0 and outputs[1] == outputs[0] + 1:
+            return f"{outputs[0] + 1}+{outputs[1] + 1}"
+        return str(outputs[0] + 1)
+
+    def build(self):
+        if self.body is not None:
+            self.body.destroy()
+        engine = self.app.engine
+        matrix = engine.audio_matrix
+        fmt = engine.audio_format
+        inputs = fmt.input_channels if fmt is not None else 2
+        destinations = (["Off"] + [f"{o + 1}+{o + 2}" for o in range(0, matrix.outputs, 2)]
+                        + [str(o + 1) for o in range(matrix.outputs)])
+        self.body = ctk.CTkScrollableFrame(self, label_text=f"Input channels to {matrix.outputs} program channels")
+        self.body.pack(fill="both", expand=True, padx=10, pady=10)
+        self.gain_labels = []
+        for i in range(inputs):
+            ctk.CTkLabel(self.body, text=f"In {i + 1}").grid(row=i, column=0, padx=(5, 10), pady=4)
+            outputs = [o for o in range(matrix.outputs) if matrix.routes[i, o]]
+            menu = ctk.CTkOptionMenu(self.body, values=destinations, width=80,
+                                     command=lambda value, i=i: self.set_route(i, value))
+            menu.set(self.describe(outputs))
+            menu.grid(row=i, column=1, padx=5, pady=4)
+            gain = float(matrix.input_gains[i])
+            db = max(self.MUTE_DB, 20 * math.log10(gain)) if gain > 0 else self.MUTE_DB
+            slider = ctk.CTkSlider(self.body, from_=self.MUTE_DB, to=12, width=180,
+                                   command=lambda value, i=i: self.set_gain(i, value))
+            slider.set(db)
+            slider.grid(row=i, column=2, padx=5, pady=4)
+            label = ctk.CTkLabel(self.body, text=self.format_db(db), width=60)
+            label.grid(row=i, column=3, padx=5, pady=4)
+            self.gain_labels.append(label)
+
+    def format_db(self, db):
+        return "off" if db <= self.MUTE_DB else f"{db:+.1f} dB"
+
+    def set_route(self, input_channel, value):
+        if value == "Off":
+            outputs = ()
+        elif "+" in value:
+            outputs = tuple(int(v) - 1 for v in value.split("+"))
+        else:
+            outputs = (int(value) - 1,)
+        self.app.engine.audio_matrix.route_input(input_channel, outputs)
+
+    def set_gain(self, input_channel, db):
+        gain = 0.0 if db <= self.MUTE_DB else 10 ** (db / 20)
+        self.app.engine.audio_matrix.set_input_gain(input_channel, gain)
+        self.gain_labels[input_channel].configure(text=self.format_db(db))
+
+
 class ScanConverterApp(ctk.CTk):
     def __init__(self):
         super().__init__()
         self.title("Scan Converter")
         self.geometry("1100x850")
         self.resizable(False, False)
-
-        # Find WASAPI hostapi index
-        self.wasapi_hostapi_index = -1
-        try:
-            hostapis = sd.query_hostapis()
-            for i, api in enumerate(hostapis):
-                if 'WASAPI' in api['name']:
-                    self.wasapi_hostapi_index = i
-                    print(f"Found WASAPI host API at index: {i}")
-                    break
-        except Exception as e:
-            print(f"Could not query host APIs: {e}")
-
-        self.sct = mss.mss()
-        self.monitor_list = self.sct.monitors[1:]  # mss.monitors[0] is all, [1:] are real
-        self.monitor_names = [f"Monitor {i+1}" for i in range(len(self.monitor_list))]
+        self.startup = StartupTimer(STARTED, STARTUP_BUDGET)
+        self.startup.mark("imports")
+
+        # Devices are enumerated in the background; until that finishes the
+        # menus show what the last run found, if anything.
+        self.inventory = DeviceInventory()
+        self.inventory.load_cache()
+        self.inventory_version = None
+        self.audio_was_running = False
+        self.monitor_list = []
+        self.monitor_names = []
+        self.audio_devices = []
+        self.audio_output_devices = []
         self.selected_monitor_index = 0
-        self.pvw_imgtk = None
+        self.preview = None
         self.pvw_running = True
+        self.pvw_version = None
+        self.pvw_errors = 0
+        self.stats_panel = None
+        self.routing_panel = None
         self.roi_coords = None
-        self.audio_stream = None
-        self.audio_output_stream = None
-        self.audio_queue = queue.Queue()
+        # Capture, conversion and audio all live in the engine; this window
+        # only drives it and displays what it produces. It is created once
+        # the window is up (see start_engine).
+        self.engine = None
 
         # Title label
         self.title_label = ctk.CTkLabel(self, text="Scan Converter", font=("Arial", 28, "bold"))
@@ -136,14 +349,14 @@ class ScanConverterApp(ctk.CTk):
         self.pvw_label.place(relx=0.5, rely=0.05, anchor="n")
         self.pvw_canvas = ctk.CTkCanvas(self.pvw_frame, width=440, height=220, bg="#222")
         self.pvw_canvas.place(relx=0.5, rely=0.55, anchor="center")
-        self.pvw_canvas_img = self.pvw_canvas.create_image(0, 0, anchor="nw")
+        self.pvw_view = PreviewView(self.pvw_canvas, 440, 220)
 
         # Controls for PVW
         self.pvw_controls_frame = ctk.CTkFrame(self.pvw_frame)
         self.pvw_controls_frame.place(relx=0.5, rely=0.92, anchor="s")
 
-        self.monitor_option = ctk.CTkOptionMenu(self.pvw_controls_frame, values=self.monitor_names, command=self.change_monitor)
-        self.monitor_option.set(self.monitor_names[0] if self.monitor_names else "")
+        self.monitor_option = ctk.CTkOptionMenu(self.pvw_controls_frame, values=[SCANNING], command=self.change_monitor)
+        self.monitor_option.set(SCANNING)
         self.monitor_option.grid(row=0, column=0, padx=5, pady=5)
 
         self.select_roi_button = ctk.CTkButton(self.pvw_controls_frame, text="Select ROI", command=self.select_roi_on_desktop)
@@ -162,6 +375,22 @@ class ScanConverterApp(ctk.CTk):
         self.pgm_label.place(relx=0.5, rely=0.05, anchor="n")
         self.pgm_canvas = ctk.CTkCanvas(self.pgm_frame, width=440, height=220, bg="#222")
         self.pgm_canvas.place(relx=0.5, rely=0.55, anchor="center")
+        self.pgm_view = PreviewView(self.pgm_canvas, 440, 220)
+
+        # Keyer controls
+        self.logo_path = None
+        self.pgm_controls_frame = ctk.CTkFrame(self.pgm_frame)
+        self.pgm_controls_frame.place(relx=0.5, rely=0.92, anchor="s")
+        self.cursor_var = ctk.BooleanVar(value=False)
+        self.cursor_check = ctk.CTkCheckBox(self.pgm_controls_frame, text="Cursor", variable=self.cursor_var,
+                                            command=self.update_overlays)
+        self.cursor_check.grid(row=0, column=0, padx=5, pady=5)
+        self.timecode_var = ctk.BooleanVar(value=False)
+        self.timecode_check = ctk.CTkCheckBox(self.pgm_controls_frame, text="Timecode", variable=self.timecode_var,
+                                              command=self.update_overlays)
+        self.timecode_check.grid(row=0, column=1, padx=5, pady=5)
+        self.logo_button = ctk.CTkButton(self.pgm_controls_frame, text="Logo...", width=80, command=self.choose_logo)
+        self.logo_button.grid(row=0, column=2, padx=5, pady=5)
 
         # Controls frame
         self.controls_frame = ctk.CTkFrame(self.main_frame)
@@ -171,18 +400,15 @@ class ScanConverterApp(ctk.CTk):
         self.device_label = ctk.CTkLabel(self.controls_frame, text="Decklink Device:")
         self.device_label.grid(row=0, column=0, padx=10, pady=5)
 
-        # Use real detection (mocked for now)
-        devices = get_decklink_devices()
-        if not devices:
-            devices = ["No DeckLink card detected."]
-        self.device_option = ctk.CTkOptionMenu(self.controls_frame, values=devices, command=self.on_device_selected)
+        # Filled in by apply_inventory once devices are known.
+        self.device_option = ctk.CTkOptionMenu(self.controls_frame, values=[SCANNING], command=self.on_device_selected)
         self.device_option.grid(row=0, column=1, padx=10, pady=5)
-        self.device_option.set(devices[0])
+        self.device_option.set(SCANNING)
 
         # Format selection
         self.format_label = ctk.CTkLabel(self.controls_frame, text="Signal Format:")
         self.format_label.grid(row=0, column=2, padx=10, pady=5)
-        self.format_option = ctk.CTkOptionMenu(self.controls_frame, values=MOCK_FORMATS)
+        self.format_option = ctk.CTkOptionMenu(self.controls_frame, values=SIGNAL_FORMATS, command=self.change_format)
         self.format_option.grid(row=0, column=3, padx=10, pady=5)
 
         # Send to PGM button
@@ -193,6 +419,12 @@ class ScanConverterApp(ctk.CTk):
         self.settings_button = ctk.CTkButton(self.controls_frame, text="Settings", command=self.open_settings)
         self.settings_button.grid(row=0, column=5, padx=10, pady=5)
 
+        self.stats_button = ctk.CTkButton(self.controls_frame, text="Stats", command=self.open_stats)
+        self.stats_button.grid(row=0, column=6, padx=10, pady=5)
+
+        self.rescan_button = ctk.CTkButton(self.controls_frame, text="Rescan", width=80, command=self.rescan_devices)
+        self.rescan_button.grid(row=0, column=7, padx=10, pady=5)
+
         # Audio Frame
         self.audio_frame = ctk.CTkFrame(self.main_frame)
         self.audio_frame.grid(row=2, column=0, columnspan=2, pady=(20, 0), padx=20, sticky="ew")
@@ -200,15 +432,11 @@ class ScanConverterApp(ctk.CTk):
         self.audio_label = ctk.CTkLabel(self.audio_frame, text="Microphone:", font=("Arial", 16, "bold"))
         self.audio_label.pack(side="left", padx=(20, 10), pady=10)
 
-        self.audio_devices = self.get_audio_devices()
-        self.audio_device_names = [d['name'] for d in self.audio_devices] if self.audio_devices else ["No microphone devices found"]
-        self.selected_audio_device_name = ctk.StringVar(value=self.audio_device_names[0])
+        self.selected_audio_device_name = ctk.StringVar(value=SCANNING)
 
-        self.audio_option_menu = ctk.CTkOptionMenu(self.audio_frame, variable=self.selected_audio_device_name, values=self.audio_device_names, command=self.change_audio_device)
+        self.audio_option_menu = ctk.CTkOptionMenu(self.audio_frame, variable=self.selected_audio_device_name, values=[SCANNING], command=self.change_audio_device)
         self.audio_option_menu.pack(side="left", padx=10, pady=10)
-
-        if not self.audio_devices:
-            self.audio_option_menu.configure(state="disabled")
+        self.audio_option_menu.configure(state="disabled")
 
         self.volume_label = ctk.CTkLabel(self.audio_frame, text="Volume:")
         self.volume_label.pack(side="left", padx=(20, 10), pady=10)
@@ -226,15 +454,11 @@ class ScanConverterApp(ctk.CTk):
         self.audio_output_label = ctk.CTkLabel(self.audio_output_frame, text="Audio Output:", font=("Arial", 16, "bold"))
         self.audio_output_label.pack(side="left", padx=(20, 10), pady=10)
 
-        self.audio_output_devices = self.get_audio_output_devices()
-        self.audio_output_device_names = [d['name'] for d in self.audio_output_devices] if self.audio_output_devices else ["No output devices found"]
-        self.selected_audio_output_device_name = ctk.StringVar(value=self.audio_output_device_names[0])
+        self.selected_audio_output_device_name = ctk.StringVar(value=SCANNING)
 
-        self.audio_output_option_menu = ctk.CTkOptionMenu(self.audio_output_frame, variable=self.selected_audio_output_device_name, values=self.audio_output_device_names, command=self.change_audio_output_device)
+        self.audio_output_option_menu = ctk.CTkOptionMenu(self.audio_output_frame, variable=self.selected_audio_output_device_name, values=[SCANNING], command=self.change_audio_output_device)
         self.audio_output_option_menu.pack(side="left", padx=10, pady=10)
-
-        if not self.audio_output_devices:
-            self.audio_output_option_menu.configure(state="disabled")
+        self.audio_output_option_menu.configure(state="disabled")
 
         self.output_volume_label = ctk.CTkLabel(self.audio_output_frame, text="Volume:")
         self.output_volume_label.pack(side="left", padx=(20, 10), pady=10)
@@ -243,109 +467,183 @@ class ScanConverterApp(ctk.CTk):
         self.output_volume_meter.pack(side="left", padx=10, pady=10, expand=True, fill="x")
         self.output_volume_meter.set(0)
 
+        # Program audio channels embedded in the output; the output device
+        # monitors the first ones. Same values as audio_mix.PROGRAM_CHANNELS,
+        # which is not imported here to keep NumPy off the start-up path.
+        self.audio_channels_label = ctk.CTkLabel(self.audio_output_frame, text="Channels:")
+        self.audio_channels_label.pack(side="left", padx=(20, 5), pady=10)
+        self.audio_channels_var = ctk.StringVar(value="2")
+        self.audio_channels_menu = ctk.CTkOptionMenu(self.audio_output_frame, variable=self.audio_channels_var,
+                                                     values=["2", "8", "16"], width=70,
+                                                     command=self.change_audio_channels)
+        self.audio_channels_menu.pack(side="left", padx=5, pady=10)
+        self.routing_button = ctk.CTkButton(self.audio_output_frame, text="Routing...", width=90,
+                                            command=self.open_routing)
+        self.routing_button.pack(side="left", padx=(5, 20), pady=10)
+
+
+
+        if self.inventory.devices is not None:
+            self.apply_inventory(self.inventory.devices)
+            self.inventory_version = self.inventory.version
+
+        # Everything slow happens after the first frame of the window.
+        self.after(0, self.on_window_shown)
+
+    def on_window_shown(self):
+        self.startup.mark("window")
+        self.inventory.scan()
+        self.poll_inventory()
+        self.after(10, self.start_engine)
+
+    def start_engine(self):
+        from engine import ScanConverterEngine
+
+        self.engine = ScanConverterEngine(self.selected_monitor_index, self.roi_coords, self.format_option.get())
+        # The windowed build has no console, so stats also go to a file.
+        self.engine.start_stats_file(DEFAULT_STATS_PATH)
+        self.update_overlays()
+        self.engine.set_audio_channels(int(self.audio_channels_var.get()))
+        self.start_pvw_update()
+        self.update_meters()
+        self.startup.mark("engine")
+        self.write_startup_report()
+
+    def write_startup_report(self):
+        # Written once both the engine and the first live device scan are in.
+        if "engine" not in self.startup.marks or "devices" not in self.startup.marks:
+            return
+        report = self.startup.report()
+        print("Startup:", json.dumps(report))
+        try:
+            with open(STARTUP_REPORT_PATH, "w") as f:
+                json.dump(report, f, indent=2)
+        except OSError as e:
+            print(f"Could not write startup report: {e}")
 
+    def poll_inventory(self):
+        # The scan runs on its own thread; Tk widgets are only touched here.
+        if not self.pvw_running or not self.winfo_exists():
+            return
+        if self.inventory.version != self.inventory_version and self.inventory.devices is not None:
+            self.inventory_version = self.inventory.version
+            self.apply_inventory(self.inventory.devices)
+        if self.inventory.scanning or self.inventory.devices is None or self.inventory.devices["cached"]:
+            self.after(50, self.poll_inventory)
+
+    def apply_inventory(self, devices):
+        self.monitor_list = devices["monitors"]
+        self.monitor_names = [f"Monitor {i+1}" for i in range(len(self.monitor_list))]
+        self.monitor_option.configure(values=self.monitor_names or [""])
+        if self.selected_monitor_index >= len(self.monitor_names):
+            self.selected_monitor_index = 0
+            if self.engine is not None:
+                self.engine.set_source(0, None)
+        self.monitor_option.set(self.monitor_names[self.selected_monitor_index] if self.monitor_names else "")
 
-        self.start_pvw_update()
+        # Use real detection (mocked for now)
+        decklink = devices["decklink"] or [NO_DECKLINK]
+        self.device_option.configure(values=decklink)
+        if self.device_option.get() not in decklink:
+            self.device_option.set(decklink[0])
+
+        self.audio_devices = devices["inputs"]
+        self.audio_output_devices = devices["outputs"]
+        menus = ((self.audio_option_menu, self.selected_audio_device_name, self.audio_devices, NO_INPUTS),
+                 (self.audio_output_option_menu, self.selected_audio_output_device_name, self.audio_output_devices, NO_OUTPUTS))
+        for menu, variable, found, empty in menus:
+            names = [d['name'] for d in found] or [empty]
+            menu.configure(values=names, state="normal" if found else "disabled")
+            if variable.get() not in names:
+                variable.set(names[0])
+
+        if not devices["cached"]:
+            if "audio" in devices["errors"]:
+                print(f"Error querying audio devices: {devices['errors']['audio']}")
+                show_message(title="Audio Error", message=f"Could not find audio devices: {devices['errors']['audio']}")
+            if "rescan" in devices["errors"]:
+                print(f"Rescan: {devices['errors']['rescan']}")
+            self.startup.mark("devices")
+            self.write_startup_report()
+            if self.audio_was_running:
+                self.audio_was_running = False
+                self.reconfigure_audio_streams()
+
+    def rescan_devices(self):
+        if self.inventory.scanning:
+            return
+        # Re-initialising PortAudio invalidates open streams; audio restarts
+        # on the same devices (if still present) once the scan is applied.
+        if self.engine is not None:
+            if self.engine.audio_stream is not None:
+                self.audio_was_running = True
+                self.engine.stop_audio()
+            self.engine.audio_caps.clear()
+        self.inventory.scan(rescan=True)
+        self.poll_inventory()
 
     def change_monitor(self, value):
+        if value not in self.monitor_names:
+            return
         self.selected_monitor_index = self.monitor_names.index(value)
+        if self.engine is not None:
+            self.engine.set_source(self.selected_monitor_index, self.roi_coords)
+
+    def change_format(self, value):
+        if self.engine is not None:
+            self.engine.set_format(value)
 
     def start_pvw_update(self):
-        import mss
-        self.sct_for_pvw = mss.mss()
+        # Grabbing happens on the capture engine's own thread and scaling on
+        # the preview worker's; the Tk loop only pastes finished images.
+        from preview import PreviewWorker
+
+        engine = self.engine
+        self.preview = PreviewWorker(
+            engine.capture.ring.latest,
+            lambda: engine.pgm_tap if engine.program is not None else None,
+            engine.program_pressure)
+        engine.start()
+        self.preview.start()
         self.update_pvw_frame()
 
     def update_pvw_frame(self):
         if not self.pvw_running or not self.winfo_exists():
             return
-        try:
-            monitor = self.sct_for_pvw.monitors[self.selected_monitor_index + 1]
-            
-            capture_region = monitor
-            if self.roi_coords:
-                x1, y1, x2, y2 = self.roi_coords
-                width, height = x2 - x1, y2 - y1
-                if width > 5 and height > 5: # Set a minimum ROI size
-                    capture_region = {
-                        "top": monitor["top"] + y1,
-                        "left": monitor["left"] + x1,
-                        "width": width,
-                        "height": height,
-                    }
-                else: # Invalid ROI, reset it
-                    self.roi_coords = None
-            
-            img = self.sct_for_pvw.grab(capture_region)
-            img_pil = Image.frombytes('RGB', img.size, img.rgb)
-            
-            # Maintain aspect ratio for preview
-            img_pil.thumbnail((440, 220), Image.LANCZOS)
-            
-            self.pvw_imgtk = ImageTk.PhotoImage(img_pil)
-            
-            # Redraw image in the center of the canvas
-            self.pvw_canvas.delete("all")
-            self.pvw_canvas_img = self.pvw_canvas.create_image(
-                220, 110, anchor="center", image=self.pvw_imgtk
-            )
-
-        except Exception as e:
-            print("PVW error:", e)
-        
-        # Schedule next update
-        self.after(100, self.update_pvw_frame)
+        preview = self.preview
+        if preview.version != self.pvw_version:
+            self.pvw_version = preview.version
+            try:
+                self.pvw_view.show(preview.pvw_image)
+                self.pgm_view.show(preview.pgm_image)
+            except Exception as e:
+                self.pvw_errors += 1
+                print("PVW error:", e)
+        # Check twice per preview interval, so a new image waits at most half of one.
+        self.after(max(10, int(preview.interval * 500)), self.update_pvw_frame)
 
     def send_to_pgm(self):
-        ctk.CTkMessagebox(title="Info", message="Send to PGM clicked! (Stub)")
-
-    def get_audio_devices(self):
-        try:
-            devices = sd.query_devices()
-            if self.wasapi_hostapi_index != -1:
-                print("Filtering for WASAPI input devices.")
-                return [d for d in devices if d['hostapi'] == self.wasapi_hostapi_index and d['max_input_channels'] > 0]
-            # Fallback if WASAPI is not found
-            return [d for d in devices if d['max_input_channels'] > 0]
-        except Exception as e:
-            print(f"Error querying audio devices: {e}")
-            CTkMessagebox(title="Audio Error", message=f"Could not find audio devices: {e}")
-            return []
+        if self.engine is None:
+            return
+        if self.engine.program is not None:
+            self.engine.stop_program()
+            self.send_button.configure(text="Send to PGM")
+            return
+        self.engine.start_program()
+        self.send_button.configure(text="Stop PGM")
 
-    def get_audio_output_devices(self):
-        try:
-            devices = sd.query_devices()
-            if self.wasapi_hostapi_index != -1:
-                print("Filtering for WASAPI output devices.")
-                return [d for d in devices if d['hostapi'] == self.wasapi_hostapi_index and d['max_output_channels'] > 0]
-            # Fallback if WASAPI is not found
-            return [d for d in devices if d['max_output_channels'] > 0]
-        except Exception as e:
-            print(f"Error querying audio output devices: {e}")
-            return []
-    def audio_callback(self, indata, frames, time, status):
-        """This is called (from a separate thread) for each audio block."""
-        if status:
-            print(status)
-        volume_norm = np.linalg.norm(indata) * 10
-        self.volume_meter.set(min(1.0, volume_norm / 100))  # Clamp value
-        self.audio_queue.put(indata.copy())
-
-    def audio_output_callback(self, outdata, frames, time, status):
-        """This is called for each audio block to be sent to the output device."""
-        if status:
-            print(f"Audio output status: {status}")
-        try:
-            data = self.audio_queue.get_nowait()
-            # Update volume meter based on the data being played
-            volume_norm = np.linalg.norm(data) * 10
-            self.output_volume_meter.set(min(1.0, volume_norm / 100))
-        except queue.Empty:
-            # Fill with silence if no data is available
-            outdata.fill(0)
-            self.output_volume_meter.set(0)
+    def update_meters(self):
+        # Meters are computed on their own worker; the Tk loop only reads the
+        # latest levels, at about 30 Hz.
+        if not self.pvw_running or not self.winfo_exists():
             return
+        from metering import AudioMeter
 
-        outdata[:] = data
+        meters = ((self.engine.input_meter, self.volume_meter), (self.engine.output_meter, self.output_volume_meter))
+        for meter, bar in meters:
+            level = max(meter.levels["peak_db"]) if meter is not None else -float("inf")
+            bar.set(AudioMeter.meter_fraction(level))
+        self.after(33, self.update_meters)
 
     def change_audio_device(self, device_name: str):
         self.reconfigure_audio_streams()
@@ -353,98 +651,79 @@ class ScanConverterApp(ctk.CTk):
     def change_audio_output_device(self, device_name: str):
         self.reconfigure_audio_streams()
 
-    def start_streams(self, input_device_info, output_device_info, samplerate):
-        try:
-            self.audio_stream = sd.InputStream(
-                device=input_device_info['index'],
-                samplerate=samplerate,
-                channels=1,
-                callback=self.audio_callback)
-
-            self.audio_output_stream = sd.OutputStream(
-                device=output_device_info['index'],
-                samplerate=samplerate,
-                channels=1,
-                callback=self.audio_output_callback)
-
-            self.audio_stream.start()
-            self.audio_output_stream.start()
-            print(f"Successfully started streams at {samplerate} Hz")
-            return True
-        except Exception as e:
-            print(f"Failed to start streams at {samplerate} Hz: {e}")
-            # Make sure to clean up if one stream opened but the other failed
-            if self.audio_stream:
-                self.audio_stream.close()
-                self.audio_stream = None
-            if self.audio_output_stream:
-                self.audio_output_stream.close()
-                self.audio_output_stream = None
-            return False
-
     def reconfigure_audio_streams(self):
-        # 1. Stop and close any existing streams
-        if self.audio_stream:
-            self.audio_stream.stop()
-            self.audio_stream.close()
-            self.audio_stream = None
-        if self.audio_output_stream:
-            self.audio_output_stream.stop()
-            self.audio_output_stream.close()
-            self.audio_output_stream = None
-
-        # Clear the queue
-        while not self.audio_queue.empty():
-            try:
-                self.audio_queue.get_nowait()
-            except queue.Empty:
-                break
-
-        # 2. Get selected devices
+        if self.engine is None or self.inventory.scanning:
+            return
+        # 1. Get selected devices
         input_device_name = self.selected_audio_device_name.get()
         output_device_name = self.selected_audio_output_device_name.get()
 
-        if not input_device_name or input_device_name == "No microphone devices found":
-            return
-        if not output_device_name or output_device_name == "No output devices found":
+        if not input_device_name or input_device_name == NO_INPUTS or \
+                not output_device_name or output_device_name == NO_OUTPUTS:
+            self.engine.stop_audio()
             return
 
         try:
             input_device_info = next(d for d in self.audio_devices if d['name'] == input_device_name)
             output_device_info = next(d for d in self.audio_output_devices if d['name'] == output_device_name)
         except StopIteration:
+            self.engine.stop_audio()
             return
 
-        # 3. Find a working sample rate and start streams
-        standard_rates = [48000, 44100, 32000, 22050, 16000]
-        for rate in standard_rates:
-            if self.start_streams(input_device_info, output_device_info, rate):
-                return # Success
+        # 2. Start streams, or crossfade the running ones to the new devices
+        if self.engine.start_audio(input_device_info, output_device_info):
+            self.refresh_routing()
+            return # Success
 
-        # If loop finishes, no rate worked
-        CTkMessagebox(title="Audio Error", message="Could not find a compatible audio format for the selected devices.")
+        # No format worked
+        show_message(title="Audio Error", message="Could not find a compatible audio format for the selected devices.")
 
     def open_settings(self):
-        CTkMessagebox(title="Settings", message="Settings dialog (to be implemented)")
+        show_message(title="Settings", message="Settings dialog (to be implemented)")
+
+    def change_audio_channels(self, value):
+        if self.engine is None:
+            return
+        if not self.engine.set_audio_channels(int(value)):
+            show_message(title="Audio Error", message=f"Could not restart audio with {value} channels.")
+        self.refresh_routing()
+
+    def open_routing(self):
+        if self.engine is None:
+            return
+        if self.routing_panel is not None and self.routing_panel.winfo_exists():
+            self.routing_panel.focus()
+            return
+        self.routing_panel = RoutingPanel(self)
+
+    def refresh_routing(self):
+        if self.routing_panel is not None and self.routing_panel.winfo_exists():
+            self.routing_panel.build()
+
+    def open_stats(self):
+        if self.engine is None:
+            return
+        if self.stats_panel is not None and self.stats_panel.winfo_exists():
+            self.stats_panel.focus()
+            return
+        self.stats_panel = StatsPanel(self)
 
     def on_device_selected(self, value):
-        if value == "No DeckLink card detected.":
-            CTkMessagebox(title="No Device", message="No DeckLink card detected.")
+        if value == NO_DECKLINK:
+            show_message(title="No Device", message=NO_DECKLINK)
 
     def on_closing(self):
         self.pvw_running = False
-        if self.audio_stream:
-            self.audio_stream.stop()
-            self.audio_stream.close()
-        if self.audio_output_stream:
-            self.audio_output_stream.stop()
-            self.audio_output_stream.close()
+        if self.preview is not None:
+            self.preview.stop()
+        if self.engine is not None:
+            self.engine.close()
         # Give the update loop a moment to stop before destroying
         self.after(100, self.destroy)
 
     def select_roi_on_desktop(self):
         if self.selected_monitor_index < 0 or self.selected_monitor_index >= len(self.monitor_list):
-            CTkMessagebox(title="Error", message="Please select a valid monitor first.")
+            show_message(title="Error", message="Please select a valid monitor first.")
             return
         
         self.withdraw() # Hide main window
@@ -457,20 +736,57 @@ class ScanConverterApp(ctk.CTk):
             roi = roi_selector.get_roi()
             if roi and (roi[2] - roi[0]) > 5 and (roi[3] - roi[1]) > 5:
                 self.roi_coords = roi
+                if self.engine is not None:
+                    self.engine.set_source(self.selected_monitor_index, roi)
                 # Update resolution label
                 width = roi[2] - roi[0]
                 height = roi[3] - roi[1]
                 self.roi_resolution_label.configure(text=f"ROI Resolution: {width}x{height}")
             else:
                 self.roi_coords = None
+                if self.engine is not None:
+                    self.engine.set_source(self.selected_monitor_index, None)
                 self.roi_resolution_label.configure(text="") # Clear if invalid
         finally:
             self.deiconify() # Show main window again
 
     def clear_roi(self):
         self.roi_coords = None
+        if self.engine is not None:
+            self.engine.set_source(self.selected_monitor_index, None)
         self.roi_resolution_label.configure(text="")
 
+    def choose_logo(self):
+        if self.logo_path is not None:
+            # The button toggles: a second click removes the logo.
+            self.logo_path = None
+            self.logo_button.configure(text="Logo...")
+            self.update_overlays()
+            return
+        from tkinter import filedialog
+
+        path = filedialog.askopenfilename(title="Logo image", filetypes=[("Images", "*.png *.jpg *.jpeg *.bmp *.gif")])
+        if not path:
+            return
+        self.logo_path = path
+        self.logo_button.configure(text="No Logo")
+        self.update_overlays()
+
+    def update_overlays(self):
+        if self.engine is None:
+            return
+        from overlay import build_layers
+
+        try:
+            layers = build_layers(self.cursor_var.get(), self.logo_path, self.timecode_var.get())
+        except OSError as e:
+            show_message(title="Logo Error", message=f"Could not load logo: {e}")
+            self.logo_path = None
+            self.logo_button.configure(text="Logo...")
+            layers = build_layers(self.cursor_var.get(), None, self.timecode_var.get())
+        self.engine.overlays.set_layers(layers)
+
+
 if __name__ == "__main__":
     app = ScanConverterApp()
     app.protocol("WM_DELETE_WINDOW", app.on_closing)
@@ -0,0 +1,280 @@
+import math
+import threading
+import time
+
+import numpy as np
+
+# Loudness below this is reported as silence.
+SILENCE_DB = -70.0
+
+
+def k_weighting_coefficients(samplerate):
+    """(b, a) of the two BS.1770 K-weighting biquads: high-shelf pre-filter, then RLB high-pass.
+
+    They are derived for any sample rate the way libebur128 does it, so
+    44.1 kHz and below match the 48 kHz reference coefficients.
+    """
+    f0, gain, q = 1681.974450955533, 3.999843853973347, 0.7071752369554196
+    k = math.tan(math.pi * f0 / samplerate)
+    vh = 10 ** (gain / 20)
+    vb = vh ** 0.4996667741545416
+    a0 = 1 + k / q + k * k
+    shelf_b = [(vh + vb * k / q + k * k) / a0, 2 * (k * k - vh) / a0, (vh - vb * k / q + k * k) / a0]
+    shelf_a = [1.0, 2 * (k * k - 1) / a0, (1 - k / q + k * k) / a0]
+
+    f0, q = 38.13547087602444, 0.5003270373238773
+    k = math.tan(math.pi * f0 / samplerate)
+    a0 = 1 + k / q + k * k
+    hp_b = [1.0, -2.0, 1.0]
+    hp_a = [1.0, 2 * (k * k - 1) / a0, (1 - k / q + k * k) / a0]
+    return (shelf_b, shelf_a), (hp_b, hp_a)
+
+
+def k_weighting_response(samplerate, freqs):
+    """Squared magnitude of the BS.1770 K-weighting filter at `freqs` (Hz)."""
+    z = np.exp(-2j * np.pi * np.asarray(freqs) / samplerate)
+    response = 1.0
+    for b, a in k_weighting_coefficients(samplerate):
+        response = response * (b[0] + b[1] * z + b[2] * z * z) / (a[0] + a[1] * z + a[2] * z * z)
+    return np.abs(response) ** 2
+
+
+class KWeighting:
+    """The K-weighting biquads applied to fixed-length blocks, with state carried between them.
+
+    Running the recursion sample by sample in Python would be far too slow,
+    so the 4th-order cascade is handled in state-space form x' = Ax + Bu,
+    y = Cx + Du, and each block of `length` samples is split in two exact
+    parts. The response to the block from zero state is a convolution with
+    the first `length` samples of the impulse response (one rfft for all
+    channels); the response to the state left by the previous block is a
+    fixed (length, 4) matrix times that state. The state after the block
+    comes from two more precomputed matrices.
+    """
+
+    def __init__(self, samplerate, length):
+        # Cascade of transposed direct form II sections, the second fed by
+        # the first's output.
+        sections = []
+        for b, a in k_weighting_coefficients(samplerate):
+            sections.append((np.array([[-a[1], 1.0], [-a[2], 0.0]]),
+                             np.array([b[1] - a[1] * b[0], b[2] - a[2] * b[0]]),
+                             np.array([1.0, 0.0]), b[0]))
+        (a1, b1, c1, d1), (a2, b2, c2, d2) = sections
+        self.A = np.block([[a1, np.zeros((2, 2))], [np.outer(b2, c1), a2]])
+        self.B = np.concatenate((b1, b2 * d1))
+        self.C = np.concatenate((d2 * c1, c2))
+        self.D = d2 * d1
+        self.length = length
+
+        # powers[k] = A^k for k in 0..length.
+        powers = np.empty((length + 1, 4, 4))
+        powers[0] = np.eye(4)
+        for k in range(length):
+            powers[k + 1] = powers[k] @ self.A
+        self._from_state = np.einsum("j,kji->ki", self.C, powers[:length])
+        impulse = np.empty(length)
+        impulse[0] = self.D
+        impulse[1:] = np.einsum("j,kji,i->k", self.C, powers[:length - 1], self.B)
+        self._n_fft = 2 * length
+        self._impulse_spectrum = np.fft.rfft(impulse, self._n_fft)
+        self._decay = powers[length]
+        # _to_state[:, k] = A^(length-1-k) B: how sample k reaches the next state.
+        self._to_state = (powers[length - 1::-1] @ self.B).T
+
+    def zero_state(self, channels):
+        return np.zeros((4, channels))
+
+    def process(self, block, state):
+        """K-weighted (length, channels) `block` and the state after it."""
+        spectrum = np.fft.rfft(block, self._n_fft, axis=0)
+        out = np.fft.irfft(spectrum * self._impulse_spectrum[:, None], self._n_fft, axis=0)[:self.length]
+        out += self._from_state @ state
+        return out, self._decay @ state + self._to_state @ block
+
+
+def _lufs(power):
+    return -0.691 + 10 * math.log10(power) if power > 0 else SILENCE_DB
+
+
+class AudioMeter:
+    """Peak, RMS and EBU R128 loudness computed off the realtime thread.
+
+    The audio callback only calls `feed`, which copies the block into a
+    preallocated ring. A worker thread drains the ring in batches of 100 ms
+    sub-blocks and computes, per channel, peak and RMS, plus momentary
+    (400 ms), short-term (3 s) and gated integrated loudness of the whole
+    program. Short-term and integrated loudness are also kept per channel
+    (`channel_short_term_lufs`, `channel_integrated_lufs`), so a single
+    embedded pair or a dead channel shows up.
+
+    K-weighting runs the BS.1770 biquads with their state carried from one
+    sub-block to the next, as a compliant meter does, but a whole sub-block
+    of all channels at a time (see KWeighting). Integrated loudness keeps a
+    histogram of gating-block loudness, so memory stays constant over
+    arbitrarily long runs. Powers and histograms have one column per channel
+    and a last one for the program.
+
+    `levels` is replaced atomically with a new dict after each batch, so the
+    GUI can read it from the Tk thread at its own rate.
+    """
+
+    def __init__(self, samplerate, channels=1, interval=1 / 30):
+        self.samplerate = samplerate
+        self.channels = channels
+        self.interval = interval
+        self._sub_block = samplerate // 10
+        self._capacity = samplerate * 2
+        self._ring = np.zeros((self._capacity, channels), dtype=np.float32)
+        self._write_pos = 0
+        self._read_pos = 0
+        self._kweighting = KWeighting(samplerate, self._sub_block)
+        self._filter_state = self._kweighting.zero_state(channels)
+
+        # Per-sub-block K-weighted mean-square power of each channel and the
+        # program, newest last (3 s).
+        self._powers = np.zeros((30, channels + 1))
+        self._pending = np.zeros((self._sub_block, channels), dtype=np.float32)
+        self._pending_len = 0
+        # Gating-block loudness histogram from -70 to +5 LUFS in 0.1 LU steps.
+        self._hist_edges = np.arange(-70.0, 5.0001, 0.1)
+        self._hist_counts = np.zeros((len(self._hist_edges), channels + 1), dtype=np.int64)
+        self._hist_power = 10 ** ((self._hist_edges + 0.05 + 0.691) / 10)[:, None]
+        self._blocks_seen = 0
+
+        self.levels = self._empty_levels()
+        self._thread = None
+        self._running = threading.Event()
+
+    def _empty_levels(self):
+        silent = [SILENCE_DB] * self.channels
+        return {
+            "peak_db": silent, "rms_db": silent,
+            "momentary_lufs": SILENCE_DB, "short_term_lufs": SILENCE_DB, "integrated_lufs": SILENCE_DB,
+            "channel_short_term_lufs": silent, "channel_integrated_lufs": silent,
+        }
+
+    def feed(self, block):
+        """Realtime side: copy a (frames, channels) block. Never blocks."""
+        frames = len(block)
+        if frames > self._capacity:
+            block = block[-self._capacity:]
+            frames = self._capacity
+        start = self._write_pos % self._capacity
+        first = min(frames, self._capacity - start)
+        self._ring[start:start + first] = block[:first]
+        if first < frames:
+            self._ring[:frames - first] = block[first:]
+        self._write_pos += frames
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._running.set()
+        self._thread = threading.Thread(target=self._run, name="meter", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=1.0):
+        self._running.clear()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def reset_integrated(self):
+        self._hist_counts[:] = 0
+        self._blocks_seen = 0
+
+    def _run(self):
+        while self._running.is_set():
+            time.sleep(self.interval)
+            self.process()
+
+    def _drain(self):
+        write_pos = self._write_pos
+        # If the worker fell more than a ring behind, meter only what is left.
+        read_pos = max(self._read_pos, write_pos - self._capacity)
+        frames = write_pos - read_pos
+        self._read_pos = write_pos
+        start = read_pos % self._capacity
+        first = min(frames, self._capacity - start)
+        if first == frames:
+            return self._ring[start:start + frames].copy()
+        return np.concatenate((self._ring[start:], self._ring[:frames - first]))
+
+    def process(self):
+        """Meter everything fed since the last call; normally run by the worker."""
+        samples = self._drain()
+        if not len(samples):
+            return
+
+        peak = np.abs(samples).max(axis=0)
+        rms = np.sqrt(np.mean(np.square(samples, dtype=np.float64), axis=0))
+
+        # Complete the pending sub-block, then take whole sub-blocks in one batch.
+        take = min(len(samples), self._sub_block - self._pending_len)
+        self._pending[self._pending_len:self._pending_len + take] = samples[:take]
+        self._pending_len += take
+        samples = samples[take:]
+        blocks = []
+        if self._pending_len == self._sub_block:
+            blocks.append(self._pending.copy())
+            self._pending_len = 0
+        whole = len(samples) // self._sub_block * self._sub_block
+        if whole:
+            blocks.extend(samples[:whole].reshape(-1, self._sub_block, self.channels))
+        rest = samples[whole:]
+        self._pending[:len(rest)] = rest
+        self._pending_len += len(rest)
+        if blocks:
+            self._add_powers(np.asarray(blocks))
+
+        momentary = self._powers[-4:, -1].mean()
+        short_term = [max(SILENCE_DB, _lufs(float(p))) for p in self._powers.mean(axis=0)]
+        integrated = self._integrated()
+        self.levels = {
+            "peak_db": [max(SILENCE_DB, 20 * math.log10(p)) if p > 0 else SILENCE_DB for p in peak],
+            "rms_db": [max(SILENCE_DB, 20 * math.log10(r)) if r > 0 else SILENCE_DB for r in rms],
+            "momentary_lufs": max(SILENCE_DB, _lufs(float(momentary))),
+            "short_term_lufs": short_term[-1],
+            "integrated_lufs": integrated[-1],
+            "channel_short_term_lufs": short_term[:-1],
+            "channel_integrated_lufs": integrated[:-1],
+        }
+
+    def _add_powers(self, blocks):
+        power = np.empty((len(blocks), self.channels))
+        for i, block in enumerate(blocks):
+            weighted, self._filter_state = self._kweighting.process(block, self._filter_state)
+            power[i] = np.mean(np.square(weighted), axis=0)
+        # BS.1770 channel weights are 1.0 for front channels, so the program
+        # is the sum over channels.
+        power = np.concatenate((power, power.sum(axis=1, keepdims=True)), axis=1)
+
+        self._powers = np.concatenate((self._powers, power))[-30:]
+        # Gating blocks are 400 ms with 75% overlap: one per new sub-block.
+        self._blocks_seen += len(power)
+        if self._blocks_seen >= 4:
+            p = self._powers
+            gating = ((p[3:] + p[2:-1] + p[1:-2] + p[:-3]) / 4)[-min(len(power), self._blocks_seen - 3):]
+            loudness = -0.691 + 10 * np.log10(np.maximum(gating, 1e-20))
+            columns = np.broadcast_to(np.arange(loudness.shape[1]), loudness.shape)
+            valid = loudness > SILENCE_DB
+            bins = np.clip(np.searchsorted(self._hist_edges, loudness[valid]) - 1, 0, len(self._hist_edges) - 1)
+            np.add.at(self._hist_counts, (bins, columns[valid]), 1)
+
+    def _integrated(self):
+        """Gated integrated loudness of every channel, then the program."""
+        counts = self._hist_counts
+        total = counts.sum(axis=0)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            # Relative gate at -10 LU below the absolute-gated mean.
+            mean = (counts * self._hist_power).sum(axis=0) / total
+            relative = -0.691 + 10 * np.log10(mean) - 10
+            gated = counts * (self._hist_edges[:, None] >= relative)
+            loudness = -0.691 + 10 * np.log10((gated * self._hist_power).sum(axis=0) / gated.sum(axis=0))
+        return [max(SILENCE_DB, float(v)) if np.isfinite(v) else SILENCE_DB for v in loudness]
+
+    @staticmethod
+    def meter_fraction(db, floor=-60.0):
+        """Map a dB reading onto 0..1 for a progress-bar style meter."""
+        return min(1.0, max(0.0, (db - floor) / -floor))
@@ -0,0 +1,301 @@
+"""Keyer layers composited into the PGM picture: cursor, logo bug, timecode.
+
+Layers are drawn in output pixels, inside the active (letterboxed) picture,
+so text and logos stay sharp whatever the capture size. Each layer renders
+its artwork once per output geometry (scaled with LANCZOS, premultiplied,
+as float32 BGRA plus 1 - alpha) and per frame only says where it goes:
+a Placement. Timecode digits are cached glyph cells copied side by side.
+
+ScanConverter composites placements into the blocks it renders anyway,
+with one multiply-add per overlay pixel, and marks the output tiles under
+any placement that moved or changed as dirty. A static logo therefore
+costs nothing after its first frame, and a running timecode only its own
+tiles.
+"""
+import time
+from collections import namedtuple
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+# Premultiplied BGRA colour (float32, 0..255) and 1 - alpha, (h, w, 1).
+Sprite = namedtuple("Sprite", "color inverse_alpha")
+
+# Where a sprite goes in active-picture pixels. `key` identifies what is
+# drawn, so the converter can tell when a placement needs redrawing.
+Placement = namedtuple("Placement", "x y sprite key")
+
+# Anchors as fractions of the free space left/above the sprite.
+POSITIONS = {
+    "top-left": (0.0, 0.0),
+    "top-center": (0.5, 0.0),
+    "top-right": (1.0, 0.0),
+    "bottom-left": (0.0, 1.0),
+    "bottom-center": (0.5, 1.0),
+    "bottom-right": (1.0, 1.0),
+}
+
+# Logos and timecode stay inside the title-safe area (90% of the picture).
+SAFE_MARGIN = 0.05
+
+FONT_NAMES = ("consolab.ttf", "DejaVuSansMono-Bold.ttf", "LiberationMono-Bold.ttf")
+
+
+def premultiply(image):
+    """Sprite from a PIL image (any mode with or without alpha)."""
+    rgba = np.asarray(image.convert("RGBA"), dtype=np.float32)
+    inverse_alpha = 1.0 - rgba[..., 3:] / 255.0
+    color = rgba[..., [2, 1, 0, 3]]
+    color[..., :3] *= 1.0 - inverse_alpha
+    return Sprite(np.ascontiguousarray(color), np.ascontiguousarray(inverse_alpha))
+
+
+def anchor(position, width, height, sprite_width, sprite_height):
+    """Top-left corner of a sprite at `position` inside the safe area."""
+    fx, fy = POSITIONS[position]
+    mx, my = round(width * SAFE_MARGIN), round(height * SAFE_MARGIN)
+    x = mx + round((width - 2 * mx - sprite_width) * fx)
+    y = my + round((height - 2 * my - sprite_height) * fy)
+    return x, y
+
+
+def load_font(size):
+    for name in FONT_NAMES:
+        try:
+            return ImageFont.truetype(name, size)
+        except OSError:
+            continue
+    return ImageFont.load_default(size)
+
+
+class Layer:
+    """Base class: `prepare` once per output geometry, `place` per frame.
+
+    `prepare(width, height, scale, rate)` gets the active picture size, the
+    output pixels per captured pixel and the output frame rate. `place(frame,
+    field)` returns a Placement or None; `field` is 1 for the second field
+    of an interlaced frame, else 0 or None. Both run on the PGM thread.
+    """
+
+    enabled = True
+
+    def prepare(self, width, height, scale, rate):
+        pass
+
+    def place(self, frame, field=None):
+        return None
+
+
+class LogoLayer(Layer):
+    """A station logo ("bug") from an image file or PIL image."""
+
+    def __init__(self, image, position="top-right", height=0.08, opacity=1.0):
+        self.image = Image.open(image) if isinstance(image, str) else image
+        self.image.load()
+        self.position = position
+        self.height = height
+        self.opacity = opacity
+        self._cache = {}
+        self._placement = None
+
+    def prepare(self, width, height, scale, rate):
+        key = (width, height)
+        sprite = self._cache.get(key)
+        if sprite is None:
+            logo = self.image.convert("RGBA")
+            logo_height = max(1, round(height * self.height))
+            logo_width = max(1, round(logo.width * logo_height / logo.height))
+            logo = logo.resize((logo_width, logo_height), Image.LANCZOS)
+            if self.opacity < 1.0:
+                logo.putalpha(logo.getchannel("A").point(lambda a: round(a * self.opacity)))
+            sprite = self._cache[key] = premultiply(logo)
+        x, y = anchor(self.position, width, height, sprite.color.shape[1], sprite.color.shape[0])
+        self._placement = Placement(x, y, sprite, ("logo", id(self), key))
+
+    def place(self, frame, field=None):
+        return self._placement
+
+
+class TimecodeLayer(Layer):
+    """Time-of-day timecode (HH:MM:SS:FF) in white on a dark box.
+
+    Each frame is labelled from its capture timestamp, so the burnt-in time
+    is when the picture was grabbed. Both fields of an interlaced frame get
+    the frame's label.
+    """
+
+    GLYPHS = "0123456789:"
+
+    def __init__(self, position="bottom-center", height=0.05, box_opacity=0.6):
+        self.position = position
+        self.height = height
+        self.box_opacity = box_opacity
+        # monotonic() -> time-of-day, fixed once so labels never jump.
+        self._wall_offset = time.time() - time.monotonic()
+        self._cache = {}
+        self._cells = None
+        self._rate = 25.0
+        self._geometry = None
+        self._text = None
+        self._placement = None
+
+    def _render_cells(self, cell_height):
+        font = load_font(max(8, round(cell_height * 0.8)))
+        cell_width = max(round(font.getlength(ch)) for ch in self.GLYPHS) + 2
+        cells = {}
+        for ch in self.GLYPHS:
+            cell = Image.new("RGBA", (cell_width, cell_height), (0, 0, 0, round(255 * self.box_opacity)))
+            text = Image.new("RGBA", cell.size, (255, 255, 255, 0))
+            ImageDraw.Draw(text).text((cell_width / 2, cell_height / 2), ch, font=font, anchor="mm",
+                                      fill=(255, 255, 255, 255))
+            cells[ch] = premultiply(Image.alpha_composite(cell, text))
+        return cells
+
+    def prepare(self, width, height, scale, rate):
+        cell_height = max(8, round(height * self.height))
+        cells = self._cache.get(cell_height)
+        if cells is None:
+            cells = self._cache[cell_height] = self._render_cells(cell_height)
+        self._cells = cells
+        self._rate = rate
+        cell_width = cells["0"].color.shape[1]
+        text_width = cell_width * len("00:00:00:00")
+        # One buffer, rewritten in place when the label changes.
+        self._color = np.empty((cell_height, text_width, 4), dtype=np.float32)
+        self._inverse_alpha = np.empty((cell_height, text_width, 1), dtype=np.float32)
+        self._geometry = anchor(self.position, width, height, text_width, cell_height)
+        self._text = None
+
+    def label(self, timestamp):
+        wall = timestamp + self._wall_offset
+        frames = int((wall % 1.0) * self._rate)
+        t = time.localtime(wall)
+        return f"{t.tm_hour:02d}:{t.tm_min:02d}:{t.tm_sec:02d}:{frames:02d}"
+
+    def place(self, frame, field=None):
+        if self._cells is None:
+            return None
+        timestamp = frame.timestamp
+        if field == 1:
+            # The second field belongs to the frame its first field started.
+            timestamp -= 0.5 / self._rate
+        text = self.label(timestamp)
+        if text != self._text:
+            cell_width = self._cells["0"].color.shape[1]
+            for i, ch in enumerate(text):
+                cell = self._cells[ch]
+                self._color[:, i * cell_width:(i + 1) * cell_width] = cell.color
+                self._inverse_alpha[:, i * cell_width:(i + 1) * cell_width] = cell.inverse_alpha
+            self._text = text
+            x, y = self._geometry
+            self._placement = Placement(x, y, Sprite(self._color, self._inverse_alpha), ("timecode", text))
+        return self._placement
+
+
+class CursorLayer(Layer):
+    """The mouse pointer, which mss leaves out of captures.
+
+    Drawn as a white arrow with a black outline where the capture source
+    reported the pointer (`Frame.cursor`, desktop coordinates); frames
+    without one get no cursor.
+    """
+
+    # Arrow outline on a 12 x 19 grid, hotspot at (0, 0).
+    ARROW = [(0, 0), (0, 16), (4, 12), (7, 19), (9, 18), (6, 11), (11, 11)]
+    SUPERSAMPLE = 4
+
+    def __init__(self, size=1.0):
+        self.size = size
+        self._cache = {}
+        self._sprite = None
+        self._scale = 1.0
+
+    def _render(self, unit):
+        ss = unit * self.SUPERSAMPLE
+        pad = max(1, round(ss))
+        image = Image.new("RGBA", (round(12 * ss) + 2 * pad, round(19 * ss) + 2 * pad), (0, 0, 0, 0))
+        points = [(pad + x * ss, pad + y * ss) for x, y in self.ARROW]
+        ImageDraw.Draw(image).polygon(points, fill=(255, 255, 255, 255), outline=(0, 0, 0, 255),
+                                      width=max(1, round(ss)))
+        return premultiply(image.reduce(self.SUPERSAMPLE)), pad // self.SUPERSAMPLE
+
+    def prepare(self, width, height, scale, rate):
+        # About as big as the pointer looked on the captured screen.
+        unit = round(max(0.5, scale * self.size), 2)
+        sprite = self._cache.get(unit)
+        if sprite is None:
+            sprite = self._cache[unit] = self._render(unit)
+        self._sprite, self._hotspot = sprite
+        self._scale = scale
+
+    def place(self, frame, field=None):
+        cursor = frame.cursor
+        if cursor is None or self._sprite is None:
+            return None
+        x = round((cursor[0] - frame.origin[0]) * self._scale) - self._hotspot
+        y = round((cursor[1] - frame.origin[1]) * self._scale) - self._hotspot
+        return Placement(x, y, self._sprite, ("cursor", id(self._sprite), x, y))
+
+
+class OverlayStack:
+    """The ordered layers of the keyer, bottom first.
+
+    `layers` is replaced whole by `set_layers`, so the GUI can change it
+    while the PGM thread is compositing. Layers added after `prepare` are
+    prepared on their first `place`.
+    """
+
+    def __init__(self, layers=()):
+        self.layers = tuple(layers)
+        self._geometry = None
+        self._prepared = {}
+
+    def set_layers(self, layers):
+        self.layers = tuple(layers)
+
+    def prepare(self, width, height, scale, rate):
+        self._geometry = (width, height, scale, rate)
+        self._prepared = {}
+
+    def place(self, frame, field=None):
+        placements = []
+        if self._geometry is None:
+            return placements
+        for layer in self.layers:
+            if not layer.enabled:
+                continue
+            if self._prepared.get(id(layer)) is not layer:
+                layer.prepare(*self._geometry)
+                self._prepared[id(layer)] = layer
+            placement = layer.place(frame, field)
+            if placement is not None:
+                placements.append(placement)
+        return placements
+
+
+def composite(block, top, left, placements):
+    """Composite placements over a float32 BGRA block at (top, left) of the picture."""
+    height, width = block.shape[:2]
+    for p in placements:
+        sprite_height, sprite_width = p.sprite.color.shape[:2]
+        y0, y1 = max(top, p.y), min(top + height, p.y + sprite_height)
+        x0, x1 = max(left, p.x), min(left + width, p.x + sprite_width)
+        if y0 >= y1 or x0 >= x1:
+            continue
+        dst = block[y0 - top:y1 - top, x0 - left:x1 - left]
+        src = (slice(y0 - p.y, y1 - p.y), slice(x0 - p.x, x1 - p.x))
+        dst *= p.sprite.inverse_alpha[src]
+        dst += p.sprite.color[src]
+
+
+def build_layers(cursor=False, logo=None, timecode=False, logo_position="top-right",
+                 timecode_position="bottom-center"):
+    """Layers for the usual keyer setup, bottom to top: logo, timecode, cursor."""
+    layers = []
+    if logo:
+        layers.append(LogoLayer(logo, logo_position))
+    if timecode:
+        layers.append(TimecodeLayer(timecode_position))
+    if cursor:
+        layers.append(CursorLayer())
+    return layers
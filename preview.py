@@ -0,0 +1,249 @@
+"""Small preview images of the capture (PVW) and the converted output (PGM).
+
+Previews are a few hundred pixels wide, so almost all of a full-resolution
+frame is thrown away. Each one is first shrunk by an integer factor with
+PIL's box `reduce`, which averages whole pixel blocks in one C pass over a
+zero-copy view of the buffer. Only the result, already within 2x of the
+target, goes through a bilinear resize to the exact letterboxed size.
+
+Packed PGM output is averaged before it is decoded: a UYVY group (U Y0 V
+Y1) is viewed as one 4-band pixel, so only the reduced picture is unpacked
+to RGB. Averaging Y'CbCr before the (linear) conversion gives the same
+picture up to rounding. v210 lists its components in UYVY order, so it is
+first cut down to 8-bit UYVY by one shift-and-mask.
+
+PreviewWorker does this on its own thread at an adaptive rate and hands
+finished PIL images to the GUI, whose only remaining job is pasting them.
+"""
+import threading
+import time
+
+import numpy as np
+from PIL import Image
+
+from convert import PIXEL_GROUPS, fit_letterbox, unpack_to_bgra
+
+PREVIEW_SIZE = (440, 220)
+
+# Preview refresh interval bounds. The worker backs off towards the slow end
+# while the PGM path is close to its budget.
+FAST_INTERVAL = 1 / 25
+SLOW_INTERVAL = 1 / 4
+
+# Conversion budget usage above which the preview slows down, and below
+# which it speeds back up.
+HIGH_PRESSURE = 0.8
+LOW_PRESSURE = 0.6
+
+
+def _fit(width, height, box):
+    _, _, fit_width, fit_height = fit_letterbox(width, height, *box, align=1)
+    return fit_width, fit_height
+
+
+def _finish(image, size):
+    """Resize a prescaled image whose bands are B, G, R, X to an RGB `size`."""
+    if image.size != size:
+        image = image.resize(size, Image.BILINEAR)
+    b, g, r, _ = image.split()
+    return Image.merge("RGB", (r, g, b))
+
+
+def bgrx_preview(data, box=PREVIEW_SIZE):
+    """RGB preview image of a (height, width, 4) BGRX frame, fitted in `box`."""
+    height, width = data.shape[:2]
+    size = _fit(width, height, box)
+    factor = max(1, min(width // size[0], height // size[1]))
+    # Channel order does not matter to the resampler; RGBX, not RGBA, so
+    # the padding byte is not treated as alpha.
+    image = Image.frombuffer("RGBX", (width, height), data, "raw", "RGBX", 0, 1)
+    if factor > 1:
+        image = image.reduce(factor)
+    return _finish(image, size)
+
+
+def _v210_to_uyvy(data, width):
+    # The 12 fields of a v210 group are Cb Y Cr Y Cb Y Cr Y Cb Y Cr Y: three
+    # UYVY groups. Keep the top 8 of each 10 bits.
+    groups = -(-width // PIXEL_GROUPS["v210"])
+    words = data.view(np.uint32)[:, :groups * 4]
+    out = np.empty(words.shape + (3,), dtype=np.uint8)
+    for i, shift in enumerate((2, 12, 22)):
+        # Assigning to uint8 keeps the low byte.
+        out[..., i] = words >> shift
+    return out.reshape(data.shape[0], -1), groups * PIXEL_GROUPS["v210"]
+
+
+def packed_preview(data, width, pixel_format, box=PREVIEW_SIZE):
+    """RGB preview image of a packed (height, stride) UYVY or v210 picture."""
+    if pixel_format == "v210":
+        data, width = _v210_to_uyvy(data, width)
+    height = data.shape[0]
+    size = _fit(width, height, box)
+    factor = max(1, min(width // size[0], height // size[1]))
+    # Horizontally in UYVY groups (pixel pairs), vertically in lines.
+    group = PIXEL_GROUPS["uyvy"]
+    groups = width // group
+    image = Image.frombuffer("RGBX", (groups, height), data, "raw", "RGBX", data.strides[0], 1)
+    reduced = np.asarray(image.reduce((max(1, factor // group), factor)))
+    small_width = reduced.shape[1] * group
+    bgra = unpack_to_bgra(reduced.reshape(reduced.shape[0], -1), small_width, "uyvy")
+    return _finish(Image.frombuffer("RGBX", (small_width, bgra.shape[0]), bgra, "raw", "RGBX", 0, 1), size)
+
+
+class OutputTap:
+    """Hands a copy of the PGM output to the preview, only when asked.
+
+    The converter reuses its output buffers, so the PGM thread copies the
+    picture into the tap's own buffer, and only after `request()`: the copy
+    happens at preview rate, not at the output frame rate.
+    """
+
+    def __init__(self):
+        self._buffer = None
+        self._wanted = threading.Event()
+        self._lock = threading.Lock()
+        self.seq = 0
+        self.pixel_format = None
+        self.width = None
+
+    def request(self):
+        self._wanted.set()
+
+    def offer(self, output, width, pixel_format):
+        """PGM side: copy `output` if a preview asked for one."""
+        if not self._wanted.is_set():
+            return
+        self._wanted.clear()
+        with self._lock:
+            if self._buffer is None or self._buffer.shape != output.shape:
+                self._buffer = np.empty_like(output)
+            np.copyto(self._buffer, output)
+            self.width = width
+            self.pixel_format = pixel_format
+            self.seq += 1
+
+    def reset(self):
+        with self._lock:
+            self._buffer = None
+            self.seq += 1
+
+    def render(self, box=PREVIEW_SIZE):
+        """Preview image of the last copied output, or None."""
+        with self._lock:
+            if self._buffer is None:
+                return None
+            return packed_preview(self._buffer, self.width, self.pixel_format, box)
+
+
+class PreviewWorker:
+    """Renders PVW and PGM preview images on a background thread.
+
+    `get_frame()` returns a retained capture Frame (or None) and
+    `get_tap()` the current OutputTap (or None when PGM is stopped);
+    `get_pressure()` returns the PGM conversion budget usage (0..1+) and
+    its over-budget count. The newest images are left in `pvw_image` and
+    `pgm_image` (None when there is nothing to show), and `version` goes
+    up whenever either changes.
+
+    The interval doubles, up to SLOW_INTERVAL, while PGM conversion is
+    running above HIGH_PRESSURE or has gone over budget since the last
+    tick. It creeps back to FAST_INTERVAL once usage drops below
+    LOW_PRESSURE. It never gets shorter than four times the worker's own
+    render time, so previews cost at most about a quarter of a core.
+    """
+
+    def __init__(self, get_frame, get_tap, get_pressure=None, box=PREVIEW_SIZE):
+        self.get_frame = get_frame
+        self.get_tap = get_tap
+        self.get_pressure = get_pressure
+        self.box = box
+        self.interval = FAST_INTERVAL
+        self.pvw_image = None
+        self.pgm_image = None
+        self.version = 0
+        self.frames = 0
+        self.errors = 0
+        self.render_time = 0.0
+        self._last_seq = None
+        self._last_tap_seq = None
+        self._last_over_budget = None
+        self._thread = None
+        self._running = threading.Event()
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._running.set()
+        self._thread = threading.Thread(target=self._run, name="preview", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=1.0):
+        self._running.clear()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _adapt(self, render_time):
+        interval = self.interval
+        if self.get_pressure is not None:
+            usage, over_budget = self.get_pressure()
+            late = self._last_over_budget is not None and over_budget > self._last_over_budget
+            self._last_over_budget = over_budget
+            if usage > HIGH_PRESSURE or late:
+                interval = min(SLOW_INTERVAL, interval * 2)
+            elif usage < LOW_PRESSURE:
+                interval = max(FAST_INTERVAL, interval * 0.9)
+        self.interval = max(interval, min(SLOW_INTERVAL, render_time * 4))
+
+    def _render(self):
+        changed = False
+        frame = self.get_frame()
+        if frame is not None:
+            try:
+                if frame.seq != self._last_seq:
+                    self._last_seq = frame.seq
+                    self.pvw_image = bgrx_preview(frame.data, self.box)
+                    changed = True
+            finally:
+                frame.release()
+
+        tap = self.get_tap()
+        if tap is None:
+            if self.pgm_image is not None:
+                self.pgm_image = None
+                changed = True
+        else:
+            if tap.seq != self._last_tap_seq:
+                self._last_tap_seq = tap.seq
+                self.pgm_image = tap.render(self.box)
+                changed = True
+            # Ask for the next output now so it is ready by the next tick.
+            tap.request()
+        if changed:
+            self.frames += 1
+            self.version += 1
+
+    def _run(self):
+        next_tick = time.monotonic()
+        while self._running.is_set():
+            started = time.perf_counter()
+            try:
+                self._render()
+            except Exception as e:
+                self.errors += 1
+                print("Preview error:", e)
+            elapsed = time.perf_counter() - started
+            self.render_time += (elapsed - self.render_time) * 0.1
+            self._adapt(elapsed)
+            next_tick = max(next_tick + self.interval, time.monotonic())
+            while self._running.is_set() and time.monotonic() < next_tick:
+                time.sleep(min(0.05, max(0.0, next_tick - time.monotonic())))
+
+    def stats(self):
+        return {
+            "frames": self.frames,
+            "interval_ms": self.interval * 1000,
+            "render_ms": self.render_time * 1000,
+            "errors": self.errors,
+        }
@@ -0,0 +1,434 @@
+"""ISO recording of the PGM feed to disk, and replay of recordings.
+
+RecordingSink is an engine sink ("record"). The conversion thread only
+copies each frame into a free buffer from a fixed set and queues it; a
+writer thread streams queued frames and their audio into segment files.
+When the disk cannot keep up and no buffer is free, the frame is dropped and
+counted instead of stalling the PGM path.
+
+Each segment is a set of files sharing one base name, made of the sink's
+prefix, its start time, the process id, the sink's number within the
+process and the segment number:
+
+    pgm_20240501_142233_4242_01_0001.uyvy   raw frames, height * stride bytes each
+    pgm_20240501_142233_4242_01_0001.wav    BWF, 24-bit PCM, bext time reference
+    pgm_20240501_142233_4242_01_0001.json   format, geometry, start timecode, counts
+
+Files are created exclusively, so should two sinks still pick the same name
+the second one fails (and counts an error) instead of overwriting.
+
+Files are preallocated to the segment's full size (posix_fallocate where
+available, so a full disk fails when the segment starts rather than as
+SIGBUS inside the map) and written through a sliding memory-mapped window,
+so every frame is one large sequential copy; on close they are truncated to
+what was written. A new segment starts when the current one reaches
+`segment_seconds`, or when its video and audio together would pass
+`segment_bytes`.
+
+ReplaySource plays segments back as a capture source, e.g.
+
+    python -m headless --replay recordings/ --sink null
+"""
+import datetime
+import errno
+import glob
+import itertools
+import json
+import mmap
+import os
+import queue
+import struct
+import threading
+import time
+
+import numpy as np
+
+from convert import line_stride, unpack_to_bgra
+from formats import frame_rate, parse_format
+from instrumentation import LatencyHistogram
+
+# Description, originator, originator reference, origination date and time,
+# time reference (low, high), version, UMID, loudness fields, reserved.
+BEXT = struct.Struct("<256s32s32s10s8sIIH64s10s180s")
+WAV_HEADER_SIZE = 12 + 8 + BEXT.size + 8 + 16 + 8
+PCM_BYTES = 3
+
+# Numbers RecordingSinks within this process, for unique segment names.
+_SINK_NUMBERS = itertools.count(1)
+
+
+class MappedFile:
+    """A preallocated file written sequentially through a sliding mmap window."""
+
+    def __init__(self, path, size, window=64 * 2 ** 20):
+        self.path = path
+        self.size = size
+        self.window = max(mmap.ALLOCATIONGRANULARITY, window // mmap.ALLOCATIONGRANULARITY * mmap.ALLOCATIONGRANULARITY)
+        self.position = 0
+        # Exclusive: never overwrite another recording.
+        self._file = open(path, "x+b")
+        self._allocate(size)
+        self._map = None
+        self._view = None
+        self._map_start = 0
+
+    def _remap(self):
+        self._unmap()
+        self._map_start = self.position // mmap.ALLOCATIONGRANULARITY * mmap.ALLOCATIONGRANULARITY
+        if self._map_start + self.window > self.size:
+            # Grow rather than fail if more data arrives than was planned.
+            self.size = max(self.size + self.window, self._map_start + self.window)
+            self._allocate(self.size)
+        self._map = mmap.mmap(self._file.fileno(), self.window, offset=self._map_start)
+        self._view = np.frombuffer(self._map, dtype=np.uint8)
+
+    def _allocate(self, size):
+        self._file.truncate(size)
+        if hasattr(os, "posix_fallocate"):
+            # truncate alone leaves a sparse file, whose blocks are only
+            # found (or not) when the map writes to them.
+            try:
+                os.posix_fallocate(self._file.fileno(), 0, size)
+            except OSError as e:
+                if e.errno not in (errno.EINVAL, errno.EOPNOTSUPP):
+                    raise
+
+    def _unmap(self):
+        if self._map is not None:
+            self._view = None  # Must go before the map can be closed.
+            self._map.close()
+            self._map = None
+
+    def write(self, data):
+        data = np.frombuffer(data, dtype=np.uint8) if not isinstance(data, np.ndarray) else data.reshape(-1).view(np.uint8)
+        done = 0
+        while done < len(data):
+            if self._map is None or self.position >= self._map_start + self.window:
+                self._remap()
+            start = self.position - self._map_start
+            n = min(len(data) - done, self.window - start)
+            self._view[start:start + n] = data[done:done + n]
+            done += n
+            self.position += n
+
+    def close(self):
+        if self._map is not None:
+            self._map.flush()
+        self._unmap()
+        self._file.truncate(self.position)
+        self._file.close()
+        return self.position
+
+
+def timecode(wall_time, fps):
+    """SMPTE-style HH:MM:SS:FF (local time of day) for a Unix timestamp."""
+    moment = datetime.datetime.fromtimestamp(wall_time)
+    frames = int(moment.microsecond / 1e6 * fps)
+    return f"{moment:%H:%M:%S}:{frames:02d}"
+
+
+def _wav_header(samplerate, channels, data_bytes, wall_time, description):
+    moment = datetime.datetime.fromtimestamp(wall_time)
+    midnight = moment.replace(hour=0, minute=0, second=0, microsecond=0)
+    reference = int((moment - midnight).total_seconds() * samplerate)
+    bext = BEXT.pack(
+        description.encode()[:256], b"scanconverter", b"", moment.strftime("%Y-%m-%d").encode(),
+        moment.strftime("%H:%M:%S").encode(), reference & 0xFFFFFFFF, reference >> 32, 1, b"", b"", b"")
+    block_align = channels * PCM_BYTES
+    return b"".join([
+        b"RIFF", struct.pack("<I", WAV_HEADER_SIZE - 8 + data_bytes), b"WAVE",
+        b"bext", struct.pack("<I", BEXT.size), bext,
+        b"fmt ", struct.pack("<IHHIIHH", 16, 1, channels, samplerate, samplerate * block_align, block_align, 8 * PCM_BYTES),
+        b"data", struct.pack("<I", data_bytes),
+    ])
+
+
+def _pcm24(block):
+    samples = np.clip(block, -1.0, 1.0) * 8388607.0
+    return samples.astype("<i4").view(np.uint8).reshape(-1, 4)[:, :PCM_BYTES]
+
+
+class _Segment:
+    def __init__(self, base, sink, wall_time):
+        self.base = base
+        self.wall_time = wall_time
+        self.frames = 0
+        self.audio_frames = 0
+        self.samplerate = None
+        self.audio_channels = None
+        self.sink = sink
+        self.video = MappedFile(f"{base}.{sink.pixel_format}", sink.frames_per_segment * sink.frame_bytes)
+        self.audio = None
+        self.audio_block_bytes = 0
+
+    @property
+    def bytes(self):
+        """Bytes written so far, video and audio."""
+        return self.video.position + (self.audio.position if self.audio is not None else 0)
+
+    def write_frame(self, data):
+        self.video.write(data)
+        self.frames += 1
+
+    def write_audio(self, block, samplerate):
+        if self.audio is None:
+            sink = self.sink
+            self.samplerate = samplerate
+            self.audio_channels = block.shape[1]
+            size = WAV_HEADER_SIZE + sink.frames_per_segment * len(block) * self.audio_channels * PCM_BYTES
+            self.audio = MappedFile(f"{self.base}.wav", size)
+            self.audio.write(_wav_header(self.samplerate, self.audio_channels, 0, self.wall_time, ""))
+        pcm = _pcm24(block)
+        self.audio.write(pcm)
+        self.audio_block_bytes = pcm.nbytes
+        self.audio_frames += len(block)
+
+    def close(self):
+        sink = self.sink
+        start = timecode(self.wall_time, sink.fps)
+        metadata = {
+            "format": sink.format.name,
+            "pixel_format": sink.pixel_format,
+            "width": sink.format.width,
+            "height": sink.format.height,
+            "stride": sink.stride,
+            "frame_rate": sink.fps,
+            "frames": self.frames,
+            "start_time": self.wall_time,
+            "start_timecode": start,
+            "video_file": os.path.basename(self.video.path),
+            "audio_file": None,
+        }
+        self.video.close()
+        if self.audio is not None:
+            data_bytes = self.audio.close() - WAV_HEADER_SIZE
+            description = f"{sink.format.name} {sink.pixel_format} start {start}"
+            with open(self.audio.path, "r+b") as f:
+                f.write(_wav_header(self.samplerate, self.audio_channels, data_bytes, self.wall_time, description))
+            metadata.update(audio_file=os.path.basename(self.audio.path), samplerate=self.samplerate,
+                            audio_channels=self.audio_channels, audio_frames=self.audio_frames)
+        with open(f"{self.base}.json", "x") as f:
+            json.dump(metadata, f, indent=2)
+
+
+class RecordingSink:
+    """Engine sink that records PGM frames and their audio to segment files.
+
+    `buffers` frames can be queued for the writer; beyond that frames are
+    dropped and counted in `dropped_frames`. Audio blocks are dropped with
+    their frame, and counted separately if the queue itself is full.
+
+    `samplerate` is the rate of the audio blocks; the engine keeps it set
+    to its audio format's. A WAV file has one rate, so after a change the
+    audio is dropped until the next segment, which starts with the next frame.
+    """
+
+    def __init__(self, video_format, pixel_format, directory="recordings", prefix="pgm",
+                 segment_seconds=300.0, segment_bytes=4 * 2 ** 30, buffers=16, samplerate=48000):
+        if isinstance(video_format, str):
+            video_format = parse_format(video_format)
+        self.format = video_format
+        self.pixel_format = pixel_format
+        self.directory = directory
+        self.prefix = prefix
+        self.segment_bytes = segment_bytes
+        self.samplerate = samplerate
+        self.fps = frame_rate(video_format)
+        self.stride = line_stride(video_format.width, pixel_format)
+        self.frame_bytes = video_format.height * self.stride
+        self.frames_per_segment = max(1, min(int(segment_seconds * self.fps), segment_bytes // self.frame_bytes))
+        os.makedirs(directory, exist_ok=True)
+
+        self._free = queue.SimpleQueue()
+        for _ in range(buffers):
+            self._free.put(np.empty((video_format.height, self.stride), dtype=np.uint8))
+        self._queue = queue.Queue(maxsize=buffers * 2)
+        # The frame whose audio may follow; None after a dropped frame.
+        self._queued_frame = None
+        # Monotonic capture stamps to wall clock, for timecode.
+        self._wall_offset = time.time() - time.monotonic()
+        self._segment = None
+        self._segment_index = 0
+        self._rate_changed = False
+        # Unique per sink: several may record into one directory, from
+        # several channel processes or one after another within a second.
+        self._session = f"{time.strftime('%Y%m%d_%H%M%S')}_{os.getpid()}_{next(_SINK_NUMBERS):02d}"
+
+        self.frames = 0
+        self.dropped_frames = 0
+        self.audio_blocks = 0
+        self.dropped_audio_blocks = 0
+        self.segments = 0
+        self.errors = 0
+        self.write_time = LatencyHistogram()
+        self._thread = threading.Thread(target=self._run, name="recorder", daemon=True)
+        self._thread.start()
+
+    def __call__(self, output, frame):
+        try:
+            buf = self._free.get_nowait()
+        except queue.Empty:
+            self.dropped_frames += 1
+            self._queued_frame = None
+            return
+        np.copyto(buf, output)
+        try:
+            self._queue.put_nowait(("video", buf, frame.timestamp))
+        except queue.Full:
+            self._free.put(buf)
+            self.dropped_frames += 1
+            self._queued_frame = None
+            return
+        self._queued_frame = frame
+        self.frames += 1
+
+    def audio(self, block, frame):
+        if frame is not self._queued_frame:
+            # Its frame was dropped; keep audio and video segments aligned.
+            self.dropped_audio_blocks += 1
+            return
+        try:
+            self._queue.put_nowait(("audio", (self.samplerate, block.copy()), frame.timestamp))
+            self.audio_blocks += 1
+        except queue.Full:
+            self.dropped_audio_blocks += 1
+
+    def _rotate(self, timestamp):
+        self._close_segment()
+        self._segment_index += 1
+        base = os.path.join(self.directory, f"{self.prefix}_{self._session}_{self._segment_index:04d}")
+        self._segment = _Segment(base, self, timestamp + self._wall_offset)
+        self.segments += 1
+
+    def _segment_full(self):
+        """Whether another frame and its audio would take the segment past `segment_bytes`."""
+        segment = self._segment
+        return segment.frames and segment.bytes + self.frame_bytes + segment.audio_block_bytes > self.segment_bytes
+
+    def _close_segment(self):
+        if self._segment is not None:
+            self._segment.close()
+            self._segment = None
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            kind, data, timestamp = item
+            started = time.perf_counter()
+            try:
+                if kind == "video":
+                    if (self._segment is None or self._segment.frames >= self.frames_per_segment
+                            or self._segment_full() or self._rate_changed):
+                        self._rate_changed = False
+                        self._rotate(timestamp)
+                    self._segment.write_frame(data)
+                elif self._segment is not None:
+                    samplerate, block = data
+                    if self._segment.samplerate not in (None, samplerate):
+                        self._rate_changed = True
+                        self.dropped_audio_blocks += 1
+                    else:
+                        self._segment.write_audio(block, samplerate)
+            except Exception as e:
+                self.errors += 1
+                print("Recorder error:", e)
+            finally:
+                if kind == "video":
+                    self._free.put(data)
+                    self.write_time.observe(time.perf_counter() - started)
+        try:
+            self._close_segment()
+        except Exception as e:
+            self.errors += 1
+            print("Recorder error:", e)
+
+    def close(self):
+        """Write out everything queued, finish the segment and stop."""
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+
+    def stats(self):
+        return {
+            "frames": self.frames,
+            "dropped_frames": self.dropped_frames,
+            "audio_blocks": self.audio_blocks,
+            "dropped_audio_blocks": self.dropped_audio_blocks,
+            "queued": self._queue.qsize(),
+            "segments": self.segments,
+            "errors": self.errors,
+            "write_ms": self.write_time.snapshot(),
+        }
+
+
+def find_segments(path):
+    """Segment metadata files for a .json path, a directory or a glob pattern."""
+    if os.path.isdir(path):
+        path = os.path.join(path, "*.json")
+    return sorted(glob.glob(path))
+
+
+class ReplaySource:
+    """Capture source that plays recorded segments back as BGRA frames.
+
+    Frames are decoded from the memory-mapped raw files one per grab, in
+    order, moving on through all segments and starting over at the end if
+    `loop` is set; otherwise `grab` returns None at the end, which stops the
+    capture engine. The capture engine's cadence sets the playback rate.
+    """
+
+    def __init__(self, path, loop=True):
+        self.paths = find_segments(path)
+        if not self.paths:
+            raise ValueError(f"No recording segments found at {path!r}")
+        frames = 0
+        for segment in self.paths:
+            with open(segment) as f:
+                frames += json.load(f)["frames"]
+        if not frames:
+            # Replaying it would find no frame to grab, forever.
+            raise ValueError(f"The recording at {path!r} has no frames")
+        self.loop = loop
+        self.index = 0
+        self._segment = -1
+        self._video = None
+        self._frame = 0
+        self.metadata = None
+
+    def open(self):
+        if self._video is None:
+            self._load(0)
+
+    def close(self):
+        self._video = None
+
+    def _load(self, segment):
+        with open(self.paths[segment]) as f:
+            self.metadata = json.load(f)
+        video_path = os.path.join(os.path.dirname(self.paths[segment]), self.metadata["video_file"])
+        m = self.metadata
+        shape = (m["frames"], m["height"], m["stride"])
+        # An empty file cannot be mapped; a segment without frames is skipped.
+        self._video = np.memmap(video_path, dtype=np.uint8, mode="r", shape=shape) if m["frames"] else np.empty(shape, np.uint8)
+        self._segment = segment
+        self._frame = 0
+
+    def grab(self, pool, monitor_index=0, roi_coords=None):
+        self.open()
+        while self._frame >= len(self._video):
+            following = self._segment + 1
+            if following == len(self.paths):
+                if not self.loop:
+                    return None
+                following = 0
+            self._load(following)
+        m = self.metadata
+        frame = pool.acquire(m["width"], m["height"])
+        unpack_to_bgra(self._video[self._frame], m["width"], m["pixel_format"], out=frame.data)
+        self._frame += 1
+        self.index += 1
+        return frame
@@ -0,0 +1,163 @@
+"""Output frame scheduling at the exact cadence of the signal format.
+
+Left to itself the PGM path converts each captured frame as it arrives, so
+output timing inherits every bit of capture jitter and every long grab.
+OutputScheduler ticks on a fixed grid instead: tick n is due at
+`epoch + n / rate` on a monotonic clock, computed from n rather than by
+adding periods, so it never drifts. At each tick it takes the newest
+captured frame stamped at or before the tick minus a delay. The choice
+depends only on capture timestamps, not on which thread ran first, so a
+slow capture repeats frames and a fast one drops them, deterministically
+and evenly spread.
+
+Capture runs at the same nominal rate on the same clock, so its stamps keep
+a steady phase against the grid. The delay puts that phase half a period
+away from the cut-off, where sleep jitter cannot push a frame across it. If
+the phase jumps to within GUARD of the cut-off (a capture overrun restarts
+its cadence, say) the delay is re-centred, at the cost of one repeat or
+drop. A phase that drifts there slowly is left alone: that is a capture
+rate off nominal, and the repeats or drops it causes are the point.
+
+`clock` defaults to time.monotonic. A clock that follows the output
+device, mapped onto the monotonic timebase the capture stamps use (as
+avsync.StreamClock does for audio input), slaves the cadence to that device.
+"""
+import time
+
+from instrumentation import LatencyHistogram
+
+# Re-centre the delay when capture stamps jump to within this fraction of
+# a period of the cut-off.
+GUARD = 0.15
+
+# The last stretch before a tick is spun rather than slept, since sleep
+# may overshoot by about a millisecond.
+SPIN_SECONDS = 0.001
+
+
+class OutputScheduler:
+    """Paces the PGM path at `rate` ticks per second.
+
+    `rate` is the format's cadence, its field rate when interlaced; `fields`
+    is the number of ticks per output frame, so ticks missed after an
+    overrun are skipped in whole frames and field parity stays on the grid.
+    `delay` is the shortest time between a capture stamp and the tick that
+    outputs it (one period by default, time for the grab to finish).
+
+    The PGM thread alternates `wait` and `pick`. Counters: `ticks`,
+    `repeats` (ticks with no newer frame), `drops` (captured frames passed
+    over), `missed` (ticks skipped because the PGM thread was late),
+    `rephases` and `empty` (ticks before the first frame). How late each
+    tick woke goes into the `jitter` histogram.
+    """
+
+    def __init__(self, rate, fields=1, delay=None, clock=time.monotonic):
+        self.rate = float(rate)
+        self.period = 1.0 / self.rate
+        self.fields = fields
+        self.min_delay = self.period if delay is None else delay
+        self.clock = clock
+        self.jitter = LatencyHistogram()
+        self._current = None
+        self.reset()
+
+    def reset(self):
+        """Start a new grid at the next `wait`, forgetting the current frame."""
+        self.close()
+        self._epoch = None
+        self._index = 0
+        self._offset = self.min_delay + self.period / 2
+        self._phase = None
+        self.ticks = 0
+        self.repeats = 0
+        self.drops = 0
+        self.missed = 0
+        self.rephases = 0
+        self.empty = 0
+        self.jitter.reset()
+
+    def close(self):
+        current, self._current = self._current, None
+        if current is not None:
+            current.release()
+
+    def wait(self, running):
+        """Sleep until the next tick and return its due time, or None once `running` is cleared."""
+        now = self.clock()
+        if self._epoch is None:
+            self._epoch = now
+            self._index = 0
+        else:
+            self._index += 1
+            # Ticks more than half a period overdue are skipped, not served late.
+            behind = int((now - self._epoch - self._index * self.period) * self.rate + 0.5)
+            if behind > 0:
+                behind = -(-behind // self.fields) * self.fields
+                self.missed += behind
+                self._index += behind
+        deadline = self._epoch + self._index * self.period
+        while True:
+            if not running.is_set():
+                return None
+            remaining = deadline - self.clock()
+            if remaining <= 0:
+                break
+            time.sleep(min(0.05, remaining - SPIN_SECONDS) if remaining > SPIN_SECONDS else 0)
+        self.jitter.observe(self.clock() - deadline)
+        self.ticks += 1
+        return deadline
+
+    def slack(self, cost=0.0):
+        """Seconds until the next tick is due, less `cost` (the work it needs); never negative."""
+        if self._epoch is None:
+            return 0.0
+        return max(0.0, self._epoch + (self._index + 1) * self.period - self.clock() - cost)
+
+    def pick(self, ring, deadline):
+        """Frame to output at the tick due at `deadline`, and the capture time it stands for.
+
+        The frame is retained for the caller; it is None until capture has
+        delivered a frame old enough. The time is the tick's cut-off, which
+        advances by exactly one period per tick even across repeats and
+        drops, so audio cut against it stays continuous.
+        """
+        cutoff = deadline - self._offset
+        frame, skipped = ring.take(cutoff)
+        if frame is not None:
+            self.drops += skipped
+            phase = (cutoff - frame.timestamp) % self.period
+            guard = GUARD * self.period
+            jumped = self._phase is None or guard < abs((phase - self._phase + self.period / 2) % self.period
+                                                        - self.period / 2)
+            if jumped and not guard <= phase <= self.period - guard:
+                # Move the cut-off half a period from this stamp, keeping
+                # the delay between min_delay and one period more.
+                offset = deadline - frame.timestamp - self.period / 2
+                offset += -((offset - self.min_delay) // self.period) * self.period
+                self._offset = offset
+                self.rephases += 1
+                phase = self.period / 2
+            self._phase = phase
+            self.close()
+            self._current = frame
+        elif self._current is not None:
+            self.repeats += 1
+        else:
+            self.empty += 1
+            return None, cutoff
+        return self._current.retain(), cutoff
+
+    def stats(self):
+        jitter = self.jitter.snapshot()
+        return {
+            "rate": self.rate,
+            "ticks": self.ticks,
+            "repeats": self.repeats,
+            "drops": self.drops,
+            "missed": self.missed,
+            "rephases": self.rephases,
+            "delay_ms": self._offset * 1000,
+            "jitter_ms": jitter["mean_ms"],
+            "jitter_p99_ms": jitter["p99_ms"],
+            "jitter_max_ms": jitter["max_ms"],
+        }
@@ -0,0 +1,388 @@
+"""PGM frames over shared memory for a separate output process.
+
+The writer (SharedMemoryFrameSink, the "shm" engine sink) owns a
+multiprocessing.shared_memory block laid out as a file header followed by N
+frame slots. Each slot has a small header and room for one converted frame.
+Readers map the same block by name and view frames in place, with no
+pickling and no copy. Each published frame is announced with an 8-byte UDP
+datagram on localhost carrying its sequence number, so a reader can sleep
+in `wait` instead of polling. The reader binds any free port and records it
+in the file header, where the writer looks it up, so every block has its
+own port and several converters can run side by side.
+
+The header also holds the writer's pid and a closed flag. A writer that
+replaces its block (the engine rebuilds the sink on a format change) sets
+the flag before unlinking the old one, and readers re-attach to the new
+block of the same name, picking up its geometry.
+
+The writer's pid is kept too. A new writer reuses a block of the same name
+only if its owner has died without unlinking it; while that writer runs
+(even with the converter paused) the block is never taken over.
+
+Slots are published seqlock-style: the writer zeroes the slot's sequence
+number, writes the data and header, then stores the new sequence number.
+A reader that finds the same non-zero sequence number before and after using
+the data knows the slot was not overwritten meanwhile.
+
+Run `python -m shm_sink --name NAME` as a stand-in output process that
+reports frame rate and handoff latency.
+"""
+import argparse
+import ctypes
+import os
+import select
+import socket
+import struct
+import sys
+import time
+from collections import namedtuple
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from convert import line_stride
+from formats import parse_format
+
+MAGIC = b"SCPG"
+VERSION = 3
+DEFAULT_NAME = "scanconverter_pgm"
+
+# magic, version, slots, slot size, width, height, stride, pixel format,
+# format name, writer pid, closed flag, reader notification port, latest
+# published sequence number.
+FILE_HEADER = struct.Struct("<4sIIQIIII32sIIIQ")
+LATEST_OFFSET = FILE_HEADER.size - 8
+PORT_OFFSET = LATEST_OFFSET - 4
+CLOSED_OFFSET = PORT_OFFSET - 4
+# How often a reader whose block was closed looks for its replacement.
+REATTACH_INTERVAL = 0.1
+# sequence number, capture timestamp, publish timestamp, data length.
+SLOT_HEADER = struct.Struct("<QddQ")
+SLOT_DATA_OFFSET = 64
+
+PIXEL_FORMAT_CODES = {"uyvy": 1, "v210": 2}
+PIXEL_FORMAT_NAMES = {code: name for name, code in PIXEL_FORMAT_CODES.items()}
+
+SharedFrame = namedtuple("SharedFrame", ["seq", "timestamp", "published", "data"])
+
+
+def _pid_alive(pid):
+    if sys.platform == "win32":
+        # os.kill would terminate the process on Windows.
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.OpenProcess(0x1000, False, pid)  # PROCESS_QUERY_LIMITED_INFORMATION
+        if not handle:
+            return False
+        code = ctypes.c_ulong()
+        alive = kernel32.GetExitCodeProcess(handle, ctypes.byref(code)) and code.value == 259  # STILL_ACTIVE
+        kernel32.CloseHandle(handle)
+        return bool(alive)
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _live_writer(buf):
+    """Pid of the running writer that owns a block, or None if it is left over."""
+    if len(buf) < FILE_HEADER.size:
+        return None
+    header = FILE_HEADER.unpack_from(buf, 0)
+    magic, version, pid = header[0], header[1], header[9]
+    if magic != MAGIC:
+        raise FileExistsError("A shared memory block of that name exists and is not a PGM frame ring")
+    # Older layouts carry no pid; treat them as left over, as are blocks the
+    # writer closed but could not unlink.
+    if version != VERSION or header[10] or not _pid_alive(pid):
+        return None
+    return pid
+
+
+def _slot_size(height, stride):
+    # Keep slots 4 KiB aligned so frame data starts on page boundaries.
+    return (SLOT_DATA_OFFSET + height * stride + 4095) // 4096 * 4096
+
+
+class SharedMemoryFrameSink:
+    """Engine sink that publishes converted frames into shared memory.
+
+    Raises FileExistsError if another running writer owns the block `name`.
+    """
+
+    def __init__(self, video_format, pixel_format, name=DEFAULT_NAME, slots=4):
+        if isinstance(video_format, str):
+            video_format = parse_format(video_format)
+        self.format = video_format
+        self.pixel_format = pixel_format
+        self.slots = slots
+        self._shm = None
+        self._slot_size = None
+        self._seq = 0
+        self.frames = 0
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._name = name
+        # Created up front so an output process can attach before PGM starts.
+        self._open(video_format.height, line_stride(video_format.width, pixel_format))
+
+    def _open(self, height, stride):
+        self._slot_size = _slot_size(height, stride)
+        size = FILE_HEADER.size + self.slots * self._slot_size
+        try:
+            self._shm = shared_memory.SharedMemory(self._name, create=True, size=size)
+        except FileExistsError:
+            existing = _attach(self._name)
+            try:
+                pid = _live_writer(existing.buf)
+            finally:
+                existing.close()
+            if pid is not None:
+                self._sock.close()
+                raise FileExistsError(f"Shared memory block {self._name!r} is in use by a running converter "
+                                      f"(pid {pid}); give this one another name")
+            # Left behind by a writer that did not shut down cleanly.
+            existing = shared_memory.SharedMemory(self._name)
+            existing.close()
+            existing.unlink()
+            self._shm = shared_memory.SharedMemory(self._name, create=True, size=size)
+        FILE_HEADER.pack_into(
+            self._shm.buf, 0, MAGIC, VERSION, self.slots, self._slot_size,
+            self.format.width, height, stride, PIXEL_FORMAT_CODES[self.pixel_format],
+            self.format.name.encode(), os.getpid(), 0, 0, 0)
+
+    def _slot_offset(self, seq):
+        return FILE_HEADER.size + (seq % self.slots) * self._slot_size
+
+    def __call__(self, output, frame):
+        self._seq += 1
+        seq = self._seq
+        offset = self._slot_offset(seq)
+        buf = self._shm.buf
+        struct.pack_into("<Q", buf, offset, 0)
+        dst = np.ndarray(output.shape, dtype=np.uint8, buffer=buf, offset=offset + SLOT_DATA_OFFSET)
+        np.copyto(dst, output)
+        SLOT_HEADER.pack_into(buf, offset, 0, frame.timestamp, time.monotonic(), output.nbytes)
+        struct.pack_into("<Q", buf, offset, seq)
+        struct.pack_into("<Q", buf, LATEST_OFFSET, seq)
+        self.frames += 1
+        port = struct.unpack_from("<I", buf, PORT_OFFSET)[0]
+        if port:
+            try:
+                self._sock.sendto(struct.pack("<Q", seq), ("127.0.0.1", port))
+            except OSError:
+                pass  # The reader went away; a new one registers again.
+
+    def close(self):
+        if self._shm is not None:
+            # Readers still mapping the block look for its replacement; wake
+            # a waiting one so it notices.
+            struct.pack_into("<I", self._shm.buf, CLOSED_OFFSET, 1)
+            port = struct.unpack_from("<I", self._shm.buf, PORT_OFFSET)[0]
+            if port:
+                try:
+                    self._sock.sendto(struct.pack("<Q", 0), ("127.0.0.1", port))
+                except OSError:
+                    pass
+        self._sock.close()
+        if self._shm is not None:
+            self._shm.close()
+            self._shm.unlink()
+            self._shm = None
+
+
+def _attach(name):
+    shm = shared_memory.SharedMemory(name)
+    # Before Python 3.13 attaching registers the block with this process's
+    # resource tracker, which would unlink it when the reader exits.
+    try:
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(shm._name, "shared_memory")
+    except Exception:
+        pass
+    return shm
+
+
+class SharedMemoryFrameReader:
+    """Reads frames published by a SharedMemoryFrameSink in another process.
+
+    The reader is notified of new frames on `notify_port` (0 for any free
+    port), which it registers in the block for the writer to send to. Only
+    one reader per block can be notified; others pass None and poll.
+
+    When the writer closes the block and a new one of the same name appears
+    (a format change), the reader moves to it: geometry and format are
+    updated, sequence numbers start again and `reattaches` is incremented.
+    """
+
+    def __init__(self, name=DEFAULT_NAME, notify_port=0):
+        self.name = name
+        self._shm = None
+        self._retired = []
+        self._closed = False
+        self.reattaches = 0
+        self._map(_attach(name))
+        self._sock = None
+        self.notify_port = None
+        if notify_port is not None:
+            self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self._sock.bind(("127.0.0.1", notify_port))
+            self._sock.setblocking(False)
+            self.notify_port = self._sock.getsockname()[1]
+            struct.pack_into("<I", self._shm.buf, PORT_OFFSET, self.notify_port)
+        self.last_seq = 0
+
+    def _map(self, shm):
+        (magic, version, slots, slot_size, width, height, stride, code, fmt,
+         *_) = FILE_HEADER.unpack_from(shm.buf, 0)
+        if magic != MAGIC or version != VERSION:
+            shm.close()
+            raise ValueError(f"Shared memory block {self.name!r} is not a PGM frame ring")
+        self._shm = shm
+        self.slots, self.slot_size = slots, slot_size
+        self.width, self.height, self.stride = width, height, stride
+        self.pixel_format = PIXEL_FORMAT_NAMES[code]
+        self.format_name = fmt.rstrip(b"\0").decode()
+
+    def _reattach(self):
+        """Move to the block that replaced a closed one; False if none yet."""
+        try:
+            shm = _attach(self.name)
+        except FileNotFoundError:
+            return False
+        if struct.unpack_from("<I", shm.buf, CLOSED_OFFSET)[0]:
+            shm.close()  # Still the old block, not unlinked yet.
+            return False
+        old = self._shm
+        try:
+            self._map(shm)
+        except ValueError:
+            return False
+        self._retire(old)
+        if self._sock is not None:
+            struct.pack_into("<I", self._shm.buf, PORT_OFFSET, self.notify_port)
+        self._closed = False
+        self.last_seq = 0
+        self.reattaches += 1
+        return True
+
+    def _retire(self, shm):
+        try:
+            shm.close()
+        except BufferError:
+            # Frames read earlier still view it; close it with the reader.
+            self._retired.append(shm)
+
+    def latest_seq(self):
+        if struct.unpack_from("<I", self._shm.buf, CLOSED_OFFSET)[0]:
+            self._closed = True
+            self._reattach()
+        return struct.unpack_from("<Q", self._shm.buf, LATEST_OFFSET)[0]
+
+    def _slot_offset(self, seq):
+        return FILE_HEADER.size + (seq % self.slots) * self.slot_size
+
+    def is_valid(self, frame):
+        """True if `frame`'s slot has not been overwritten since it was read."""
+        if frame.data.base is not self._shm.buf.obj:
+            return False  # Read from a block the reader has since left.
+        return struct.unpack_from("<Q", self._shm.buf, self._slot_offset(frame.seq))[0] == frame.seq
+
+    def read(self, seq=None):
+        """View the frame `seq` (default: latest) in place, or None if gone.
+
+        The returned data aliases the shared block; check `is_valid` after
+        using it, or copy it, since the writer reuses the slot N frames later.
+        """
+        if seq is None:
+            seq = self.latest_seq()
+        if not seq:
+            return None
+        offset = self._slot_offset(seq)
+        slot_seq, timestamp, published, length = SLOT_HEADER.unpack_from(self._shm.buf, offset)
+        if slot_seq != seq:
+            return None
+        data = np.ndarray((self.height, self.stride), dtype=np.uint8, buffer=self._shm.buf,
+                          offset=offset + SLOT_DATA_OFFSET)
+        self.last_seq = seq
+        return SharedFrame(seq, timestamp, published, data)
+
+    def wait(self, timeout=None):
+        """Wait for a frame newer than the last one read and view it."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            seq = self.latest_seq()
+            if seq > self.last_seq:
+                frame = self.read(seq)
+                if frame is not None:
+                    return frame
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return None
+            if self._sock is None:
+                time.sleep(0.001)
+                continue
+            if self._closed:
+                # No notifications come until the replacement block exists.
+                remaining = REATTACH_INTERVAL if remaining is None else min(remaining, REATTACH_INTERVAL)
+            if select.select([self._sock], [], [], remaining)[0]:
+                # Drain every queued notification; only the newest matters.
+                try:
+                    while True:
+                        self._sock.recv(8)
+                except (BlockingIOError, OSError):
+                    pass
+
+    def close(self):
+        if self._sock is not None:
+            if struct.unpack_from("<I", self._shm.buf, PORT_OFFSET)[0] == self.notify_port:
+                struct.pack_into("<I", self._shm.buf, PORT_OFFSET, 0)
+            self._sock.close()
+            self._sock = None
+        for shm in self._retired:
+            shm.close()
+        self._retired = []
+        self._shm.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m shm_sink", description="Stand-in PGM output process")
+    parser.add_argument("--name", default=DEFAULT_NAME)
+    parser.add_argument("--port", type=int, default=0, help="notification port (default: any free port)")
+    parser.add_argument("--duration", type=float, default=10.0)
+    args = parser.parse_args(argv)
+
+    reader = SharedMemoryFrameReader(args.name, args.port)
+    print(f"Reading {reader.format_name} {reader.pixel_format} from {args.name!r}")
+    frames = skipped = 0
+    latencies = []
+    started = time.monotonic()
+    last_seq = None
+    reattaches = 0
+    try:
+        while time.monotonic() - started < args.duration:
+            frame = reader.wait(timeout=1.0)
+            if frame is None:
+                continue
+            if reader.reattaches != reattaches:
+                reattaches = reader.reattaches
+                last_seq = None
+                print(f"Re-attached: {reader.format_name} {reader.pixel_format}")
+            latencies.append(time.monotonic() - frame.published)
+            if last_seq is not None:
+                skipped += frame.seq - last_seq - 1
+            last_seq = frame.seq
+            frames += 1
+    finally:
+        reader.close()
+    elapsed = time.monotonic() - started
+    if latencies:
+        lat = np.array(latencies) * 1000
+        print(f"{frames / elapsed:.1f} fps, {skipped} skipped, handoff latency "
+              f"p50 {np.percentile(lat, 50):.2f} ms p99 {np.percentile(lat, 99):.2f} ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
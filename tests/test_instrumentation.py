@@ -0,0 +1,37 @@
+import time
+from collections import Counter
+
+from benchmarks import FakeSoundDevice, SyntheticSource
+from engine import ScanConverterEngine
+from instrumentation import prometheus_text
+
+
+def _series(text):
+    return [line.rsplit(" ", 1)[0] for line in text.splitlines() if line and not line.startswith("#")]
+
+
+def test_nested_sequences_get_distinct_labels():
+    series = _series(prometheus_text({"audio": {"routes": [(0, 0, 1.0), (0, 1, 1.0)]}}))
+    assert len(series) == len(set(series)) == 6
+
+
+def test_engine_stats_have_no_duplicate_series():
+    fake = FakeSoundDevice()
+    engine = ScanConverterEngine(video_format="1280x720 50p", audio_backend=fake,
+                                 source=SyntheticSource(640, 360), workers=1)
+    engine.set_audio_channels(8)
+    input_info, output_info, _ = fake.query_devices()
+    try:
+        engine.start()
+        engine.start_program("null")
+        assert engine.start_audio(input_info, output_info)
+        engine.audio_matrix.route_pair((0, 1), 2)
+        fake.run(1.0)
+        time.sleep(0.3)
+        stats = engine.stats()
+        histograms = engine.histograms()
+    finally:
+        engine.close()
+    assert "audio" in stats and "avsync" in stats
+    counts = Counter(_series(prometheus_text(stats, histograms)))
+    assert [name for name, n in counts.items() if n > 1] == []